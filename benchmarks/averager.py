@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+################################################################################
+# Copyright (c) 2018, National Research Foundation (Square Kilometre Array)
+#
+# Licensed under the BSD 3-Clause License (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+################################################################################
+
+"""Benchmark the parallel axes of :func:`katdal.averager._average_visibilities`.
+
+This times averaging along each candidate parallel axis (time, channel and
+baseline block) for a number of MeerKAT-like shapes, next to the axis that
+:func:`katdal.averager._parallel_axis` picks automatically. The thread count
+is taken from numba, so compare runs like::
+
+  for n in 1 2 4 8; do NUMBA_NUM_THREADS=$n python benchmarks/averager.py; done
+
+Use `--bl-step` and `--min-iterations` to try other values of the
+:data:`katdal.averager.BL_STEP` and `MIN_ITERATIONS_PER_THREAD` constants.
+"""
+
+from __future__ import print_function
+
+from common import argument_parser, best_time, report_threads
+
+
+# Input shape (dumps, channels, correlation products) and (timeav, chanav)
+CASES = [
+    ((8, 4096, 544), (1, 256)),     # 16 antennas, 4096 -> 16 channels
+    ((8, 4096, 544), (1, 8)),       # 16 antennas, mild channel averaging
+    ((64, 1024, 544), (8, 64)),     # 16 antennas, long block of dumps
+    ((2, 4096, 8320), (2, 1024)),   # 64 antennas, heavy averaging in both
+    ((1, 32768, 272), (1, 8)),      # 8 antennas, 32K mode
+]
+AXES = ('time', 'channel', 'baseline')
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument('--bl-step', type=int, help='Override BL_STEP (baselines per block)')
+    parser.add_argument('--min-iterations', type=int, help='Override MIN_ITERATIONS_PER_THREAD')
+    args = parser.parse_args()
+
+    from katdal import averager
+    from katdal.test.test_averager import random_visibilities
+    # Numba freezes global constants on compilation, so override them first
+    if args.bl_step:
+        averager.BL_STEP = args.bl_step
+    if args.min_iterations:
+        averager.MIN_ITERATIONS_PER_THREAD = args.min_iterations
+    n_threads = report_threads()
+    print('BL_STEP = {}, MIN_ITERATIONS_PER_THREAD = {}'
+          .format(averager.BL_STEP, averager.MIN_ITERATIONS_PER_THREAD))
+    for shape, (timeav, chanav) in CASES:
+        vis, weight, flag = random_visibilities(shape)
+        auto = averager._parallel_axis(shape[0] // timeav, shape[1] // chanav, shape[2], n_threads)
+        times = [best_time(lambda: averager._average_visibilities(vis, weight, flag,
+                                                                  timeav, chanav, False, axis),
+                           args.repeats)
+                 for axis in range(len(AXES))]
+        best = min(range(len(AXES)), key=lambda axis: times[axis])
+        print('{} averaged by {}: {} -> auto picks {} ({:.2f}x best)'
+              .format(shape, (timeav, chanav),
+                      ', '.join('{} {:.3f} s'.format(name, t) for name, t in zip(AXES, times)),
+                      AXES[auto], times[auto] / times[best]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+################################################################################
+# Copyright (c) 2018, National Research Foundation (Square Kilometre Array)
+#
+# Licensed under the BSD 3-Clause License (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+################################################################################
+
+"""Helpers shared by the katdal benchmark scripts."""
+
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import timeit
+
+
+def argument_parser(doc):
+    """Command-line parser with the options common to all benchmarks.
+
+    Parameters
+    ----------
+    doc : string
+        Module docstring of benchmark script, whose first line describes it
+
+    Returns
+    -------
+    parser : :class:`argparse.ArgumentParser` object
+        Parser that can be extended with benchmark-specific options
+    """
+    parser = argparse.ArgumentParser(description=doc.splitlines()[0])
+    parser.add_argument('--repeats', type=int, default=3, help='Number of timing repeats per case')
+    return parser
+
+
+def best_time(func, repeats, warmup=True):
+    """Best wall-clock time of `repeats` calls to `func`, in seconds.
+
+    An extra untimed call is made first if `warmup` is True, to trigger any
+    numba compilation or caching before the timing starts.
+    """
+    if warmup:
+        func()
+    return min(timeit.Timer(func).repeat(repeats, 1))
+
+
+def report_threads():
+    """Print the numba thread count and warn if it oversubscribes the CPUs."""
+    import numba
+    n_threads = numba.config.NUMBA_NUM_THREADS
+    n_cpus = multiprocessing.cpu_count()
+    print('Using {} numba threads on {} CPUs (set NUMBA_NUM_THREADS to change)'.format(n_threads, n_cpus))
+    if n_threads > n_cpus:
+        print('WARNING: threads oversubscribe CPUs, so timings only show parallel overheads')
+    return n_threads
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+################################################################################
+# Copyright (c) 2018, National Research Foundation (Square Kilometre Array)
+#
+# Licensed under the BSD 3-Clause License (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+################################################################################
+
+"""Benchmark :func:`katdal.ms_async.permute_baselines` against the original kernel.
+
+This reports the throughput of both kernels, in MB of input visibilities,
+weights and flags per second, for MeerKAT-like shapes. The thread count is
+taken from numba, so compare runs like::
+
+  for n in 1 2 4 8; do NUMBA_NUM_THREADS=$n python benchmarks/permute.py; done
+
+Use `--bl-step` and `--chan-step` to try other tile sizes than
+:data:`katdal.ms_async.PERMUTE_BL_STEP` and `PERMUTE_CHAN_STEP`.
+"""
+
+from __future__ import print_function
+
+import numpy as np
+import numba
+
+from common import argument_parser, best_time, report_threads
+
+
+@numba.jit(nopython=True, parallel=True)
+def original_permute_baselines(in_vis, in_weights, in_flags, cp_index, out_vis, out_weights, out_flags):
+    """The kernel previously found in mvftoms.py, for comparison."""
+    in_flags_u8 = in_flags.view(np.uint8)
+    n_time, n_bls, n_chans, n_pols = out_vis.shape
+    bstep = 128
+    bblocks = (n_bls + bstep - 1) // bstep
+    for t in range(n_time):
+        for bblock in numba.prange(bblocks):
+            bstart = bblock * bstep
+            bstop = min(n_bls, bstart + bstep)
+            for c in range(n_chans):
+                for b in range(bstart, bstop):
+                    for p in range(out_vis.shape[3]):
+                        idx = cp_index[b, p]
+                        if idx >= 0:
+                            vis = in_vis[t, c, idx]
+                            weight = in_weights[t, c, idx]
+                            flag = in_flags_u8[t, c, idx] != 0
+                        else:
+                            vis = np.complex64(0 + 0j)
+                            weight = np.float32(0)
+                            flag = np.bool_(True)
+                        out_vis[t, b, c, p] = vis
+                        out_weights[t, b, c, p] = weight
+                        out_flags[t, b, c, p] = flag
+    return out_vis, out_weights, out_flags
+
+
+def cp_index_for(n_ants):
+    """Baseline-pol index into products ordered as ingest does (with autos)."""
+    n_bls = n_ants * (n_ants + 1) // 2
+    return np.arange(4 * n_bls).reshape(n_bls, 4)
+
+
+# Number of dumps, channels and antennas
+CASES = [(1, 4096, 16), (8, 1024, 16), (1, 1024, 64), (2, 32768, 4), (1, 32768, 8), (1, 32768, 16)]
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument('--bl-step', type=int, help='Override PERMUTE_BL_STEP (baselines per tile)')
+    parser.add_argument('--chan-step', type=int, help='Override PERMUTE_CHAN_STEP (channels per tile)')
+    args = parser.parse_args()
+
+    from katdal import ms_async
+    from katdal.test.test_ms_async import random_products
+    # Numba freezes global constants on compilation, so override them first
+    if args.bl_step:
+        ms_async.PERMUTE_BL_STEP = args.bl_step
+    if args.chan_step:
+        ms_async.PERMUTE_CHAN_STEP = args.chan_step
+    report_threads()
+    print('PERMUTE_BL_STEP = {}, PERMUTE_CHAN_STEP = {}'
+          .format(ms_async.PERMUTE_BL_STEP, ms_async.PERMUTE_CHAN_STEP))
+    for n_time, n_chans, n_ants in CASES:
+        cp_index = cp_index_for(n_ants)
+        inputs = random_products((n_time, n_chans, cp_index.size))
+        outputs = [np.empty((n_time,) + cp_index.shape[:1] + (n_chans, 4), x.dtype) for x in inputs]
+        kernel_args = inputs + (cp_index,) + tuple(outputs)
+        megabytes = sum(x.nbytes for x in inputs) / 1e6
+        rates = [megabytes / best_time(lambda: kernel(*kernel_args), args.repeats)
+                 for kernel in (original_permute_baselines, ms_async.permute_baselines)]
+        print('{} dumps x {} channels x {} antennas: original {:.0f} MB/s, current {:.0f} MB/s ({:.2f}x)'
+              .format(n_time, n_chans, n_ants, rates[0], rates[1], rates[1] / rates[0]))
+
+
+if __name__ == '__main__':
+    main()
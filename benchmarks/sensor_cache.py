@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+################################################################################
+# Copyright (c) 2018, National Research Foundation (Square Kilometre Array)
+#
+# Licensed under the BSD 3-Clause License (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+################################################################################
+
+"""Benchmark virtual sensor lookup in :class:`katdal.SensorCache`.
+
+This matches thousands of per-antenna and per-baseline virtual sensor names
+against the standard virtual sensor templates, both one template at a time
+(the original lookup) and via the combined :class:`VirtualSensorTable`
+pattern. It also times the first access of all these sensors through
+:meth:`SensorCache.get`, where the sensor calculations themselves are trivial.
+"""
+
+from __future__ import print_function
+
+import re
+
+import numpy as np
+
+from katdal.dataset import DEFAULT_SENSOR_PROPS, DEFAULT_VIRTUAL_SENSORS
+from katdal.sensordata import SensorCache, VirtualSensorTable, dummy_sensor_data
+
+from common import argument_parser, best_time
+
+
+def _calc_dummy(cache, name, **kwargs):
+    """Virtual sensor that is cheap to calculate."""
+    cache[name] = data = dummy_sensor_data(name, 0.0)
+    return data
+
+
+def _match_per_template(templates, name):
+    """Original lookup: convert and match each template in turn."""
+    for template in templates:
+        pattern = re.sub(r'({[a-zA-Z_]\w*})', lambda m: '(?P<' + m.group(0)[1:-1] + '>[^//]+)', template)
+        match = re.match(pattern, name)
+        if match:
+            return template, match.groupdict()
+    return None, {}
+
+
+def sensor_names(n_ants):
+    """Per-antenna and per-baseline virtual sensor names for an array."""
+    ants = ['m%03d' % (n,) for n in range(n_ants)]
+    names = ['Antennas/%s/%s' % (ant, coord) for ant in ants for coord in ('ra', 'dec', 'parangle', 'lst')]
+    names += ['Antennas/%s/%s_%s' % (antA, coord, antB)
+              for n, antA in enumerate(ants) for antB in ants[n + 1:] for coord in 'uvw']
+    return names
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument('--ants', type=int, default=32, help='Number of antennas')
+    args = parser.parse_args()
+    names = sensor_names(args.ants)
+    virtual = dict((template, _calc_dummy) for template in DEFAULT_VIRTUAL_SENSORS)
+    table = VirtualSensorTable(virtual)
+    per_template = best_time(lambda: [_match_per_template(virtual, name) for name in names], args.repeats)
+    combined = best_time(lambda: [table.match(name) for name in names], args.repeats)
+    print('Matching {} names against {} templates: per template {:.3f} s, combined {:.3f} s'
+          .format(len(names), len(virtual), per_template, combined))
+
+    def first_access():
+        cache = SensorCache({}, np.arange(10.), 1.0, props=dict(DEFAULT_SENSOR_PROPS), virtual=virtual)
+        for name in names:
+            cache.get(name)
+    total = best_time(first_access, args.repeats)
+    print('First access of {} virtual sensors via SensorCache.get: {:.3f} s ({:.1f} us per sensor)'
+          .format(len(names), total, 1e6 * total / len(names)))
+
+
+if __name__ == '__main__':
+    main()
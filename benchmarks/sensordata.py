@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+################################################################################
+# Copyright (c) 2018, National Research Foundation (Square Kilometre Array)
+#
+# Licensed under the BSD 3-Clause License (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+################################################################################
+"""Benchmark :func:`katdal.sensordata.remove_duplicates_and_invalid_values`.
+
+This times the clean-up of high-rate sensors with 10^6 - 10^7 samples
+(including some duplicate timestamps and invalid statuses) against the
+original implementation based on Python loops, which is only run once per
+size as it is slow.
+"""
+
+from __future__ import print_function
+
+import numpy as np
+
+from katdal.sensordata import RecordSensorData, remove_duplicates_and_invalid_values
+
+from common import argument_parser, best_time
+
+
+def original_remove_duplicates_and_invalid_values(sensor):
+    """The previous implementation (without logging), for comparison."""
+    x = np.atleast_1d(sensor['timestamp'])
+    y = np.atleast_1d(sensor['value'])
+    try:
+        z = np.atleast_1d(sensor['status'])
+    except ValueError:
+        z = None
+    sort_ind = np.argsort(x, kind='mergesort')
+    x, y = x[sort_ind], y[sort_ind]
+    last_of_run = np.asarray(list(np.diff(x) != 0) + [True])
+    unique_ind = last_of_run.nonzero()[0]
+    replacement = unique_ind[len(unique_ind) - np.cumsum(last_of_run[::-1])[::-1]]
+    [n for (r, n) in zip(replacement, range(len(y))) if y[r] != y[n]]
+    if z is not None:
+        [n for (r, n) in zip(replacement, range(len(z))) if z[r] != z[n]]
+        status = z[unique_ind].astype('|S7')
+        unique_ind = unique_ind[(status == 'nominal') | (status == 'warn') |
+                                (status == 'error')]
+    data = np.array(zip(x[unique_ind], y[unique_ind]),
+                    dtype=[('timestamp', x.dtype), ('value', y.dtype)])
+    return RecordSensorData(data, sensor.name)
+
+
+def high_rate_sensor(n_samples, seed=1):
+    """Sensor sampled at 10 Hz with about 1% duplicate and 1% invalid samples."""
+    rs = np.random.RandomState(seed)
+    timestamps = 1234567890. + 0.1 * np.arange(n_samples)
+    duplicates = rs.random_sample(n_samples) < 0.01
+    timestamps[duplicates] = timestamps[np.maximum(duplicates.nonzero()[0] - 1, 0)]
+    data = np.empty(n_samples, dtype=[('timestamp', np.float64), ('value', np.float64), ('status', '|S7')])
+    data['timestamp'] = timestamps
+    data['value'] = rs.standard_normal(n_samples)
+    data['status'] = np.where(rs.random_sample(n_samples) < 0.01, 'failure', 'nominal')
+    return RecordSensorData(data, 'sensor')
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10 ** 6, 10 ** 7], help='Number of samples')
+    parser.add_argument('--skip-original', action='store_true', help='Only time the current implementation')
+    args = parser.parse_args()
+    for n_samples in args.sizes:
+        sensor = high_rate_sensor(n_samples)
+        elapsed = best_time(lambda: remove_duplicates_and_invalid_values(sensor), args.repeats, warmup=False)
+        message = '{} samples: vectorised {:.3f} s'.format(n_samples, elapsed)
+        if not args.skip_original:
+            original = best_time(lambda: original_remove_duplicates_and_invalid_values(sensor), 1, warmup=False)
+            message += ', original {:.3f} s ({:.0f}x)'.format(original, original / elapsed)
+        print(message)
+
+
+if __name__ == '__main__':
+    main()
@@ -15,12 +15,68 @@
 ################################################################################
 
 from __future__ import print_function
+from collections import namedtuple
+
 import numpy as np
 import numba
+import katpoint
+
+
+# Number of baselines per block: want a block to be multiple cache lines but fit into L1
+BL_STEP = 256
+# Minimum number of parallel iterations per thread to balance the load
+MIN_ITERATIONS_PER_THREAD = 4
+# Angular velocity of the Earth's rotation, in rad/s
+EARTH_ROTATION_RATE = 7.2921150e-5
+
+
+@numba.jit(nopython=True)
+def _average_block(vis, weight, flag_u8, timeav, chanav, flagav, av_t, av_c, bstart,
+                   av_vis, av_weight, av_flag, vis_sum, vis_weight_sum, weight_sum, flag_any, flag_all):
+    """Average a single block of baselines for one output dump and channel."""
+    n_bl = vis.shape[2]
+    bstop = min(n_bl, bstart + len(vis_sum))
+    tstart = av_t * timeav
+    cstart = av_c * chanav
+    scale = weight.dtype.type(1.0 / (timeav * chanav))
+    wzero = weight.dtype.type(0)   # Zero constant of correct type
+    vis_sum[:] = 0
+    vis_weight_sum[:] = 0
+    weight_sum[:] = 0
+    flag_any[:] = False
+    flag_all[:] = True
+    for t in range(tstart, tstart + timeav):
+        for c in range(cstart, cstart + chanav):
+            for b in range(bstop - bstart):
+                b1 = b + bstart
+                v = vis[t, c, b1]
+                w = weight[t, c, b1]
+                f = (flag_u8[t, c, b1] != 0)
+                if f:
+                    # Don't simply use 0 here: it causes numba's type
+                    # inference to upgrade w from float32 to float64.
+                    w = wzero
+                flag_any[b] |= f
+                flag_all[b] &= f
+                vis_sum[b] += v
+                vis_weight_sum[b] += w * v
+                weight_sum[b] += w
+    for b in range(bstop - bstart):
+        b1 = b + bstart
+        w = np.float32(weight_sum[b])
+        # If everything is flagged/zero-weighted, use an unweighted average
+        if not w:
+            v = vis_sum[b] * scale
+        else:
+            v = vis_weight_sum[b] / w
+        f = flag_any[b] if flagav else flag_all[b]
+        av_vis[av_t, av_c, b1] = v
+        av_weight[av_t, av_c, b1] = w
+        av_flag[av_t, av_c, b1] = f
 
 
 @numba.jit(nopython=True, parallel=True)
-def _average_visibilities(vis, weight, flag, timeav, chanav, flagav):
+def _average_visibilities(vis, weight, flag, timeav, chanav, flagav, axis=1):
     # Workaround for https://github.com/numba/numba/issues/2921
     flag_u8 = flag.view(np.uint8)
 
@@ -28,6 +84,7 @@ def _average_visibilities(vis, weight, flag, timeav, chanav, flagav):
     n_time, n_chans, n_bl = vis.shape
     av_n_time = n_time // timeav
     av_n_chans = n_chans // chanav
+    av_n_blocks = (n_bl + BL_STEP - 1) // BL_STEP
     av_shape = (av_n_time, av_n_chans, n_bl)
 
     # Allocate output buffers
@@ -35,58 +92,178 @@ def _average_visibilities(vis, weight, flag, timeav, chanav, flagav):
     av_weight = np.empty(av_shape, weight.dtype)
     av_flag = np.empty(av_shape, flag.dtype)
 
+    # Parallelise over the requested axis of (time, channel, baseline block)
+    # and loop over the other two axes in order within each iteration.
+    n_blocks = (av_n_time, av_n_chans, av_n_blocks)
+    n_outer = n_blocks[axis]
+    n_inner = av_n_time * av_n_chans * av_n_blocks // n_outer if n_outer else 0
+    for i in numba.prange(0, n_outer):
+        vis_sum = np.empty(BL_STEP, vis.dtype)
+        vis_weight_sum = np.empty(BL_STEP, vis.dtype)
+        weight_sum = np.empty(BL_STEP, weight.dtype)
+        flag_any = np.empty(BL_STEP, np.bool_)
+        flag_all = np.empty(BL_STEP, np.bool_)
+        for j in range(n_inner):
+            if axis == 0:
+                av_t = i
+                av_c, block = divmod(j, av_n_blocks)
+            elif axis == 1:
+                av_c = i
+                av_t, block = divmod(j, av_n_blocks)
+            else:
+                block = i
+                av_t, av_c = divmod(j, av_n_chans)
+            _average_block(vis, weight, flag_u8, timeav, chanav, flagav, av_t, av_c, block * BL_STEP,
+                           av_vis, av_weight, av_flag, vis_sum, vis_weight_sum, weight_sum, flag_any, flag_all)
+    return av_vis, av_weight, av_flag
+
+
+def _parallel_axis(av_n_time, av_n_chans, n_bl, n_threads=None):
+    """Pick axis of averaged output to parallelise over.
+
+    The candidates are channels, time and blocks of baselines, in that order
+    of preference (since the time axis is often short, e.g. 1). The first
+    candidate with enough iterations to keep all threads busy is chosen,
+    otherwise the one with the most iterations.
+
+    Parameters
+    ----------
+    av_n_time, av_n_chans, n_bl : int
+        Shape of averaged output
+    n_threads : int, optional
+        Number of threads available (default is numba's thread count)
+
+    Returns
+    -------
+    axis : {0, 1, 2}
+        Index of parallel axis in (time, channel, baseline block)
+    """
+    if n_threads is None:
+        n_threads = numba.config.NUMBA_NUM_THREADS
+    n_blocks = (av_n_time, av_n_chans, (n_bl + BL_STEP - 1) // BL_STEP)
+    for axis in (1, 0, 2):
+        if n_blocks[axis] >= MIN_ITERATIONS_PER_THREAD * n_threads:
+            return axis
+    return max((1, 0, 2), key=lambda axis: n_blocks[axis])
+
+
+@numba.jit(nopython=True, parallel=True)
+def _average_and_permute(vis, weight, flag, timeav, chanav, flagav, cp_index, out_vis, out_weight, out_flag):
+    # Workaround for https://github.com/numba/numba/issues/2921
+    flag_u8 = flag.view(np.uint8)
+    out_flag_u8 = out_flag.view(np.uint8)
+
+    av_n_time, n_bl, av_n_chans, n_pol = out_vis.shape
     scale = weight.dtype.type(1.0 / (timeav * chanav))
     wzero = weight.dtype.type(0)   # Zero constant of correct type
-
-    bl_step = 128      # Want a chunk to be multiple cache lines but into L1
-    # We put channel as the outer loop just because it's more likely than
-    # time to get parallel speedup with prange (since the time axis is often
-    # short e.g. 1).
-    for av_c in numba.prange(0, av_n_chans):
-        cstart = av_c * chanav
-        vis_sum = np.empty(bl_step, vis.dtype)
-        vis_weight_sum = np.empty(bl_step, vis.dtype)
-        weight_sum = np.empty(bl_step, weight.dtype)
-        flag_any = np.empty(bl_step, np.bool_)
-        flag_all = np.empty(bl_step, np.bool_)
-        for av_t in range(0, av_n_time):
-            tstart = av_t * timeav
-            for bstart in range(0, n_bl, bl_step):
-                bstop = min(n_bl, bstart + bl_step)
-                vis_sum[:] = 0
-                vis_weight_sum[:] = 0
-                weight_sum[:] = 0
-                flag_any[:] = False
-                flag_all[:] = True
-                for t in range(tstart, tstart + timeav):
-                    for c in range(cstart, cstart + chanav):
-                        for b in range(bstop - bstart):
-                            b1 = b + bstart
-                            v = vis[t, c, b1]
-                            w = weight[t, c, b1]
-                            f = (flag_u8[t, c, b1] != 0)
+    vzero = vis.dtype.type(0)
+    bl_step = max(BL_STEP // n_pol, 1)
+    n_blocks = (n_bl + bl_step - 1) // bl_step
+    # Parallelise over both averaged dumps and blocks of output baselines,
+    # since either may be short
+    for i in numba.prange(0, av_n_time * n_blocks):
+        av_t, block = divmod(i, n_blocks)
+        tstart = av_t * timeav
+        bstart = block * bl_step
+        bstop = min(n_bl, bstart + bl_step)
+        vis_sum = np.empty((bl_step, n_pol), vis.dtype)
+        vis_weight_sum = np.empty((bl_step, n_pol), vis.dtype)
+        weight_sum = np.empty((bl_step, n_pol), weight.dtype)
+        flag_any = np.empty((bl_step, n_pol), np.bool_)
+        flag_all = np.empty((bl_step, n_pol), np.bool_)
+        for av_c in range(av_n_chans):
+            cstart = av_c * chanav
+            vis_sum[:] = 0
+            vis_weight_sum[:] = 0
+            weight_sum[:] = 0
+            flag_any[:] = False
+            flag_all[:] = True
+            for t in range(tstart, tstart + timeav):
+                for c in range(cstart, cstart + chanav):
+                    for b in range(bstop - bstart):
+                        for p in range(n_pol):
+                            idx = cp_index[b + bstart, p]
+                            if idx < 0:
+                                continue
+                            v = vis[t, c, idx]
+                            w = weight[t, c, idx]
+                            f = (flag_u8[t, c, idx] != 0)
                             if f:
-                                # Don't simply use 0 here: it causes numba's type
-                                # inference to upgrade w from float32 to float64.
                                 w = wzero
-                            flag_any[b] |= f
-                            flag_all[b] &= f
-                            vis_sum[b] += v
-                            vis_weight_sum[b] += w * v
-                            weight_sum[b] += w
-                for b in range(bstop - bstart):
-                    b1 = b + bstart
-                    w = np.float32(weight_sum[b])
+                            flag_any[b, p] |= f
+                            flag_all[b, p] &= f
+                            vis_sum[b, p] += v
+                            vis_weight_sum[b, p] += w * v
+                            weight_sum[b, p] += w
+            for b in range(bstop - bstart):
+                b1 = b + bstart
+                for p in range(n_pol):
+                    if cp_index[b1, p] < 0:
+                        # Missing products are zero and flagged
+                        out_vis[av_t, b1, av_c, p] = vzero
+                        out_weight[av_t, b1, av_c, p] = wzero
+                        out_flag_u8[av_t, b1, av_c, p] = 1
+                        continue
+                    w = np.float32(weight_sum[b, p])
                     # If everything is flagged/zero-weighted, use an unweighted average
                     if not w:
-                        v = vis_sum[b] * scale
+                        v = vis_sum[b, p] * scale
                     else:
-                        v = vis_weight_sum[b] / w
-                    f = flag_any[b] if flagav else flag_all[b]
-                    av_vis[av_t, av_c, b1] = v
-                    av_weight[av_t, av_c, b1] = w
-                    av_flag[av_t, av_c, b1] = f
-    return av_vis, av_weight, av_flag
+                        v = vis_weight_sum[b, p] / w
+                    f = flag_any[b, p] if flagav else flag_all[b, p]
+                    out_vis[av_t, b1, av_c, p] = v
+                    out_weight[av_t, b1, av_c, p] = w
+                    out_flag_u8[av_t, b1, av_c, p] = f
+
+
+def average_and_permute(vis, weight, flag, cp_index, out_vis, out_weight, out_flag,
+                        timeav=10, chanav=8, flagav=False):
+    """Average visibilities, flags and weights and reorder baselines in one pass.
+
+    This performs the same averaging as :func:`average_visibilities` but
+    writes the result directly into existing output arrays with dimensions
+    (time, baseline, channel, pol), as used for Measurement Sets. This avoids
+    allocating intermediate averaged arrays and writing the data twice. The
+    averaging factors and the shape of the output determine how much of the
+    input is used (leftover dumps and channels are discarded).
+
+    Parameters
+    ----------
+    vis : array of complex64, shape (*T*, *F*, *P*)
+        The input visibilities to be averaged, with all correlation products
+    weight : array of float32, shape (*T*, *F*, *P*)
+        The input weights (used for weighted averaging)
+    flag : array of bool, shape (*T*, *F*, *P*)
+        The input flags (flagged data have weight zero before averaging)
+    cp_index : array of int, shape (*B*, *npol*)
+        Input correlation product index for each output baseline and
+        polarisation (negative for missing products, which are zeroed and
+        flagged in the output)
+    out_vis, out_weight, out_flag : arrays, shape (*T* // `timeav`, *B*, *F* // `chanav`, *npol*)
+        Output arrays (e.g. shared memory slots) with same dtypes as inputs
+    timeav : int, optional
+        The desired averaging size in dumps
+    chanav : int, optional
+        The desired averaging size in channels
+    flagav : bool, optional
+        Flag averaged data if any (instead of all) data in the bin is flagged
+
+    Returns
+    -------
+    out_vis, out_weight, out_flag : arrays
+        The output arrays, for convenience
+
+    Raises
+    ------
+    ValueError
+        If the output shape does not match the input and averaging factors
+    """
+    n_time, n_chans, n_prods = vis.shape
+    expected = (n_time // timeav, cp_index.shape[0], n_chans // chanav, cp_index.shape[1])
+    if out_vis.shape != expected or out_weight.shape != expected or out_flag.shape != expected:
+        raise ValueError('Output arrays should have shape {}, not {}'.format(expected, out_vis.shape))
+    _average_and_permute(vis, weight, flag, timeav, chanav, flagav, cp_index, out_vis, out_weight, out_flag)
+    return out_vis, out_weight, out_flag
 
 
 def average_visibilities(vis, weight, flag, timestamps, channel_freqs, timeav=10, chanav=8, flagav=False):
@@ -101,7 +278,9 @@ def average_visibilities(vis, weight, flag, timestamps, channel_freqs, timeav=10
     of the input data, the remaining channels or timestamps at the end of the
     array after averaging are discarded. Channels are averaged first and the
     timestamps are second. An array of timestamps and frequencies corresponding
-    to each channel is also directly averaged and returned.
+    to each channel is also directly averaged and returned. The averaging is
+    spread over multiple threads along the output axis (channel, time or
+    baseline) with enough iterations to keep all threads busy.
 
     Inputs
     ------
@@ -146,11 +325,301 @@ def average_visibilities(vis, weight, flag, timestamps, channel_freqs, timeav=10
     channel_freqs = channel_freqs[:n_chans]
 
     # Average the data (using a numba-accelerated function)
+    axis = _parallel_axis(n_time // timeav, n_chans // chanav, n_bl)
     av_vis, av_weight, av_flag = \
-        _average_visibilities(vis, weight, flag, timeav, chanav, flagav)
+        _average_visibilities(vis, weight, flag, timeav, chanav, flagav, axis)
 
     # Average the metadata
     av_freq = np.mean(channel_freqs.reshape(-1, chanav), axis=-1)
     av_timestamps = np.mean(timestamps.reshape(-1, timeav), axis=-1)
 
     return av_vis, av_weight, av_flag, av_timestamps, av_freq
+
+
+class StreamingAverager(object):
+    """Average visibilities, weights and flags arriving in blocks of dumps.
+
+    This applies the same averaging as :func:`average_visibilities` to a
+    stream of time blocks of arbitrary size. Dumps that do not complete an
+    averaging bin are kept and combined with the next block, so that the
+    block size need not be a multiple of `timeav`. Call :meth:`flush` at the
+    end of the stream (e.g. at a scan boundary) to average the final partial
+    bin over the dumps it contains.
+
+    Parameters
+    ----------
+    channel_freqs : array of float, shape (*F*,)
+        The frequencies (in Hz) corresponding to the input channels
+    timeav : int, optional
+        The desired averaging size in dumps
+    chanav : int, optional
+        The desired averaging size in channels
+    flagav : bool, optional
+        Flag averaged data if any (instead of all) data in the bin is flagged
+    partial_chans : bool, optional
+        Average leftover channels that do not fill a whole bin into a final
+        (narrower) channel bin, instead of discarding them
+
+    Attributes
+    ----------
+    channel_freqs : array of float, shape (*F_av*,)
+        Averaged channel frequencies (in Hz)
+    """
+
+    def __init__(self, channel_freqs, timeav=10, chanav=8, flagav=False, partial_chans=False):
+        channel_freqs = np.asarray(channel_freqs)
+        n_chans = len(channel_freqs)
+        if timeav < 1 or chanav < 1:
+            raise ValueError('Averaging factors must be positive, not timeav={} and chanav={}'
+                             .format(timeav, chanav))
+        self.timeav = timeav
+        self.chanav = min(chanav, n_chans)
+        self.flagav = flagav
+        self._n_chans = n_chans
+        self._n_full_chans = n_chans // self.chanav * self.chanav
+        self.partial_chans = partial_chans and self._n_full_chans < n_chans
+        bins = [channel_freqs[:self._n_full_chans].reshape(-1, self.chanav).mean(axis=-1)]
+        if self.partial_chans:
+            bins.append(channel_freqs[self._n_full_chans:].mean(keepdims=True))
+        self.channel_freqs = np.concatenate(bins)
+        self._pending = None
+
+    def _average(self, vis, weight, flag, timestamps, timeav):
+        """Average whole number of `timeav`-sized bins in time."""
+        n_time, n_chans, n_bl = vis.shape
+        n_time = n_time // timeav * timeav
+        vis, weight, flag, timestamps = vis[:n_time], weight[:n_time], flag[:n_time], timestamps[:n_time]
+        av_n_time = n_time // timeav
+        axis = _parallel_axis(av_n_time, len(self.channel_freqs), n_bl)
+        channel_bins = [(slice(0, self._n_full_chans), self.chanav)]
+        if self.partial_chans:
+            channel_bins.append((slice(self._n_full_chans, n_chans), n_chans - self._n_full_chans))
+        outputs = [_average_visibilities(vis[:, chans], weight[:, chans], flag[:, chans],
+                                         timeav, chanav, self.flagav, axis)
+                   for chans, chanav in channel_bins]
+        av_vis, av_weight, av_flag = [np.concatenate(arrays, axis=1) if len(arrays) > 1 else arrays[0]
+                                      for arrays in zip(*outputs)]
+        av_timestamps = np.mean(timestamps.reshape(-1, timeav), axis=-1)
+        return av_vis, av_weight, av_flag, av_timestamps
+
+    def add(self, vis, weight, flag, timestamps):
+        """Add block of dumps and average all bins that are now complete.
+
+        Parameters
+        ----------
+        vis : array of complex64, shape (*T*, *F*, *B*)
+            The input visibilities to be averaged
+        weight : array of float32, shape (*T*, *F*, *B*)
+            The input weights (used for weighted averaging)
+        flag : array of bool, shape (*T*, *F*, *B*)
+            The input flags (flagged data have weight zero before averaging)
+        timestamps : array of float, shape (*T*,)
+            The timestamps corresponding to the input dumps
+
+        Returns
+        -------
+        av_vis, av_weight, av_flag : arrays, shape (*T_av*, *F_av*, *B*)
+            Averaged visibilities, weights and flags (*T_av* may be zero)
+        av_timestamps : array of float, shape (*T_av*,)
+            Averaged timestamps
+
+        Raises
+        ------
+        ValueError
+            If the block has the wrong number of channels or baselines
+        """
+        vis, weight, flag = np.asarray(vis), np.asarray(weight), np.asarray(flag)
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        if vis.shape[1] != self._n_chans:
+            raise ValueError('Expected {} channels in block, got {}'.format(self._n_chans, vis.shape[1]))
+        pending = self._pending
+        if pending is not None and pending[0].shape[2] != vis.shape[2]:
+            raise ValueError('Number of baselines changed from {} to {} without flush'
+                             .format(pending[0].shape[2], vis.shape[2]))
+        start = 0
+        outputs = []
+        if pending is not None:
+            # Complete the pending bin with the first few dumps of the block
+            start = min(self.timeav - len(pending[0]), len(vis))
+            pending = [np.concatenate([old, new[:start]])
+                       for old, new in zip(pending, (vis, weight, flag, timestamps))]
+            if len(pending[0]) == self.timeav:
+                outputs.append(self._average(*(pending + [self.timeav])))
+                pending = None
+        # Average the remaining whole bins in place and keep the leftover dumps
+        stop = start + (len(vis) - start) // self.timeav * self.timeav
+        if stop > start or not outputs:
+            outputs.append(self._average(vis[start:stop], weight[start:stop],
+                                         flag[start:stop], timestamps[start:stop], self.timeav))
+        if stop < len(vis):
+            # Copy the leftover dumps, as the caller may reuse the block buffers
+            pending = [np.array(x[stop:]) for x in (vis, weight, flag, timestamps)]
+        self._pending = pending
+        if len(outputs) == 1:
+            return outputs[0]
+        return tuple(np.concatenate(arrays) for arrays in zip(*outputs))
+
+    def flush(self):
+        """Average the final partial bin and reset the averager.
+
+        Returns
+        -------
+        av_vis, av_weight, av_flag, av_timestamps : arrays or None
+            Averaged data of partial bin (with a single dump), in the same
+            format as :meth:`add`, or None if there are no leftover dumps
+        """
+        pending, self._pending = self._pending, None
+        if pending is None:
+            return None
+        return self._average(*(pending + [len(pending[0])]))
+
+
+def baseline_averaging_factors(baseline_lengths, dump_period, channel_width, max_freq, fov_radius,
+                               tolerance=0.01, max_timeav=8, max_chanav=16):
+    r"""Per-baseline averaging factors that keep smearing within tolerance.
+
+    Averaging in time and frequency decorrelates sources away from the phase
+    centre, by an amount that grows with baseline length. For a source at
+    angular distance `fov_radius` the amplitude loss due to averaging over an
+    interval that changes its phase by up to :math:`2 \pi x` radians is
+    :math:`1 - \mathrm{sinc}(x) \approx \pi^2 x^2 / 6`, which bounds the
+    averaging interval and bandwidth per baseline. The factors are rounded
+    down to powers of two so that the bins of different baselines nest.
+
+    Parameters
+    ----------
+    baseline_lengths : array of float, shape (*B*,)
+        Lengths of baselines (e.g. maximum projected UV lengths), in metres
+    dump_period : float
+        Duration of each input dump, in seconds
+    channel_width : float
+        Width of each input channel, in Hz
+    max_freq : float
+        Highest frequency in the band (where smearing is worst), in Hz
+    fov_radius : float
+        Radius of field of interest around the phase centre, in radians
+    tolerance : float, optional
+        Maximum fractional amplitude loss of a source at the field edge
+    max_timeav, max_chanav : int, optional
+        Upper limits on the time and channel averaging factors
+
+    Returns
+    -------
+    timeav, chanav : array of int, shape (*B*,)
+        Time and channel averaging factors per baseline
+    """
+    baseline_lengths = np.abs(np.asarray(baseline_lengths, dtype=np.float64))
+    max_phase_cycles = np.sqrt(6.0 * tolerance) / np.pi
+    # Delay difference (in seconds) across the field and its rate of change
+    delay = baseline_lengths * fov_radius / katpoint.lightspeed
+    delay_rate = delay * EARTH_ROTATION_RATE
+
+    def _factor(max_span, unit, max_factor):
+        """Largest power-of-two factor whose span stays below max_span."""
+        with np.errstate(divide='ignore'):
+            factor = np.floor(np.log2(np.maximum(max_span / unit, 1.0)))
+        return np.minimum(2 ** np.minimum(factor, 62), max_factor).astype(np.int64)
+
+    with np.errstate(divide='ignore'):
+        max_interval = max_phase_cycles / (delay_rate * max_freq)
+        max_bandwidth = max_phase_cycles / delay
+    return (_factor(max_interval, dump_period, max_timeav),
+            _factor(max_bandwidth, channel_width, max_chanav))
+
+
+BaselineAveragedVisibilities = namedtuple('BaselineAveragedVisibilities', [
+    'vis', 'weight', 'flag', 'offsets', 'baseline', 'time', 'interval', 'chanav', 'channel_freqs'])
+
+
+def average_visibilities_per_baseline(vis, weight, flag, timestamps, channel_freqs, dump_period,
+                                      timeav, chanav, flagav=False):
+    """Average visibilities, flags and weights with factors per baseline.
+
+    This averages each baseline with its own time and channel factors, as
+    obtained from :func:`baseline_averaging_factors`. Each averaging block
+    is done as in :func:`average_visibilities`, except that leftover dumps at
+    the end are averaged into a final shorter bin instead of being discarded
+    (leftover channels are still discarded). Since the number of averaged
+    channels varies per baseline, the output is ragged: a sequence of rows,
+    one per averaged dump and baseline, sorted by time and then baseline.
+    The averaged data of all rows are concatenated into 1-D arrays, with
+    row *i* occupying ``offsets[i]:offsets[i + 1]``.
+
+    Parameters
+    ----------
+    vis : array of complex64, shape (*T*, *F*, *B*)
+        The input visibilities to be averaged
+    weight : array of float32, shape (*T*, *F*, *B*)
+        The input weights (used for weighted averaging)
+    flag : array of bool, shape (*T*, *F*, *B*)
+        The input flags (flagged data have weight zero before averaging)
+    timestamps : array of float, shape (*T*,)
+        The timestamps corresponding to the input dumps
+    channel_freqs : array of float, shape (*F*,)
+        The frequencies (in Hz) corresponding to the input channels
+    dump_period : float
+        Duration of each input dump, in seconds
+    timeav, chanav : int or array of int, shape (*B*,)
+        Time and channel averaging factors per baseline
+    flagav : bool, optional
+        Flag averaged data if any (instead of all) data in the bin is flagged
+
+    Returns
+    -------
+    averaged : :class:`BaselineAveragedVisibilities` namedtuple
+        Ragged output with fields `vis`, `weight` and `flag` (concatenated row
+        data), `offsets` (shape (*R* + 1,) start of each row in the data),
+        `baseline` (input baseline index per row), `time` (centroid timestamp
+        per row), `interval` (duration per row, in seconds), `chanav` (channel
+        averaging factor per row) and `channel_freqs` (dict mapping channel
+        averaging factor to averaged channel frequencies)
+    """
+    n_time, n_chans, n_bl = vis.shape
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    channel_freqs = np.asarray(channel_freqs)
+    timeav = np.clip(np.broadcast_to(timeav, (n_bl,)), 1, max(n_time, 1)).astype(np.int64)
+    chanav = np.clip(np.broadcast_to(chanav, (n_bl,)), 1, max(n_chans, 1)).astype(np.int64)
+    parts, freqs = [], {}
+    # Average each group of baselines sharing the same factors in one go
+    for group_timeav, group_chanav in sorted(set(zip(timeav, chanav))):
+        baselines = np.flatnonzero((timeav == group_timeav) & (chanav == group_chanav))
+        n_group_chans = n_chans // group_chanav * group_chanav
+        freqs[group_chanav] = channel_freqs[:n_group_chans].reshape(-1, group_chanav).mean(axis=-1)
+        group = [x[:, :n_group_chans][:, :, baselines] for x in (vis, weight, flag)]
+        n_full = n_time // group_timeav * group_timeav
+        bins = [(0, n_full, group_timeav), (n_full, n_time, n_time - n_full)]
+        for start, stop, bin_timeav in bins:
+            if stop == start:
+                continue
+            axis = _parallel_axis((stop - start) // bin_timeav, n_group_chans // group_chanav, len(baselines))
+            averaged = _average_visibilities(group[0][start:stop], group[1][start:stop], group[2][start:stop],
+                                             bin_timeav, group_chanav, flagav, axis)
+            av_n_time = len(averaged[0])
+            # Turn (time, channel, baseline) into rows of channels per (time, baseline)
+            data = [x.transpose(0, 2, 1).reshape(av_n_time * len(baselines), -1) for x in averaged]
+            times = timestamps[start:stop].reshape(-1, bin_timeav).mean(axis=-1)
+            parts.append((data, np.repeat(times, len(baselines)), np.tile(baselines, av_n_time),
+                          bin_timeav * dump_period, group_chanav))
+    row_time = np.concatenate([part[1] for part in parts]) if parts else np.zeros(0)
+    row_baseline = np.concatenate([part[2] for part in parts]) if parts else np.zeros(0, np.int64)
+    row_length = np.concatenate([np.repeat(part[0][0].shape[1], len(part[1])) for part in parts]) \
+        if parts else np.zeros(0, np.int64)
+    order = np.lexsort((row_baseline, row_time))
+    # Position of each (unsorted) row in the sorted output
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    offsets = np.r_[0, np.cumsum(row_length[order])].astype(np.int64)
+    out = [np.empty(offsets[-1], x.dtype) for x in (vis, weight, flag)]
+    interval = np.empty(len(order))
+    row_chanav = np.empty(len(order), np.int64)
+    first_row = 0
+    for data, times, _, part_interval, part_chanav in parts:
+        rows = rank[first_row:first_row + len(times)]
+        first_row += len(times)
+        index = offsets[rows][:, np.newaxis] + np.arange(data[0].shape[1])
+        for out_data, part_data in zip(out, data):
+            out_data[index] = part_data
+        interval[rows] = part_interval
+        row_chanav[rows] = part_chanav
+    return BaselineAveragedVisibilities(out[0], out[1], out[2], offsets, row_baseline[order],
+                                        row_time[order], interval, row_chanav, freqs)
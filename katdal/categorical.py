@@ -251,14 +251,35 @@ class CategoricalData(object):
     array assimilates objects such as tuples, lists and other arrays. The
     alternative is an array of :class:`ComparableArrayWrapper` objects but
     these then need to be unpacked at some later stage which is also tricky.
+    For lookups the list is converted to an array once if possible, which is
+    cached until `unique_values` is replaced or changes via :meth:`add` or
+    :meth:`remove` (so avoid modifying its items in place).
 
     """
 
+    # Cached array version of unique_values and the list it came from
+    _values_array = None
+    _values_array_source = None
+    _values_array_source_len = 0
+
     def __init__(self, sensor_values, events):
         values, self.indices = unique_in_order(sensor_values, return_inverse=True)
         self.unique_values = [ComparableArrayWrapper.unwrap(v) for v in values]
         self.events = np.asarray(events)
 
+    @property
+    def _unique_values_array(self):
+        """Unique values as an array indexable by value index, or None if ragged."""
+        values = self.unique_values
+        if values is not self._values_array_source or len(values) != self._values_array_source_len:
+            try:
+                self._values_array = np.array(values)
+            except ValueError:
+                self._values_array = None
+            self._values_array_source = values
+            self._values_array_source_len = len(values)
+        return self._values_array
+
     @property
     def _comparable_values(self):
         """Comparable version of unique values, wrapping any objects."""
@@ -306,24 +327,21 @@ class CategoricalData(object):
 
         """
         if isinstance(key, slice):
-            # Convert slice notation to the corresponding sequence of dump indices
-            key = range(*key.indices(self.events[-1]))
+            # Convert slice notation to the corresponding array of dump indices
+            key = np.arange(*key.indices(self.events[-1]))
         # Convert sequence of bools (one per dump) to sequence of indices where key is True
         elif np.asarray(key).dtype == np.bool and len(np.asarray(key)) == self.events[-1]:
             key = np.nonzero(key)[0]
         indices = self._lookup(key)
         # Interpret indices as either a sequence of ints or a single int
-        try:
-            values = [self.unique_values[index] for index in indices]
-        except TypeError:
+        if np.isscalar(indices):
             return self.unique_values[indices]
-        # Handle empty selections specially to ensure proper dtype and shape
-        if not values:
-            all_possible_values = np.array(self.unique_values)
-            dtype = all_possible_values.dtype
-            shape = all_possible_values.shape
-            return np.empty((0,) + shape[1:], dtype)
-        return np.array(values)
+        all_possible_values = self._unique_values_array
+        if all_possible_values is not None:
+            return all_possible_values[indices]
+        # Fall back to assembling the selected values if they don't fit in one array
+        values = [self.unique_values[index] for index in indices]
+        return np.array(values) if values else np.empty(0, dtype=object)
 
     def __repr__(self):
         """Short human-friendly string representation of categorical data object."""
@@ -413,6 +431,7 @@ class CategoricalData(object):
             except ValueError:
                 value_index = len(self.unique_values)
                 self.unique_values += [value]
+                self._values_array_source = None
         else:
             value_index = self._lookup(event)
         # If new event coincides with existing event, simply change value of that event, else insert new event
@@ -443,6 +462,7 @@ class CategoricalData(object):
             self.indices = remap[self.indices[keep]]
             self.events = np.r_[self.events[:-1][keep], self.events[-1]]
             del self.unique_values[index]
+            self._values_array_source = None
 
     def add_unmatched(self, segments, match_dist=1):
         """Add duplicate events for segment starts that don't match sensor events.
@@ -594,6 +614,31 @@ def concatenate_categorical(split_data, **kwargs):
     return data
 
 
+def _intern(values):
+    """Split array of values into array of unique values (in order) and codes.
+
+    The unique values are picked from `values` itself, which preserves their
+    dtype, and ``unique_values[codes]`` reconstructs `values`.
+    """
+    if values.dtype == np.object:
+        # Number the values in order of appearance in a single dict pass
+        lookup = {}
+        try:
+            codes = np.array([lookup.setdefault(value, len(lookup)) for value in values], dtype=np.int)
+        except TypeError:
+            # Fall back to slower list-based lookup for unhashable object values
+            codes = unique_in_order(values, return_inverse=True)[1]
+        # The first occurrence of each value is where its code exceeds all previous ones
+        first = np.flatnonzero(codes > np.maximum.accumulate(np.r_[-1, codes[:-1]]))
+        return values[first], codes
+    # Sort-based version for plain dtypes, with codes renumbered in order of appearance
+    _, first, codes = np.unique(values, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return values[first[order]], rank[codes]
+
+
 def _single_event_per_dump(events, greedy):
     """Ensure that each dump is associated with a single sensor event.
 
@@ -604,55 +649,55 @@ def _single_event_per_dump(events, greedy):
     "greedy" will override non-greedy ones and grab a dump even if it is not
     the final value. In this scenario, move the final (non-greedy) event to the
     next dump by modifying its dump index in the `events` parameter. The
-    generator returns up to *N* events but not the special terminal event.
+    result contains up to *N* events but not the special terminal event.
 
     Parameters
     ----------
-    events : mutable sequence of non-negative ints, length *N* + 1
+    events : array of non-negative int, length *N* + 1
         Monotonic sequence of dump indices associated with each sensor event.
         The last event is one past the last dump (i.e. the total number of
         dumps). Be aware that this parameter is mutated by the function.
     greedy : sequence of bool, length *N*
         Flags indicating whether the sensor value at a given event is "greedy"
 
-    Yields
-    ------
-    event_index : non-negative int
-        Index into `events` sequence of the next cleaned up event (does not
-        yield the one-past-last-dump terminal event)
+    Returns
+    -------
+    event_indices : array of non-negative int
+        Indices into `events` sequence of the cleaned up events, in order
+        (excluding the one-past-last-dump terminal event)
+
+    Notes
+    -----
+    The events are processed per dump with array operations. The events in
+    each dump form a group, and the final event of a group is also the event
+    active at the start of the next dump. The winner of a dump is its final
+    greedy event, or else the event active at its start if that is greedy, or
+    else its final event. A final event that loses to a greedy one is pushed
+    to the next dump, and it wins that dump if no other events occur there.
 
     """
-    # The previous winning event is the dominant event in the previous dump
-    previous_winning_event = 0
-    previous_dump = 0
-    # This generates consecutive event indices with associated dump indices
-    for current_event, current_dump in enumerate(events):
-        # At the start of a new dump, process the events of the previous dump
-        if current_dump > previous_dump:
-            # This previous event segment is assumed to straddle dump boundary
-            assert current_event >= 1, "First sensor event not at dump 0"
-            event_at_dump_start = current_event - 1
-            # The normal victory condition is to be the final event in the dump
-            if not greedy[previous_winning_event]:
-                previous_winning_event = event_at_dump_start
-            winning_dump = events[previous_winning_event]
-            # Only yield winning event in immediate past to avoid duplicates
-            if previous_dump <= winning_dump < current_dump:
-                yield previous_winning_event
-            # If winning event was greedy and final event was non-greedy,
-            # push final event to the start of next dump and yield if it is
-            # the only event in that dump (otherwise it has to fight it out...)
-            if event_at_dump_start != previous_winning_event:
-                # NB: This modifies `events`! It simplifies bookkeeping.
-                events[event_at_dump_start] += 1
-                if current_dump > events[event_at_dump_start]:
-                    yield event_at_dump_start
-                previous_winning_event = event_at_dump_start
-            previous_dump = current_dump
-        # While within the same dump, pick the latest greedy event as winner
-        # Also, avoid indexing greedy with final one-past-last event
-        if (current_event < len(greedy)) and greedy[current_event]:
-            previous_winning_event = current_event
+    greedy = np.asarray(greedy, dtype=bool)
+    assert events[0] == 0, "First sensor event not at dump 0"
+    # The final event of each dump (the terminal event is not part of a dump)
+    final = np.flatnonzero(events[1:] != events[:-1])
+    dump = events[final]
+    next_dump = events[final + 1]
+    # Final greedy event of each dump, or -1 if there are none
+    greedy_events = np.where(greedy, np.arange(len(greedy)), -1)
+    final_greedy = np.maximum.reduceat(greedy_events, np.r_[0, final[:-1] + 1])
+    # The event active at the start of each dump is the final event of the previous dump
+    at_start = np.r_[-1, final[:-1]]
+    greedy_at_start = (at_start >= 0) & greedy[at_start]
+    winner = np.where(final_greedy >= 0, final_greedy, np.where(greedy_at_start, at_start, final))
+    pushed = winner != final
+    # A greedy event active at the start of a dump belongs to an earlier dump
+    # and was already yielded there, as it is not pushed itself
+    yield_winner = (final_greedy >= 0) | ~greedy_at_start
+    yield_pushed = pushed & (next_dump > dump + 1)
+    # NB: This modifies `events`! It simplifies bookkeeping.
+    events[final[pushed]] += 1
+    event_indices = np.c_[np.where(yield_winner, winner, -1), np.where(yield_pushed, final, -1)].ravel()
+    return event_indices[event_indices >= 0]
 
 
 def sensor_to_categorical(sensor_timestamps, sensor_values, dump_midtimes,
@@ -725,6 +770,9 @@ def sensor_to_categorical(sensor_timestamps, sensor_values, dump_midtimes,
     within_dumps = slice(first_proper_event, one_past_last_event)
     sensor_values = sensor_values[within_dumps]
     events = events[within_dumps]
+    # Represent sensor values as integer codes into an array of unique values,
+    # so that the rest only has to deal with each distinct value once
+    values, codes = _intern(sensor_values)
     # Apply optional transform to sensor values
     if transform is not None:
         if wrapped_values:
@@ -732,30 +780,34 @@ def sensor_to_categorical(sensor_timestamps, sensor_values, dump_midtimes,
             def transform(value):   # noqa: E306
                 """Unwrap wrapped value, transform and rewrap."""
                 return ComparableArrayWrapper(orig_transform(value.unwrapped))
-        sensor_values = np.array([transform(y) for y in sensor_values])
+        values = np.array([transform(y) for y in values])
     # Force first dump to have valid sensor value
     # (insert initial value or let the first proper value apply from the start)
     if events[0] != 0 and initial_value is not None:
         if wrapped_values:
             initial_value = ComparableArrayWrapper(initial_value)
-        sensor_values = np.r_[[initial_value], sensor_values]
+        values = np.r_[[initial_value], values]
+        codes = np.r_[0, codes + 1]
         events = np.r_[0, events]
     events[0] = 0
+    # The transform and initial value may have made some values equal
+    values, recode = _intern(values)
+    codes = recode[codes]
     # Clean up dump->event mapping, taking into account greedy values
     greedy_values = () if greedy_values is None else greedy_values
-    greedy = [value in greedy_values for value in sensor_values]
+    greedy = np.array([value in greedy_values for value in values], dtype=bool)[codes]
     # Add one-past-last-dump terminator (will be removed again by `cleaned_up`)
     events = np.r_[events, num_dumps]
     # NB: `events` is mutated by `_single_event_per_dump`
-    cleaned_up = list(_single_event_per_dump(events, greedy))
-    sensor_values = sensor_values[cleaned_up]
+    cleaned_up = _single_event_per_dump(events, greedy)
+    codes = codes[cleaned_up]
     events = events[cleaned_up]
     # Discard sensor events that do not change the (transformed) sensor value
     # (i.e. that repeat the previous value)
     if not allow_repeats:
-        changes_value = [n for n in range(len(sensor_values)) if n == 0 or
-                         sensor_values[n] != sensor_values[n - 1]]
-        sensor_values = sensor_values[changes_value]
+        changes_value = np.r_[True, codes[1:] != codes[:-1]][:len(codes)]
+        codes = codes[changes_value]
         events = events[changes_value]
+    sensor_values = values[codes]
     # Last event is fixed at one-past-last-dump to indicate end of last segment
     return CategoricalData(sensor_values, np.r_[events, num_dumps])
@@ -20,6 +20,7 @@ from __future__ import division
 
 import contextlib
 import functools
+import itertools
 import uuid
 
 import numpy as np
@@ -372,7 +373,7 @@ class ChunkStore(object):
             prefix = 'Chunk {!r}: '.format(chunk_name) if chunk_name else ''
             raise StandardisedError(prefix + str(e))
 
-    def get_dask_array(self, array_name, chunks, dtype, offset=()):
+    def get_dask_array(self, array_name, chunks, dtype, offset=(), index=()):
         """Get dask array from the store.
 
         Any missing chunks are replaced with zeros, suppressing any
@@ -388,6 +389,11 @@ class ChunkStore(object):
             Data type of array
         offset : tuple of int, optional
             Offset to add to each dimension when addressing chunks in store
+        index : tuple of sequences of int, optional
+            Indices of chunks to include per dimension (the default is to
+            include all chunks, also for any dimensions not in `index`).
+            The array then consists of the selected chunks only, joined in
+            the given order, and its graph has no tasks for the other chunks.
 
         Returns
         -------
@@ -397,9 +403,24 @@ class ChunkStore(object):
         getter = functools.partial(self.get_chunk_or_zeros, dtype=dtype)
         if offset:
             getter = _add_offset_to_slices(getter, offset)
-        # Use dask utility function that forms the core of da.from_array
-        dask_graph = da.core.getem(array_name, chunks, getter)
-        return da.Array(dask_graph, array_name, chunks, dtype)
+        if not index:
+            # Use dask utility function that forms the core of da.from_array
+            dask_graph = da.core.getem(array_name, chunks, getter)
+            return da.Array(dask_graph, array_name, chunks, dtype)
+        chunks = da.core.normalize_chunks(chunks)
+        index = tuple(index) + tuple(range(len(c)) for c in chunks[len(index):])
+        out_name = '{}-{}'.format(array_name, dask.base.tokenize(*index))
+        out_chunks = tuple(tuple(c[n] for n in indices)
+                           for c, indices in zip(chunks, index))
+        # Build the graph of a getem() call, but only for the selected chunks
+        slices = []
+        for c, indices in zip(chunks, index):
+            starts = np.cumsum((0,) + c)
+            slices.append([slice(int(starts[n]), int(starts[n + 1])) for n in indices])
+        keys = itertools.product([out_name], *[range(len(c)) for c in out_chunks])
+        values = ((getter, array_name, s) for s in itertools.product(*slices))
+        dask_graph = dict(zip(keys, values))
+        return da.Array(dask_graph, out_name, out_chunks, dtype)
 
     def put_dask_array(self, array_name, array, offset=()):
         """Put dask array into the store.
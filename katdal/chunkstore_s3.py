@@ -225,6 +225,44 @@ class S3ChunkStore(ChunkStore):
                 # Assume result is (exception type, exception value, traceback)
                 raise result[0], result[1], result[2]
 
+    # Process-wide registry of stores, keyed on (class, URL, timeout, token)
+    _registry = {}
+    _registry_lock = threading.Lock()
+
+    @classmethod
+    def shared_from_url(cls, url, timeout=10, extra_timeout=1, token=None,
+                        **kwargs):
+        """Obtain S3 chunk store for endpoint URL, reusing an existing one.
+
+        This looks up a store with the same endpoint URL, timeout and token in
+        a process-wide registry and only constructs a new store via
+        :meth:`from_url` if none is found. This lets consecutive opens of
+        datasets in the same archive share a warm connection pool and skip
+        the initial smoke test. The parameters are the same as for
+        :meth:`from_url`.
+
+        Raises
+        ------
+        :exc:`chunkstore.StoreUnavailable`
+            If S3 server interaction failed (it's down, no authentication, etc)
+        """
+        key = (cls, url, timeout, token)
+        with cls._registry_lock:
+            store = cls._registry.get(key)
+        if store is None:
+            # Don't hold the lock while connecting, as that may take a while.
+            # If another thread beats us to it, use its store instead.
+            store = cls.from_url(url, timeout, extra_timeout, token, **kwargs)
+            with cls._registry_lock:
+                store = cls._registry.setdefault(key, store)
+        return store
+
+    @classmethod
+    def clear_registry(cls):
+        """Forget all stores shared via :meth:`shared_from_url`."""
+        with cls._registry_lock:
+            cls._registry.clear()
+
     def _chunk_url(self, chunk_name):
         return urlparse.urljoin(self._url, urllib.quote(chunk_name + '.npy'))
 
@@ -425,9 +425,8 @@ class ConcatenatedSensorCache(SensorCache):
             # Look up properties associated with this specific sensor
             props = self.props.get(name, {})
             # Look up properties associated with this class of sensor
-            for key, val in self.props.iteritems():
-                if key[0] == '*' and name.endswith(key[1:]):
-                    props.update(val)
+            for val in self._wildcard_props(name):
+                props.update(val)
             # Any properties passed directly to this method takes precedence
             props.update(kwargs)
             return concatenate_categorical(split_data, **props)
@@ -16,10 +16,13 @@
 
 """Base class for accessing a visibility data set."""
 
+import sys
 import time
 import logging
+import threading
 
 import numpy as np
+import dask.array as da
 
 import katpoint
 from katpoint import is_iterable, rad2deg
@@ -186,6 +189,44 @@ class SpectralWindow(object):
         return hash(self._description)
 
 
+class _BackgroundCall(object):
+    """Call a function in a background thread and reraise any errors on wait."""
+    def __init__(self, func, *args):
+        self._exc_info = None
+        self._thread = threading.Thread(target=self._run, args=(func,) + args)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, func, *args):
+        try:
+            func(*args)
+        except BaseException:
+            self._exc_info = sys.exc_info()
+
+    def join(self):
+        """Wait for the call to finish, ignoring any errors."""
+        self._thread.join()
+
+    def wait(self):
+        """Wait for the call to finish and reraise its exception, if any."""
+        self._thread.join()
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+
+
+def _fetch_block(arrays, index, out):
+    """Fetch the same part of each array into the corresponding output array.
+
+    If all arrays are dask-backed lazy indexers, this does a single pass
+    through dask so that the arrays are retrieved together.
+    """
+    if all(hasattr(array, 'dask_getitem') for array in arrays):
+        da.store([array.dask_getitem(index) for array in arrays], out, lock=False)
+    else:
+        for array, output in zip(arrays, out):
+            output[:] = array[index]
+
+
 def _robust_target(description):
     """Robust build of :class:`katpoint.Target` object from description string."""
     if not description:
@@ -197,6 +238,39 @@ def _robust_target(description):
         return katpoint.Target('Nothing, special')
 
 
+def utc_to_mjd(timestamps):
+    """Convert UTC timestamps to Modified Julian Days (MJD) in one go.
+
+    This gives exactly the same result as calling
+    :meth:`katpoint.Timestamp.to_mjd` on each timestamp, as it follows the
+    same path through broken-down UTC time and ephem's Dublin Julian Day,
+    but operates on whole arrays instead of individual timestamps.
+
+    Parameters
+    ----------
+    timestamps : float or array of float
+        UTC timestamps, in seconds since the Unix epoch
+
+    Returns
+    -------
+    mjd : float or array of float, same shape as `timestamps`
+        Modified Julian Day for each timestamp
+    """
+    secs = np.asarray(timestamps, dtype=np.float64)
+    int_secs = np.floor(secs)
+    days, day_secs = np.divmod(int_secs, 24. * 60. * 60.)
+    hours, hour_secs = np.divmod(day_secs, 60. * 60.)
+    minutes, seconds = np.divmod(hour_secs, 60.)
+    seconds = seconds + (secs - int_secs)
+    # Dublin Julian Day (ephem date) of Unix epoch is 25567.5, and ephem
+    # adds the time of day to the date in hours, minutes and seconds
+    djd = days + 25567.5
+    djd = djd + hours / 24.
+    djd = djd + minutes / (24. * 60.)
+    djd = djd + seconds / (24. * 60. * 60.)
+    return djd + 2415020 - 2400000.5
+
+
 DEFAULT_SENSOR_PROPS = {
     '*nd_coupler': {'categorical': True, 'greedy_values': (True,), 'initial_value': '0',
                     'transform': lambda x: x not in ('0', 'False', 0)},
@@ -213,7 +287,7 @@ DEFAULT_SENSOR_PROPS = {
 
 def _calc_mjd(cache, name):
     """Calculate Modified Julian Day (MJD) timestamps using sensor cache contents."""
-    cache[name] = mjd = np.array([katpoint.Timestamp(t).to_mjd() for t in cache.timestamps[:]])
+    cache[name] = mjd = utc_to_mjd(cache.timestamps[:])
     return mjd
 
 
@@ -224,29 +298,57 @@ def _calc_lst(cache, name, ant):
     return lst
 
 
+def _ephem_dates(timestamps):
+    """Convert UTC timestamps to ephem dates exactly as katpoint does."""
+    return [katpoint.Timestamp(t).to_ephem_date() for t in timestamps]
+
+
+def _azel_to_radec(antenna, dates, az, el):
+    """Astrometric (ra, dec) of (az, el) arrays as seen by antenna on ephem dates.
+
+    This gives the same result as calling the :meth:`katpoint.Target.radec`
+    method of ``katpoint.construct_azel_target(az, el)`` per sample, but
+    without constructing a target object per sample (for a stationary body
+    the astrometric and apparent coordinates are the same).
+    """
+    observer = antenna.observer
+    radec = np.empty((len(dates), 2))
+    for n, (date, a, e) in enumerate(zip(dates, az, el)):
+        observer.date = date
+        radec[n] = observer.radec_of(a, e)
+    return radec[:, 0], radec[:, 1]
+
+
 def _calc_radec(cache, name, ant):
     """Calculate (ra, dec) pointing coordinates using sensor cache contents."""
     ant_group = 'Antennas/%s/' % (ant,)
     antenna = cache.get(ant_group + 'antenna')[0]
     az, el = cache.get(ant_group + 'az'), cache.get(ant_group + 'el')
-    radec = np.array([katpoint.construct_azel_target(a, e).radec(t, antenna)
-                      for t, a, e in zip(cache.timestamps[:], az, el)])
-    cache[ant_group + 'ra'] = radec[:, 0]
-    cache[ant_group + 'dec'] = radec[:, 1]
-    return radec[:, 0] if name == ant_group + 'ra' else radec[:, 1]
+    ra, dec = _azel_to_radec(antenna, _ephem_dates(cache.timestamps[:]), az, el)
+    cache[ant_group + 'ra'] = ra
+    cache[ant_group + 'dec'] = dec
+    return ra if name == ant_group + 'ra' else dec
+
+
+_calc_radec.dependencies = lambda name, ant: ['Antennas/%s/az' % (ant,), 'Antennas/%s/el' % (ant,)]
 
 
 def _calc_parangle(cache, name, ant):
     """Calculate parallactic angle using sensor cache contents."""
     ant_group = 'Antennas/%s/' % (ant,)
     antenna = cache.get(ant_group + 'antenna')[0]
-    az, el = cache.get(ant_group + 'az'), cache.get(ant_group + 'el')
-    parangle = np.array([katpoint.construct_azel_target(a, e).parallactic_angle(t, antenna)
-                         for t, a, e in zip(cache.timestamps[:], az, el)])
+    # Apparent (ra, dec) of a stationary (az, el) body equal its astrometric (ra, dec)
+    ra, dec = cache.get(ant_group + 'ra'), cache.get(ant_group + 'dec')
+    ha = cache.get(ant_group + 'lst') - ra
+    # This is the formula used by :meth:`katpoint.Target.parallactic_angle`
+    parangle = np.arctan2(np.sin(ha), np.tan(antenna.observer.lat) * np.cos(dec) - np.sin(dec) * np.cos(ha))
     cache[name] = parangle
     return parangle
 
 
+_calc_parangle.dependencies = lambda name, ant: ['Antennas/%s/ra' % (ant,), 'Antennas/%s/dec' % (ant,)]
+
+
 def _calc_target_coords(cache, name, ant, projection, coordsys):
     """Calculate target coordinates using sensor cache contents."""
     ant_group = 'Antennas/%s/' % (ant,)
@@ -267,14 +369,43 @@ def _calc_target_coords(cache, name, ant, projection, coordsys):
     return x if name.startswith(ant_group + 'target_x') else y
 
 
+def _calc_array_uvw(cache, name, ant):
+    """Calculate (u,v,w) coordinates of antennas relative to array reference position.
+
+    The coordinates of all antennas are calculated in one go, since the
+    (u,v,w) basis per timestamp is the expensive part and it is common to all
+    antennas. All antennas share a single array reference position (that of
+    the first antenna by name), so that the coordinates of any two antennas
+    may be differenced even if their own reference positions differ. The
+    array reference position also serves as pointing reference (which
+    matters for targets tied to the local horizon, such as azel targets).
+    """
+    ants = {}
+    for key in cache.keys():
+        if key.startswith('Antennas/') and key.endswith('/antenna'):
+            ants[key[len('Antennas/'):-len('/antenna')]] = cache.get(key)[0]
+    if ant not in ants:
+        ants[ant] = cache.get('Antennas/%s/antenna' % (ant,))[0]
+    names = sorted(ants)
+    array_reference = katpoint.Antenna('', *ants[names[0]].ref_position_wgs84)
+    enu = np.array([array_reference.baseline_toward(ants[a]) for a in names])
+    # Axes are coordinate (u/v/w), time and antenna
+    uvw = np.empty((3, len(cache.timestamps), len(names)))
+    targets = cache.get('Observation/target')
+    for segm, target in targets.segments():
+        basis = target.uvw_basis(cache.timestamps[segm], array_reference).reshape(3, 3, -1)
+        uvw[:, segm] = np.tensordot(basis, enu, ([1], [1]))
+    for n, a in enumerate(names):
+        for coord, values in zip('uvw', uvw):
+            cache['Antennas/%s/array_%s' % (a, coord)] = values[:, n]
+    return cache.get(name)
+
+
 def _calc_uvw(cache, name, antA, antB):
     """Calculate (u,v,w) coordinates using sensor cache contents."""
     antA_group, antB_group = 'Antennas/%s/' % (antA,), 'Antennas/%s/' % (antB,)
-    antennaA, antennaB = cache.get(antA_group + 'antenna')[0], cache.get(antB_group + 'antenna')[0]
-    u, v, w = np.empty(len(cache.timestamps)), np.empty(len(cache.timestamps)), np.empty(len(cache.timestamps))
-    targets = cache.get('Observation/target')
-    for segm, target in targets.segments():
-        u[segm], v[segm], w[segm] = target.uvw(antennaA, cache.timestamps[segm], antennaB)
+    u, v, w = [cache.get(antA_group + 'array_' + coord) - cache.get(antB_group + 'array_' + coord)
+               for coord in 'uvw']
     cache[antA_group + 'u_%s' % (antB,)] = u
     cache[antA_group + 'v_%s' % (antB,)] = v
     cache[antA_group + 'w_%s' % (antB,)] = w
@@ -287,6 +418,7 @@ DEFAULT_VIRTUAL_SENSORS = {
     'Antennas/{ant}/parangle': _calc_parangle,
     'Antennas/{ant}/target_[xy]_{projection}_{coordsys}': _calc_target_coords,
     'Antennas/{antA}/[uvw]_{antB}': _calc_uvw,
+    'Antennas/{ant}/array_[uvw]': _calc_array_uvw,
 }
 
 # -------------------------------------------------------------------------------------------------
@@ -944,6 +1076,81 @@ class DataSet(object):
         # Restore original selection more thoroughly
         self.select(**preselection)
 
+    def blocks(self, dumps_per_block=64, channels_per_block=None, prefetch=True):
+        """Generator that iterates through blocks of correlator data.
+
+        This iterates through the currently selected data in blocks of
+        consecutive dumps (and optionally channels), returning aligned
+        timestamps, visibilities, weights and flags for each block. All three
+        data arrays are retrieved in a single pass where the format supports
+        it. The data are written into two sets of output arrays which are
+        reused on alternate iterations, and by default the next block is
+        already being retrieved while the current one is processed.
+
+        The returned arrays are therefore only valid until the next iteration
+        and should be copied if they need to be kept for longer. The
+        selection may not be changed while iterating.
+
+        Parameters
+        ----------
+        dumps_per_block : int, optional
+            Number of dumps per block (the last block along time may be shorter)
+        channels_per_block : int or None, optional
+            Number of channels per block (None for all selected channels)
+        prefetch : bool, optional
+            True to retrieve the next block in the background
+
+        Yields
+        ------
+        timestamps : array of float64, shape (*t*,)
+            Timestamps of dumps in block
+        vis : array of complex64, shape (*t*, *f*, *B*)
+            Complex visibility data of block
+        weights : array of float32, shape (*t*, *f*, *B*)
+            Visibility weights of block
+        flags : array of bool, shape (*t*, *f*, *B*)
+            Visibility flags of block
+
+        """
+        num_dumps, num_chans, num_corrprods = self.shape
+        if channels_per_block is None:
+            channels_per_block = num_chans
+        dumps_per_block = max(min(dumps_per_block, num_dumps), 1)
+        channels_per_block = max(min(channels_per_block, num_chans), 1)
+        indices = [np.s_[t:t + dumps_per_block, f:f + channels_per_block]
+                   for t in range(0, num_dumps, dumps_per_block)
+                   for f in range(0, num_chans, channels_per_block)]
+        arrays = (self.vis, self.weights, self.flags)
+        shape = (dumps_per_block, channels_per_block, num_corrprods)
+        buffers = [[np.empty(shape, array.dtype) for array in arrays]
+                   for n in range(2)]
+
+        def outputs(n):
+            """Views on output arrays of block `n`, trimmed at array edges."""
+            time_slice, freq_slice = indices[n]
+            block_dumps = len(range(num_dumps)[time_slice])
+            block_chans = len(range(num_chans)[freq_slice])
+            return [buf[:block_dumps, :block_chans] for buf in buffers[n % 2]]
+
+        def fetch(n):
+            _fetch_block(arrays, indices[n], outputs(n))
+
+        timestamps = self.timestamps
+        pending = None
+        try:
+            for n in range(len(indices)):
+                if pending is None:
+                    fetch(n)
+                else:
+                    pending.wait()
+                    pending = None
+                if prefetch and n + 1 < len(indices):
+                    pending = _BackgroundCall(fetch, n + 1)
+                yield (timestamps[indices[n][0]],) + tuple(outputs(n))
+        finally:
+            if pending is not None:
+                pending.join()
+
     # - - - - - - - - - - - - - - Format-specific properties - - - - - - - - - - - - - - - - - -
 
     @property
@@ -1053,19 +1260,27 @@ class DataSet(object):
 
     def _sensor_per_ant(self, base_name):
         """Extract a single sensor per antenna and safely stack the results."""
-        def sensor_data(ant_name):
-            return self.sensor['Antennas/%s/%s' % (ant_name, base_name)]
-        return np.column_stack([sensor_data(ant.name) for ant in self.ants]) \
+        names = ['Antennas/%s/%s' % (ant.name, base_name) for ant in self.ants]
+        return np.column_stack(self.sensor.get_many(names, select=True)) \
             if self.ants else np.zeros((self.shape[0], 0))
 
     def _sensor_per_corrprod(self, base_name):
         """Extract a single sensor per corrprod and safely stack the results."""
-        def sensor_data(antA, antB):
-            return self.sensor['Antennas/%s/%s_%s' % (antA, base_name, antB)]
-        return np.column_stack([sensor_data(inpA[:-1], inpB[:-1])
-                                for inpA, inpB in self.corr_products]) \
+        names = ['Antennas/%s/%s_%s' % (inpA[:-1], base_name, inpB[:-1]) for inpA, inpB in self.corr_products]
+        return np.column_stack(self.sensor.get_many(names, select=True)) \
             if len(self.corr_products) else np.zeros((self.shape[0], 0))
 
+    def _uvw_per_corrprod(self, coord):
+        """Difference per-antenna (u,v,w) coordinates for all corrprods at once."""
+        if not len(self.corr_products):
+            return np.zeros((self.shape[0], 0))
+        ants = [(inpA[:-1], inpB[:-1]) for inpA, inpB in self.corr_products]
+        names = sorted(set(a for pair in ants for a in pair))
+        index = dict((name, n) for n, name in enumerate(names))
+        per_ant = np.column_stack([self.sensor['Antennas/%s/array_%s' % (name, coord)] for name in names])
+        antA, antB = np.array([[index[a], index[b]] for a, b in ants]).T
+        return per_ant[:, antA] - per_ant[:, antB]
+
     @property
     def az(self):
         """Azimuth angle of each dish in degrees.
@@ -1159,7 +1374,7 @@ class DataSet(object):
         convention is :math:`u_1 - u_2` for baseline (ant1, ant2).
 
         """
-        return self._sensor_per_corrprod('u')
+        return self._uvw_per_corrprod('u')
 
     @property
     def v(self):
@@ -1171,7 +1386,7 @@ class DataSet(object):
         convention is :math:`v_1 - v_2` for baseline (ant1, ant2).
 
         """
-        return self._sensor_per_corrprod('v')
+        return self._uvw_per_corrprod('v')
 
     @property
     def w(self):
@@ -1183,4 +1398,4 @@ class DataSet(object):
         convention is :math:`w_1 - w_2` for baseline (ant1, ant2).
 
         """
-        return self._sensor_per_corrprod('w')
+        return self._uvw_per_corrprod('w')
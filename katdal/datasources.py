@@ -19,13 +19,10 @@
 import urlparse
 import os
 import logging
-import itertools
-from collections import defaultdict
 
 import katsdptelstate
 import numpy as np
 import dask.array as da
-from dask.array.rechunk import intersect_chunks
 
 from .sensordata import TelstateSensorData
 from .chunkstore_s3 import S3ChunkStore
@@ -34,6 +31,9 @@ from .chunkstore_npy import NpyFileChunkStore
 
 logger = logging.getLogger(__name__)
 
+# Flag bit indicating that no data was received (see FLAG_NAMES in visdatav4)
+DATA_LOST = 8
+
 
 class DataSourceNotFound(Exception):
     """File associated with DataSource not found or server not responding."""
@@ -72,7 +72,18 @@ class VisFlagsWeights(object):
     name : string, optional
         Identifier that describes the origin of the data (backend-specific)
 
+    Attributes
+    ----------
+    unscaled_weights : array-like of uint8, shape (*T*, *F*, *B*), or None
+        Low-resolution weights before per-channel scaling (None if `weights`
+        are not stored as separate components)
+    weights_channel : array-like of float32, shape (*T*, *F*), or None
+        Per-channel scale factors that turn `unscaled_weights` into `weights`
+
     """
+    unscaled_weights = None
+    weights_channel = None
+
     def __init__(self, vis, flags, weights, name='custom'):
         if not (vis.shape == flags.shape == weights.shape):
             raise ValueError("Shapes of vis %s, flags %s and weights %s differ"
@@ -86,20 +97,191 @@ class VisFlagsWeights(object):
     def shape(self):
         return self.vis.shape
 
+    def subset(self, name, keep=()):
+        """Data array restricted to the parts needed for a selection.
+
+        The full array is only guaranteed to be available as an attribute.
+        Subclasses may return a smaller array that still contains all the
+        elements selected by `keep`, together with the equivalent selection
+        on the smaller array, so that indexing the result with the returned
+        `keep` is the same as indexing the full array with the original one.
+
+        Parameters
+        ----------
+        name : {'vis', 'weights', 'unscaled_weights', 'weights_channel'}
+            Name of data array
+        keep : tuple, optional
+            Index expression (typically a boolean mask per dimension)
+
+        Returns
+        -------
+        array : :class:`dask.array.Array` object or None
+            Data array or part of it (None if the array is not available)
+        keep : tuple
+            Index expression to apply to `array`
+        """
+        array = getattr(self, name)
+        return (None if array is None else da.asarray(array)), keep
+
+    def select_flags(self, flags_select, keep=()):
+        """Boolean flags indicating whether any of the selected flag bits are set.
+
+        Parameters
+        ----------
+        flags_select : int
+            Bit mask of flag types to consider (255 for all of them)
+        keep : tuple, optional
+            Index expression used to restrict flags (see :meth:`subset`)
+
+        Returns
+        -------
+        flags : :class:`dask.array.Array` object of bool, shape (*T*, *F*, *B*)
+            True where any of the selected flag bits are set
+        keep : tuple
+            Index expression to apply to `flags`
+        """
+        flags_select = np.uint8(flags_select)
+        flags = da.map_blocks(_select_flags, da.asarray(self.flags),
+                              dtype=np.bool_, flags_select=flags_select)
+        return flags, keep
+
+
+def _chunk_indices(chunks):
+    """Index of the chunk containing each element along a single dimension."""
+    return np.repeat(np.arange(len(chunks)), chunks)
+
+
+def _chunk_selection(chunks, keep):
+    """Chunks along one dimension that contain elements selected by `keep`.
+
+    Returns the indices of the relevant chunks together with the equivalent
+    selection on the concatenation of these chunks. Only boolean masks are
+    narrowed down; for any other index, or if a mask touches all (or none) of
+    the chunks, None is returned together with the original `keep`.
+    """
+    if not (isinstance(keep, np.ndarray) and keep.dtype == np.bool_ and
+            keep.shape == (sum(chunks),)):
+        return None, keep
+    indices = _chunk_indices(chunks)
+    selected = np.zeros(len(chunks), dtype=np.bool_)
+    selected[indices[keep]] = True
+    if selected.all() or not selected.any():
+        return None, keep
+    return np.flatnonzero(selected), keep[selected[indices]]
+
+
+def _any_in_ranges(grid, first, last, axis):
+    """Check for True values in `grid` within index ranges along `axis`.
+
+    The output has the same shape as `grid`, except along `axis` where element
+    *k* indicates whether `grid` has any True values in the inclusive index
+    range [`first[k]`, `last[k]`] along that axis.
+    """
+    pad_shape = list(grid.shape)
+    pad_shape[axis] = 1
+    counts = np.concatenate([np.zeros(pad_shape, dtype=np.int_),
+                             np.cumsum(grid, axis=axis)], axis=axis)
+    return np.take(counts, last + 1, axis=axis) > np.take(counts, first, axis=axis)
+
+
+def _data_lost_map(has_arrays, flags_chunks):
+    """Map missing chunks of arrays onto the chunk grid of the flags array.
+
+    Parameters
+    ----------
+    has_arrays : sequence of (array of bool, tuple of tuple of int) pairs
+        Grid indicating presence of each chunk of an array, and the array's
+        chunk specification (may have fewer dimensions than the flags)
+    flags_chunks : tuple of tuple of int
+        Chunk specification of flags array
+
+    Returns
+    -------
+    lost : tuple
+        Tuple of (`touched`, `offsets`, `missing`) where `touched` is a grid
+        of bools indicating which flags chunks have lost data, `offsets` holds
+        the start of each flags chunk (plus end of array) per dimension and
+        `missing` is a list of (grid of bools, chunk indices per dimension)
+        with one entry per array that is missing at least one chunk
+    """
+    offsets = [np.cumsum((0,) + c) for c in flags_chunks]
+    touched = np.zeros(tuple(len(c) for c in flags_chunks), dtype=np.bool_)
+    missing = []
+    for has_array, chunks in has_arrays:
+        if has_array.all():
+            continue
+        # Array may have fewer dimensions than flags (e.g. weights_channel),
+        # so treat the extra flags dimensions as a single chunk
+        extra_dims = len(flags_chunks) - has_array.ndim
+        missing_grid = ~has_array.reshape(has_array.shape + extra_dims * (1,))
+        chunk_indices = [_chunk_indices(c) for c in chunks]
+        chunk_indices += [np.zeros(sum(c), dtype=np.int_)
+                          for c in flags_chunks[has_array.ndim:]]
+        # Flags chunks are touched if any array chunks that they overlap are missing
+        touched_by_array = missing_grid
+        for axis, (indices, offset) in enumerate(zip(chunk_indices, offsets)):
+            first, last = indices[offset[:-1]], indices[offset[1:] - 1]
+            touched_by_array = _any_in_ranges(touched_by_array, first, last, axis)
+        touched |= touched_by_array
+        missing.append((missing_grid, chunk_indices))
+    return touched, offsets, missing
+
+
+def _data_lost_mask(shape, lost, block_id):
+    """Mask of flags in block affected by missing chunks (None if unaffected)."""
+    touched, offsets, missing = lost
+    if not touched[block_id]:
+        return None
+    block = [slice(offset[n], offset[n + 1])
+             for offset, n in zip(offsets, block_id)]
+    mark = np.zeros(shape, dtype=np.bool_)
+    for missing_grid, chunk_indices in missing:
+        index = np.ix_(*[indices[s] for indices, s in zip(chunk_indices, block)])
+        mark |= missing_grid[index]
+    return mark
+
 
 def _apply_data_lost(orig_flags, lost, block_id):
-    mark = lost.get(block_id)
-    if not mark:
+    """Set the 'data lost' bit of flags in block wherever chunks are missing."""
+    mark = _data_lost_mask(orig_flags.shape, lost, block_id)
+    if mark is None:
         return orig_flags    # Common case - no data lost
     flags = orig_flags.copy()
-    for idx in mark:
-        flags[idx] |= 8
+    flags[mark] |= DATA_LOST
+    return flags
+
+
+def _select_flags(orig_flags, flags_select, lost=None, index=(), block_id=None):
+    """Turn raw flags into bools, only considering the selected flag bits.
+
+    This marks lost data, applies the `flags_select` bit mask and converts
+    the result to bool in a single pass over each block, with one output
+    allocation per block. If the flags only contain some chunks of the full
+    array, `index` maps their block IDs to those of the full array.
+    """
+    if flags_select == 255:
+        flags = np.not_equal(orig_flags, 0)
+    else:
+        masked = np.bitwise_and(orig_flags, flags_select)
+        # Convert to bool in place (safe as both types have the same itemsize)
+        flags = np.not_equal(masked, 0, out=masked.view(np.bool_))
+    if lost is not None and flags_select & DATA_LOST:
+        if index:
+            block_id = tuple(indices[n] for indices, n in zip(index, block_id))
+        mark = _data_lost_mask(orig_flags.shape, lost, block_id)
+        if mark is not None:
+            flags |= mark
     return flags
 
 
 class ChunkStoreVisFlagsWeights(VisFlagsWeights):
     """Correlator data stored in a chunk store.
 
+    The dask arrays of the full dataset are only built when first accessed.
+    Use :meth:`subset` and :meth:`select_flags` instead to obtain smaller
+    graphs containing only the chunks touched by a selection. The subset of
+    each array is cached until the set of chunks changes.
+
     Parameters
     ----------
     store : :class:`ChunkStore` object
@@ -107,39 +289,119 @@ class ChunkStoreVisFlagsWeights(VisFlagsWeights):
     chunk_info : dict mapping array name to info dict
         Dict specifying prefix, dtype, shape and chunks per array
     """
+    # Map data attribute names to the names of the underlying stored arrays
+    _stored_arrays = {'vis': 'correlator_data',
+                      'unscaled_weights': 'weights',
+                      'weights_channel': 'weights_channel'}
+
     def __init__(self, store, chunk_info):
+        shapes = [tuple(chunk_info[array]['shape'])
+                  for array in ('correlator_data', 'flags', 'weights')]
+        if not (shapes[0] == shapes[1] == shapes[2]):
+            raise ValueError("Shapes of vis %s, flags %s and weights %s differ"
+                             % tuple(shapes))
         self.store = store
-        darray = {}
+        self.name = chunk_info['correlator_data']['prefix']
+        self._chunk_info = chunk_info
+        self._chunks = {}
         has_arrays = []
         for array, info in chunk_info.items():
             array_name = store.join(info['prefix'], array)
-            chunk_args = (array_name, info['chunks'], info['dtype'])
-            darray[array] = store.get_dask_array(*chunk_args)
+            chunks = da.core.normalize_chunks(info['chunks'], info['shape'])
+            self._chunks[array] = chunks
             # Find all missing chunks in array and convert to 'data_lost' flags
-            has_arrays.append((store.has_array(array_name, info['chunks'], info['dtype']),
-                               info['chunks']))
-        vis = darray['correlator_data']
-        base_name = chunk_info['correlator_data']['prefix']
-        flags_raw_name = store.join(chunk_info['flags']['prefix'], 'flags_raw')
-        # Combine original flags with data_lost indicating where values were lost from
-        # other arrays.
-        lost = defaultdict(list)  # Maps chunk index to list of index expressions to mark as lost
-        for has_array, chunks in has_arrays:
-            # array may have fewer dimensions than flags
-            # (specifically, for weights_channel).
-            if has_array.ndim < darray['flags'].ndim:
-                chunks += tuple((x,) for x in darray['flags'].shape[has_array.ndim:])
-            intersections = intersect_chunks(darray['flags'].chunks, chunks)
-            for has, pieces in itertools.izip(has_array.flat, intersections):
-                if not has:
-                    for piece in pieces:
-                        chunk_idx, slices = zip(*piece)
-                        lost[chunk_idx].append(slices)
-        flags = da.map_blocks(_apply_data_lost, darray['flags'], dtype=np.uint8,
-                              name=flags_raw_name, lost=lost)
-        # Combine low-resolution weights and high-resolution weights_channel
-        weights = darray['weights'] * darray['weights_channel'][..., np.newaxis]
-        VisFlagsWeights.__init__(self, vis, flags, weights, base_name)
+            has_arrays.append((store.has_array(array_name, chunks, info['dtype']), chunks))
+        self._lost = _data_lost_map(has_arrays, self._chunks['flags'])
+        self._full = {}
+        self._subsets = {}
+
+    def _get_array(self, array, index=()):
+        """Dask array of stored `array`, only containing chunks in `index`."""
+        if not index:
+            darray = self._full.get(array)
+        else:
+            cached_index, darray = self._subsets.get(array, ((), None))
+            if cached_index != index:
+                darray = None
+        if darray is None:
+            info = self._chunk_info[array]
+            array_name = self.store.join(info['prefix'], array)
+            darray = self.store.get_dask_array(array_name, self._chunks[array],
+                                               info['dtype'], index=index)
+            if not index:
+                self._full[array] = darray
+            else:
+                self._subsets[array] = (index, darray)
+        return darray
+
+    def _chunk_subset(self, array, keep):
+        """Indices of chunks of `array` touched by `keep`, and adjusted `keep`."""
+        chunks = self._chunks[array]
+        selection = [_chunk_selection(c, k) for c, k in zip(chunks, keep)]
+        if all(indices is None for indices, _ in selection):
+            return (), keep
+        new_keep = tuple(k for _, k in selection) + tuple(keep[len(selection):])
+        index = tuple(tuple(range(len(c))) if indices is None else tuple(indices.tolist())
+                      for c, (indices, _) in zip(chunks, selection))
+        index += tuple(tuple(range(len(c))) for c in chunks[len(index):])
+        return index, new_keep
+
+    @property
+    def shape(self):
+        return tuple(self._chunk_info['correlator_data']['shape'])
+
+    @property
+    def vis(self):
+        return self._get_array('correlator_data')
+
+    @property
+    def flags(self):
+        flags = self._full.get('flags_raw')
+        if flags is None:
+            # Combine original flags with data_lost indicating where values
+            # were lost from other arrays
+            flags_raw_name = self.store.join(self._chunk_info['flags']['prefix'], 'flags_raw')
+            flags = da.map_blocks(_apply_data_lost, self._get_array('flags'),
+                                  dtype=np.uint8, name=flags_raw_name, lost=self._lost)
+            self._full['flags_raw'] = flags
+        return flags
+
+    @property
+    def unscaled_weights(self):
+        return self._get_array('weights')
+
+    @property
+    def weights_channel(self):
+        return self._get_array('weights_channel')
+
+    @property
+    def weights(self):
+        weights = self._full.get('weights_scaled')
+        if weights is None:
+            # Combine low-resolution weights and high-resolution weights_channel
+            weights = self.unscaled_weights * self.weights_channel[..., np.newaxis]
+            self._full['weights_scaled'] = weights
+        return weights
+
+    def subset(self, name, keep=()):
+        """See the docstring of :meth:`VisFlagsWeights.subset`."""
+        array = self._stored_arrays.get(name)
+        if array is None:
+            return VisFlagsWeights.subset(self, name, keep)
+        index, keep = self._chunk_subset(array, keep)
+        return self._get_array(array, index), keep
+
+    def select_flags(self, flags_select, keep=()):
+        """See the docstring of :meth:`VisFlagsWeights.select_flags`."""
+        flags_select = np.uint8(flags_select)
+        index, keep = self._chunk_subset('flags', keep)
+        raw_flags = self._get_array('flags', index)
+        # Go back to the raw flags so that data_lost is merged into the same pass
+        name = '{}-select-{}'.format(raw_flags.name, flags_select)
+        flags = da.map_blocks(_select_flags, raw_flags, dtype=np.bool_,
+                              name=name, flags_select=flags_select,
+                              lost=self._lost, index=index)
+        return flags, keep
 
 
 class DataSource(object):
@@ -283,7 +545,8 @@ def _infer_chunk_store(url_parts, telstate, npy_store_path=None,
     Returns
     -------
     store : :class:`katdal.ChunkStore` object
-        Chunk store for visibility data
+        Chunk store for visibility data (S3 stores are shared between datasets
+        with the same endpoint URL and credentials)
 
     Raises
     ------
@@ -296,7 +559,7 @@ def _infer_chunk_store(url_parts, telstate, npy_store_path=None,
     if npy_store_path:
         return NpyFileChunkStore(npy_store_path)
     if s3_endpoint_url:
-        return S3ChunkStore.from_url(s3_endpoint_url, **kwargs)
+        return S3ChunkStore.shared_from_url(s3_endpoint_url, **kwargs)
     # NPY chunk store is an option if the dataset is an RDB file
     if url_parts.scheme == 'file':
         # Look for adjacent data directory (presumably containing NPY files)
@@ -308,7 +571,7 @@ def _infer_chunk_store(url_parts, telstate, npy_store_path=None,
         data_path = os.path.join(store_path, vis_prefix)
         if os.path.isdir(data_path):
             return NpyFileChunkStore(store_path)
-    return S3ChunkStore.from_url(telstate['s3_endpoint_url'], **kwargs)
+    return S3ChunkStore.shared_from_url(telstate['s3_endpoint_url'], **kwargs)
 
 
 def _upgrade_flags(chunk_info, telstate):
@@ -26,7 +26,7 @@ from .dataset import (DataSet, WrongVersion, BrokenFile, Subarray, SpectralWindo
                       DEFAULT_SENSOR_PROPS, DEFAULT_VIRTUAL_SENSORS, _robust_target)
 from .sensordata import RecordSensorData, SensorCache
 from .categorical import CategoricalData, sensor_to_categorical
-from .lazy_indexer import LazyIndexer, LazyTransform
+from .lazy_indexer import LazyIndexer, LazyTransform, DaskLazyIndexer, dask_array_from_hdf5
 
 logger = logging.getLogger(__name__)
 
@@ -52,12 +52,19 @@ SENSOR_ALIASES = {
 }
 
 
+def _azel_sensors(name, ant):
+    """Actual sensor behind virtual (az, el) sensor (as a dependency list)."""
+    return ['Antennas/%s/%s' % (ant, 'pos.actual-scan-azim' if name.endswith('az') else 'pos.actual-scan-elev')]
+
+
 def _calc_azel(cache, name, ant):
     """Calculate virtual (az, el) sensors from actual ones in sensor cache."""
-    real_sensor = 'Antennas/%s/%s' % (ant, 'pos.actual-scan-azim' if name.endswith('az') else 'pos.actual-scan-elev')
-    cache[name] = sensor_data = katpoint.deg2rad(cache.get(real_sensor))
+    cache[name] = sensor_data = katpoint.deg2rad(cache.get(_azel_sensors(name, ant)[0]))
     return sensor_data
 
+
+_calc_azel.dependencies = _azel_sensors
+
 VIRTUAL_SENSORS = dict(DEFAULT_VIRTUAL_SENSORS)
 VIRTUAL_SENSORS.update({'Antennas/{ant}/az': _calc_azel, 'Antennas/{ant}/el': _calc_azel})
 
@@ -131,6 +138,12 @@ def dummy_dataset(name, shape, dtype, value):
     return dummy_file.create_dataset(name, shape=shape, maxshape=shape,
                                      dtype=dtype, fillvalue=value, compression='gzip')
 
+
+def _vis_to_complex(vis, conjugate=False):
+    """Turn block of real/imag float32 pairs into complex64 visibilities."""
+    vis = vis.view(np.complex64)[..., 0]
+    return vis.conj() if conjugate else vis
+
 # -------------------------------------------------------------------------------------------------
 # -- CLASS :  H5DataV2
 # -------------------------------------------------------------------------------------------------
@@ -158,6 +171,12 @@ class H5DataV2(DataSet):
         real timestamps at the cost of slightly inaccurate label borders
     keepdims : {False, True}, optional
         Force vis / weights / flags to be 3-dimensional, regardless of selection
+    dask_vis : {False, True}, optional
+        Expose visibilities as a dask array aligned with the HDF5 chunks, so
+        that each chunk is read once per computation (incompatible with
+        `keepdims`). Weights and flags still use the serial
+        :class:`LazyIndexer`, and the reads do not run in parallel, as h5py
+        serialises them behind a global lock
     kwargs : dict, optional
         Extra keyword arguments, typically meant for other formats and ignored
 
@@ -169,7 +188,7 @@ class H5DataV2(DataSet):
     """
 
     def __init__(self, filename, ref_ant='', time_offset=0.0, mode='r',
-                 quicklook=False, keepdims=False, **kwargs):
+                 quicklook=False, keepdims=False, dask_vis=False, **kwargs):
         DataSet.__init__(self, filename, ref_ant, time_offset)
 
         # Load file
@@ -230,6 +249,9 @@ class H5DataV2(DataSet):
         self.start_time = katpoint.Timestamp(data_timestamps[0] - 0.5 * self.dump_period)
         self.end_time = katpoint.Timestamp(data_timestamps[-1] + 0.5 * self.dump_period)
         self._keepdims = keepdims
+        if dask_vis and keepdims:
+            raise ValueError('The dask_vis and keepdims options cannot be combined')
+        self._vis_dask = dask_array_from_hdf5(self._vis).rechunk({3: -1}) if dask_vis else None
 
         # ------ Extract flags ------
 
@@ -532,6 +554,15 @@ class H5DataV2(DataSet):
         extract_time = LazyTransform('extract_time', lambda t, keep: t + 0.5 * dump_period + time_offset)
         return LazyIndexer(self._timestamps, keep=self._time_keep, transforms=[extract_time])
 
+    def _first_stage_index(self, num_dumps):
+        """First-stage index into vis-like dataset with `num_dumps` dumps."""
+        time_keep = self._time_keep
+        # If there is a duplicate final dump, these lengths don't match -> ignore last dump in file
+        if len(time_keep) == num_dumps - 1:
+            time_keep = np.zeros(num_dumps, dtype=np.bool)
+            time_keep[:len(self._time_keep)] = self._time_keep
+        return (time_keep, self._freq_keep, self._corrprod_keep)
+
     def _vislike_indexer(self, dataset, extractor):
         """Lazy indexer for vis-like datasets (vis / weights / flags).
 
@@ -554,13 +585,7 @@ class H5DataV2(DataSet):
             Lazy indexer with appropriate selectors and transforms included
 
         """
-        # Create first-stage index from dataset selectors
-        time_keep = self._time_keep
-        # If there is a duplicate final dump, these lengths don't match -> ignore last dump in file
-        if len(time_keep) == len(dataset) - 1:
-            time_keep = np.zeros(len(dataset), dtype=np.bool)
-            time_keep[:len(self._time_keep)] = self._time_keep
-        stage1 = (time_keep, self._freq_keep, self._corrprod_keep)
+        stage1 = self._first_stage_index(len(dataset))
 
         def _force_3dim(data, keep):
             """Keep singleton dimensions in stage 2 (i.e. final) indexing."""
@@ -593,6 +618,10 @@ class H5DataV2(DataSet):
         electric field of :math:`e^{i(\omega t - jz)}` i.e. phase that
         increases with time.
         """
+        if self._vis_dask is not None:
+            # The visibilities are conjugated due to using the lower sideband
+            vis = self._vis_dask.map_blocks(_vis_to_complex, True, dtype=np.complex64, drop_axis=3)
+            return DaskLazyIndexer(vis, self._first_stage_index(len(self._vis_dask)))
         extract = LazyTransform('extract_vis',
                                 # Discard the 4th / last dimension as this is subsumed in complex view
                                 # The visibilities are conjugated due to using the lower sideband
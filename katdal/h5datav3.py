@@ -32,7 +32,8 @@ from .dataset import (DataSet, WrongVersion, BrokenFile, Subarray, SpectralWindo
 from .sensordata import (SensorCache, RecordSensorData,
                          H5TelstateSensorData, pickle_loads)
 from .categorical import CategoricalData
-from .lazy_indexer import LazyIndexer, LazyTransform
+from .lazy_indexer import LazyIndexer, LazyTransform, DaskLazyIndexer, dask_array_from_hdf5
+from .h5datav2 import _vis_to_complex
 
 logger = logging.getLogger(__name__)
 
@@ -57,13 +58,20 @@ SENSOR_ALIASES = {
 }
 
 
+def _azel_sensors(name, ant):
+    """Actual sensor behind virtual (az, el) sensor (as a dependency list)."""
+    return ['Antennas/%s/%s' % (ant, 'pos_actual_scan_azim' if name.endswith('az') else 'pos_actual_scan_elev')]
+
+
 def _calc_azel(cache, name, ant):
     """Calculate virtual (az, el) sensors from actual ones in sensor cache."""
-    real_sensor = 'Antennas/%s/%s' % (ant, 'pos_actual_scan_azim' if name.endswith('az') else 'pos_actual_scan_elev')
-    cache[name] = sensor_data = katpoint.deg2rad(cache.get(real_sensor))
+    cache[name] = sensor_data = katpoint.deg2rad(cache.get(_azel_sensors(name, ant)[0]))
     return sensor_data
 
 
+_calc_azel.dependencies = _azel_sensors
+
+
 VIRTUAL_SENSORS = dict(DEFAULT_VIRTUAL_SENSORS)
 VIRTUAL_SENSORS.update({'Antennas/{ant}/az': _calc_azel, 'Antennas/{ant}/el': _calc_azel})
 
@@ -113,6 +121,50 @@ def dummy_dataset(name, shape, dtype, value):
                                      dtype=dtype, fillvalue=value, compression='gzip')
 
 
+class DirectDataset(object):
+    """Read-only HDF5 dataset that reads its raw storage directly.
+
+    This wraps a contiguous, unfiltered (i.e. uncompressed) :class:`h5py.Dataset`
+    and bypasses the h5py / HDF5 selection machinery by memory-mapping the
+    dataset straight from the file. Reads therefore do not hold h5py's global
+    lock. Selections are copied into ordinary arrays. Chunked datasets are not
+    supported, as raw chunk reads are not usable with h5py 2.x on Python 2.
+
+    Parameters
+    ----------
+    dataset : :class:`h5py.Dataset` object
+        Underlying HDF5 dataset
+
+    Raises
+    ------
+    ValueError
+        If the dataset is chunked or filtered or its storage cannot be mapped
+    """
+
+    def __init__(self, dataset):
+        if dataset.chunks is not None:
+            raise ValueError('HDF5 dataset %r is chunked' % (dataset.name,))
+        offset = dataset.id.get_offset()
+        if offset is None:
+            raise ValueError('HDF5 dataset %r has no storage allocated' % (dataset.name,))
+        if dataset.file.driver not in ('sec2', 'stdio'):
+            raise ValueError('HDF5 file %r is not a single file on disk' % (dataset.file.filename,))
+        self.dataset = dataset
+        self.shape = dataset.shape
+        self.dtype = dataset.dtype
+        self.chunks = None
+        self.name = dataset.name
+        self.file = dataset.file
+        self._memmap = np.memmap(dataset.file.filename, self.dtype, 'r', offset, self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        # Copy the selection, as a memmap view has not been read from disk yet
+        return np.array(self._memmap[key])
+
+
 class _AttributeFound(Exception):
     """This indicates that an attribute has been found and contains its value."""
 
@@ -149,6 +201,17 @@ class H5DataV3(DataSet):
         Override receiver band if provided (e.g. 'l') - used to find ND models
     keepdims : {False, True}, optional
         Force vis / weights / flags to be 3-dimensional, regardless of selection
+    dask_vis : {False, True}, optional
+        Expose visibilities as a dask array aligned with the HDF5 chunks, so
+        that each chunk is read once per computation (incompatible with
+        `keepdims`). Weights and flags still use the serial
+        :class:`LazyIndexer`. The visibilities are only read in parallel if
+        `direct_read` is also enabled on a file with contiguous visibilities,
+        as h5py otherwise serialises all reads behind a global lock
+    direct_read : {False, True}, optional
+        Read contiguous, uncompressed visibilities straight from the HDF5
+        storage via :class:`DirectDataset`, which memory-maps them and
+        bypasses h5py (other visibility layouts are read via h5py as usual)
     kwargs : dict, optional
         Extra keyword arguments, typically meant for other formats and ignored
 
@@ -171,7 +234,8 @@ class H5DataV3(DataSet):
 
     def __init__(self, filename, ref_ant='', time_offset=0.0, mode='r',
                  time_scale=None, time_origin=None, rotate_bls=False,
-                 centre_freq=None, band=None, keepdims=False, **kwargs):
+                 centre_freq=None, band=None, keepdims=False, dask_vis=False,
+                 direct_read=False, **kwargs):
         DataSet.__init__(self, filename, ref_ant, time_offset)
 
         # Load file
@@ -240,8 +304,16 @@ class H5DataV3(DataSet):
             self._vis = data_group['correlator_data']
         else:
             raise BrokenFile('File contains no visibility data')
+        if direct_read:
+            try:
+                self._vis = DirectDataset(self._vis)
+            except ValueError as err:
+                logger.warning('Reading visibilities via h5py instead of directly: %s', err)
         self._timestamps = data_group['timestamps'][:]
         self._keepdims = keepdims
+        if dask_vis and keepdims:
+            raise ValueError('The dask_vis and keepdims options cannot be combined')
+        self._vis_dask = dask_array_from_hdf5(self._vis).rechunk({3: -1}) if dask_vis else None
 
         # Resynthesise timestamps from sample counter based on a different
         # scale factor or origin. For this we need to get the CBF scale factor
@@ -941,6 +1013,15 @@ class H5DataV3(DataSet):
         """
         return self._timestamps[self._time_keep]
 
+    def _first_stage_index(self, num_dumps, dims=3):
+        """First-stage index into vis-like dataset with `num_dumps` dumps."""
+        time_keep = self._time_keep
+        # If there is a duplicate final dump, these lengths don't match -> ignore last dump in file
+        if len(time_keep) == num_dumps - 1:
+            time_keep = np.zeros(num_dumps, dtype=np.bool)
+            time_keep[:len(self._time_keep)] = self._time_keep
+        return (time_keep, self._freq_keep, self._corrprod_keep)[:dims]
+
     def _vislike_indexer(self, dataset, extractor=None, dims=3):
         """Lazy indexer for vis-like datasets (vis / weights / flags).
 
@@ -968,13 +1049,7 @@ class H5DataV3(DataSet):
             Lazy indexer with appropriate selectors and transforms included
 
         """
-        # Create first-stage index from dataset selectors
-        time_keep = self._time_keep
-        # If there is a duplicate final dump, these lengths don't match -> ignore last dump in file
-        if len(time_keep) == len(dataset) - 1:
-            time_keep = np.zeros(len(dataset), dtype=np.bool)
-            time_keep[:len(self._time_keep)] = self._time_keep
-        stage1 = (time_keep, self._freq_keep, self._corrprod_keep)[:dims]
+        stage1 = self._first_stage_index(len(dataset), dims)
 
         def _force_full_dim(data, keep):
             """Keep singleton dimensions in stage 2 (i.e. final) indexing."""
@@ -1011,6 +1086,11 @@ class H5DataV3(DataSet):
         electric field of :math:`e^{i(\omega t - jz)}` i.e. phase that
         increases with time.
         """
+        if self._vis_dask is not None:
+            # Lower side-band has the conjugate visibilities (see below)
+            conjugate = self.spectral_windows[self.spw].sideband != 1
+            vis = self._vis_dask.map_blocks(_vis_to_complex, conjugate, dtype=np.complex64, drop_axis=3)
+            return DaskLazyIndexer(vis, self._first_stage_index(len(self._vis_dask)))
         if self.spectral_windows[self.spw].sideband == 1:
             # Discard the 4th / last dimension as this is subsumed in complex view
             convert = lambda vis, keep: vis.view(np.complex64)[..., 0]
@@ -17,13 +17,14 @@
 """Two-stage deferred indexer for objects with expensive __getitem__ calls."""
 
 import copy
+import itertools
 import threading
 
 import numpy as np
 import dask.array as da
 import dask.optimization
-
-# TODO support advanced integer indexing with non-strictly increasing indices (i.e. out-of-order and duplicates)
+import dask.sharedict
+from dask.base import tokenize
 
 
 def _simplify_index(shape, indices):
@@ -71,6 +72,246 @@ def _simplify_index(shape, indices):
     return tuple(out)
 
 
+def _outer_index_plan(chunks, index):
+    """Plan the gathering of integer `index` along an axis with given `chunks`.
+
+    The output positions are split into blocks of consecutive positions,
+    aiming for about the same size as the largest input chunk and avoiding
+    splits inside a run of positions served by the same input chunk.
+
+    Returns
+    -------
+    out_chunks : tuple of int
+        Sizes of output blocks
+    plan : list of list of tuple
+        For each output block, a list of (input chunk number, indices
+        into input chunk, positions in output block) tuples
+    """
+    offsets = np.cumsum((0,) + tuple(chunks))
+    source = np.searchsorted(offsets, index, side='right') - 1
+    target = max(chunks) if len(chunks) else 1
+    # Positions where the input chunk changes (start of each run)
+    run_starts = np.r_[0, np.flatnonzero(np.diff(source)) + 1]
+    block_starts = [0]
+    for run_start in run_starts[1:]:
+        if run_start - block_starts[-1] >= target:
+            block_starts.append(run_start)
+    block_starts.append(len(index))
+    out_chunks, plan = [], []
+    for start, end in zip(block_starts[:-1], block_starts[1:]):
+        block_source = source[start:end]
+        block_plan = []
+        for n in np.unique(block_source):
+            positions = np.flatnonzero(block_source == n)
+            block_plan.append((n, index[start:end][positions] - offsets[n], positions))
+        out_chunks.append(end - start)
+        plan.append(block_plan)
+    if not out_chunks:
+        out_chunks, plan = [0], [[]]
+    return tuple(out_chunks), plan
+
+
+def _gather_block(chunks, selections, shape, dtype):
+    """Assemble output block from input chunks via one fancy index per chunk."""
+    out = np.empty(shape, dtype)
+    for chunk, (select, positions) in zip(chunks, selections):
+        out[np.ix_(*positions)] = chunk[np.ix_(*select)]
+    return out
+
+
+def _dask_oindex(x, index):
+    """Apply orthogonal (outer) index to dask array `x`.
+
+    Each element of `index` is applied independently to its own axis, as in
+    :class:`LazyIndexer`. Slices and scalars are handled by dask itself,
+    which also copes with a single increasing integer (or boolean) index.
+    Any other combination of integer or boolean indices, including unsorted
+    or repeated integers, results in one task per output block that extracts
+    the required elements from each of its input chunks with a single fancy
+    index and inserts them into the output. Each input chunk is therefore
+    only retrieved once per output block, regardless of the number of axes
+    with fancy indices.
+
+    Parameters
+    ----------
+    x : :class:`dask.array.Array` object
+        Array to be indexed
+    index : tuple
+        Index expression with one element per axis (missing axes are
+        selected in full)
+
+    Returns
+    -------
+    out : :class:`dask.array.Array` object
+        Indexed array
+
+    Raises
+    ------
+    IndexError
+        If a fancy index has the wrong length (booleans) or is out of bounds
+    ValueError
+        If a fancy index has more than one dimension
+    """
+    if not isinstance(index, tuple):
+        index = (index,)
+    if any(k is np.newaxis or k is Ellipsis for k in index) or len(index) > x.ndim:
+        return x[index]
+    normalised = []
+    for k in index:
+        if not (isinstance(k, slice) or np.isscalar(k)):
+            k = np.asarray(k)
+            if k.ndim == 0 and k.dtype != np.bool_:
+                # A 0-d integer array acts like an integer and drops its axis
+                k = k.item()
+            elif k.ndim > 1:
+                raise ValueError('Fancy index must be 1-dimensional, not shape {}'.format(k.shape))
+        normalised.append(k)
+    index = tuple(normalised)
+    basic, fancy = [], []
+    for k in index:
+        if isinstance(k, slice) or np.isscalar(k):
+            basic.append(k)
+            if not np.isscalar(k):
+                fancy.append(None)
+        else:
+            basic.append(slice(None))
+            fancy.append(np.asarray(k))
+    fancy += [None] * (x.ndim - len(index))
+    arrays = [k for k in fancy if k is not None]
+    if not arrays or (len(arrays) == 1 and arrays[0].ndim == 1 and
+                      (arrays[0].dtype == np.bool_ or np.all(np.diff(arrays[0]) > 0))):
+        return x[index]
+    # Let dask do the basic indexing first, which drops scalar dimensions
+    x = x[tuple(basic)]
+    out_chunks, plans = [], []
+    for axis, (k, chunks) in enumerate(zip(fancy, x.chunks)):
+        if k is None:
+            out_chunks.append(chunks)
+            plans.append([[(n, np.arange(c), np.arange(c))] for n, c in enumerate(chunks)])
+            continue
+        length = x.shape[axis]
+        if k.dtype == np.bool_:
+            if k.shape != (length,):
+                raise IndexError('Boolean index of length {} does not match axis {} '
+                                 'of length {}'.format(len(k), axis, length))
+            k = np.flatnonzero(k)
+        k = k.astype(np.int_)
+        if k.size and (k.min() < -length or k.max() >= length):
+            raise IndexError('Index out of bounds for axis {} of length {}'.format(axis, length))
+        k = np.where(k < 0, k + length, k)
+        axis_chunks, axis_plan = _outer_index_plan(chunks, k)
+        out_chunks.append(axis_chunks)
+        plans.append(axis_plan)
+    name = 'oindex-' + tokenize(x, *fancy)
+    graph = {}
+    for block_id in itertools.product(*[range(len(plan)) for plan in plans]):
+        keys, selections = [], []
+        for parts in itertools.product(*[plan[n] for plan, n in zip(plans, block_id)]):
+            keys.append((x.name,) + tuple(part[0] for part in parts))
+            selections.append((tuple(part[1] for part in parts), tuple(part[2] for part in parts)))
+        shape = tuple(c[n] for c, n in zip(out_chunks, block_id))
+        graph[(name,) + block_id] = (_gather_block, keys, tuple(selections), shape, x.dtype)
+    dsk = dask.sharedict.merge(x.dask, (name, graph))
+    return da.Array(dsk, name, tuple(out_chunks), x.dtype)
+
+
+def _segments(indices):
+    """Split sorted unique integer indices into contiguous segments.
+
+    Returns arrays of segment starts and stops (one past the last index).
+    """
+    jumps = np.nonzero(np.diff(indices) > 1)[0]
+    starts = np.r_[indices[0], indices[jumps + 1]]
+    stops = np.r_[indices[jumps], indices[-1]] + 1
+    return starts, stops
+
+
+def _hdf5_chunk_shape(dataset):
+    """Chunk shape of an HDF5-like dataset, or None if it is not chunked."""
+    chunks = getattr(dataset, 'chunks', None)
+    if isinstance(chunks, tuple) and all(isinstance(c, (int, long, np.integer)) for c in chunks):
+        return chunks
+    return None
+
+
+def _merge_segments(reads, itemsize, chunk_shape=None, read_overhead=0):
+    """Merge segments to be read along each dimension according to a cost model.
+
+    Reading the selection takes one read per combination of segments across
+    the dimensions. The cost model charges `read_overhead` bytes for each of
+    these reads plus the bytes actually read. Merging two adjacent segments
+    along a dimension reduces the number of reads but also reads the gap in
+    between. The cheapest gaps are merged greedily until no merge reduces the
+    total cost. If the dataset is chunked, only gaps spanning whole chunks
+    count, as the chunks on either side of the gap are read in full anyway.
+
+    Parameters
+    ----------
+    reads : list
+        Selection per dimension, either a scalar or slice (read in one go) or
+        a tuple of (starts, stops) arrays of contiguous segments
+    itemsize : int
+        Number of bytes per element of the dataset
+    chunk_shape : tuple of int or None, optional
+        Chunk shape of dataset (None if the dataset is not chunked)
+    read_overhead : float, optional
+        Fixed cost of a single read, in bytes
+
+    Returns
+    -------
+    reads : list
+        Selection per dimension with merged (starts, stops) segment arrays
+    """
+    count, span, gaps = [], [], []
+    for dim, read in enumerate(reads):
+        if np.isscalar(read):
+            count.append(1)
+            span.append(1)
+        elif isinstance(read, slice):
+            count.append(1)
+            span.append(len(range(read.start, read.stop, read.step)))
+        else:
+            starts, stops = read
+            count.append(len(starts))
+            span.append(int(np.sum(stops - starts)))
+            if len(starts) < 2:
+                continue
+            gap = starts[1:] - stops[:-1]
+            if chunk_shape is not None:
+                chunk = chunk_shape[dim]
+                skipped = starts[1:] // chunk - (stops[:-1] - 1) // chunk - 1
+                cost = np.maximum(skipped, 0) * chunk
+            else:
+                cost = gap
+            gaps.append((dim, np.argsort(cost, kind='mergesort'), cost, gap))
+    merged = {dim: np.zeros(len(gap), dtype=np.bool_) for dim, _, _, gap in gaps}
+    position = dict((dim, 0) for dim, _, _, _ in gaps)
+    while True:
+        best_delta, best = 0., None
+        for dim, order, cost, gap in gaps:
+            if position[dim] >= len(order):
+                continue
+            n = order[position[dim]]
+            other_count = np.prod(count[:dim] + count[dim + 1:], dtype=np.float64)
+            other_span = np.prod(span[:dim] + span[dim + 1:], dtype=np.float64)
+            delta = cost[n] * itemsize * other_span - read_overhead * other_count
+            # Gaps that cost nothing to read are merged even without overhead
+            if delta < best_delta or (best is None and delta == 0 and cost[n] == 0):
+                best_delta, best = delta, (dim, n, gap[n])
+        if best is None:
+            break
+        dim, n, gap_size = best
+        merged[dim][n] = True
+        position[dim] += 1
+        count[dim] -= 1
+        span[dim] += int(gap_size)
+    reads = list(reads)
+    for dim, mask in merged.items():
+        starts, stops = reads[dim]
+        reads[dim] = (starts[np.r_[True, ~mask]], stops[np.r_[~mask, True]])
+    return reads
+
+
 # -------------------------------------------------------------------------------------------------
 # -- CLASS :  LazyTransform
 # -------------------------------------------------------------------------------------------------
@@ -162,7 +403,12 @@ class LazyIndexer(object):
     of the dimension to alleviate issue 2. Finally, this also allows faster
     data retrieval by extracting a large slice from the HDF5 dataset and then
     performing advanced indexing on the resulting :class:`numpy.ndarray` object
-    instead, in response to issue 3.
+    instead, in response to issue 3. A simple cost model decides which nearby
+    segments to merge into larger slices, weighing the fixed cost of each read
+    (see :attr:`read_overhead`) against the extra data read, and taking the
+    chunk layout of the HDF5 dataset into account. The requested elements are
+    then picked out of the read data with a single advanced indexing step,
+    which also allows integer indices that are unsorted or repeated.
 
     The `keep` parameter of the :meth:`__init__` and :meth:`__getitem__` methods
     accepts a generic index or slice specification, i.e. anything that would be
@@ -200,6 +446,10 @@ class LazyIndexer(object):
 
     """
 
+    # Fixed cost of a single read from the dataset, expressed as the number of
+    # bytes that could be read instead (used to decide on merging segments)
+    read_overhead = 65536
+
     def __init__(self, dataset, keep=slice(None), transforms=None):
         self.dataset = dataset
         self.transforms = [] if transforms is None else transforms
@@ -285,83 +535,65 @@ class LazyIndexer(object):
         keep = keep[:ndim] + [slice(None)] * (ndim - len(keep))
         # Map current selection to original data indices based on any existing initial selection, per data dimension
         keep = [(dkeep if dlookup is None else dlookup[dkeep]) for dkeep, dlookup in zip(keep, self._lookup)]
-        # Iterate over dimensions of dataset, storing information on selection on each dimension:
-        # `selection` is a list with one element per dimension; each element is a list of contiguous segments along
-        # the dimension, and each segment is represented by a tuple of 3 elements:
-        # (dataset selection, post-selection, output array selection)
-        # Similarly, `segment_sizes` is a list of lists of segment lengths (empty lists for scalar-selected dimensions)
-        selection, segment_sizes = [], []
+        # Iterate over dimensions of dataset, describing the selection on each dimension by `reads`, which is either
+        # a scalar or slice passed directly to the dataset, or the (starts, stops) arrays of contiguous segments to
+        # read, and `wanted`, the requested integer indices into the dataset for advanced indexing (else None)
+        reads, wanted = [], []
         for dim_keep, dim_len in zip(keep, self.dataset.shape):
-            if np.isscalar(dim_keep):
-                # If selection is a scalar, pass directly to dataset selector and remove dimension from output
-                selection.append([(dim_keep, None, None)])
-                segment_sizes.append([])
-            elif isinstance(dim_keep, slice):
-                # If selection is a slice, pass directly to dataset selector without post-selection
-                start, stop, stride = dim_keep.indices(dim_len)
-                segm_size = len(range(start, stop, stride))
-                selection.append([(slice(start, stop, stride), slice(None), slice(0, segm_size, 1))])
-                segment_sizes.append([segm_size])
-            elif len(dim_keep) == 0:
-                # If selection is empty, pass to post-selector, as HDF5 datasets do not support zero-length selection
-                selection.append([(slice(0, 1, 1), slice(0, 0, 1), slice(0, 0, 1))])
-                segment_sizes.append([0])
+            if np.isscalar(dim_keep) or isinstance(dim_keep, slice):
+                # Pass scalars (which remove the dimension from output) and slices directly to dataset selector
+                if isinstance(dim_keep, slice):
+                    dim_keep = slice(*dim_keep.indices(dim_len))
+                reads.append(dim_keep)
+                wanted.append(None)
             else:
                 # Anything else is advanced indexing via bool or integer sequences
                 dim_keep = np.atleast_1d(dim_keep)
                 # Turn boolean mask into integer indices (True means keep that index)
                 if dim_keep.dtype == np.bool and len(dim_keep) == dim_len:
                     dim_keep = np.nonzero(dim_keep)[0]
-                elif not np.all(dim_keep == np.unique(dim_keep)):
-                    raise TypeError('LazyIndexer cannot handle duplicate or unsorted advanced integer indices')
-                # Split indices into multiple contiguous segments (specified by first and one-past-last data indices)
-                jumps = np.nonzero(np.diff(dim_keep) > 1)[0]
-                first = [dim_keep[0]] + dim_keep[jumps + 1].tolist()
-                last = dim_keep[jumps].tolist() + [dim_keep[-1]]
-                segments = np.c_[first, np.array(last) + 1]
-                if len(dim_keep) > 0.2 * dim_len and len(segments) > 1:
-                    # If more than 20% of data are selected in 2 or more separate segments (the Ratcliffian benchmark),
-                    # select data at dataset level with a single slice spanning segments and then postselect the ndarray
-                    selection.append([(slice(segments[0, 0], segments[-1, 1], 1),
-                                       dim_keep - dim_keep[0], slice(0, len(dim_keep), 1))])
-                    segment_sizes.append([len(dim_keep)])
-                else:
-                    # Turn each segment into a separate slice at dataset level without post-selection,
-                    # and construct contiguous output slices of the same segment sizes
-                    segm_sizes = [end - start for start, end in segments]
-                    segm_starts = np.cumsum([0] + segm_sizes)
-                    selection.append([(slice(start, end, 1), slice(None), slice(segm_starts[n], segm_starts[n + 1], 1))
-                                      for n, (start, end) in enumerate(segments)])
-                    segment_sizes.append(segm_sizes)
+                dim_keep = np.where(dim_keep < 0, dim_keep + dim_len, dim_keep)
+                # Read each contiguous segment of the sorted unique indices (duplicates and order are restored later)
+                reads.append(_segments(np.unique(dim_keep)) if len(dim_keep) else
+                             (np.zeros(0, dtype=np.int_), np.zeros(0, dtype=np.int_)))
+                wanted.append(dim_keep)
         # Short-circuit the selection if all dimensions are selected with scalars (resulting in a scalar output)
-        if segment_sizes == [[]] * ndim:
-            out_data = self.dataset[tuple([select[0][0] for select in selection])]
+        if all(np.isscalar(read) for read in reads):
+            out_data = self.dataset[tuple(reads)]
         else:
-            # Use dense N-dimensional meshgrid to slice data set into chunks, based on segments along each dimension
-            chunk_indices = np.mgrid[[slice(0, len(select), 1) for select in selection]]
-            # Pre-allocate output ndarray to have the correct shape and dtype (will be at least 1-dimensional)
-            out_data = np.empty([np.sum(segments) for segments in segment_sizes if segments], dtype=self.dataset.dtype)
-            # Iterate over chunks, extracting them from dataset and inserting them into the right spot in output array
-            for chunk_index in chunk_indices.reshape(ndim, -1).T:
-                # Extract chunk from dataset (don't use any advanced indexing here, only scalars and slices)
-                dataset_select = tuple([select[segment][0] for select, segment in zip(selection, chunk_index)])
-                chunk = self.dataset[dataset_select]
-                # Perform post-selection on chunk (can be fancier / advanced indexing because chunk is now an ndarray)
-                post_select = [select[segment][1] for select, segment in zip(selection, chunk_index)]
-                # If any dimensions were dropped due to scalar indexing, drop them from post_select/out_select tuples
-                post_select = tuple([select for select in post_select if select is not None])
-                # Do post-selection one dimension at a time, as ndarray does not allow simultaneous advanced indexing
-                # on more than one dimension. This caters for the scenario where more than one dimension satisfies
-                # the Ratcliffian benchmark (the only way to get advanced post-selection).
-                for dim in range(len(chunk.shape)):
-                    # Only do post-selection on this dimension if non-trivial (otherwise an unnecessary copy happens)
-                    if not (isinstance(post_select[dim], slice) and post_select[dim] == slice(None)):
-                        # Prepend the appropriate number of colons to the selection to place it at correct dimension
-                        chunk = chunk[[slice(None)] * dim + [post_select[dim]]]
-                # Determine appropriate output selection and insert chunk into output array
-                out_select = [select[segment][2] for select, segment in zip(selection, chunk_index)]
-                out_select = tuple([select for select in out_select if select is not None])
-                out_data[out_select] = chunk
+            # Merge segments where fewer, larger reads are expected to be cheaper
+            reads = _merge_segments(reads, self.dataset.dtype.itemsize,
+                                    _hdf5_chunk_shape(self.dataset), self.read_overhead)
+            # Each read goes into a buffer holding the concatenation of segments along each dimension
+            read_selects, buffer_selects, gather = [], [], []
+            for read, dim_wanted in zip(reads, wanted):
+                if np.isscalar(read):
+                    read_selects.append([read])
+                    continue
+                elif isinstance(read, slice):
+                    size = len(range(read.start, read.stop, read.step))
+                    read_selects.append([read])
+                    buffer_selects.append([slice(0, size)])
+                    gather.append(np.arange(size))
+                    continue
+                starts, stops = read
+                offsets = np.r_[0, np.cumsum(stops - starts)]
+                read_selects.append([slice(start, stop) for start, stop in zip(starts, stops)])
+                buffer_selects.append([slice(offsets[n], offsets[n + 1]) for n in range(len(starts))])
+                segment = np.searchsorted(starts, dim_wanted, side='right') - 1
+                gather.append(offsets[segment] + dim_wanted - starts[segment] if len(dim_wanted) else dim_wanted)
+            buffer = np.empty([select[-1].stop if select else 0 for select in buffer_selects],
+                              dtype=self.dataset.dtype)
+            # HDF5 datasets do not support zero-length selections, so only read if there is something to read
+            if buffer.size:
+                for read_select, buffer_select in zip(itertools.product(*read_selects),
+                                                      itertools.product(*buffer_selects)):
+                    buffer[buffer_select] = self.dataset[read_select]
+            # Perform a single final gather if the buffer holds anything other than the requested output
+            if all(len(g) == size and np.all(g == np.arange(size)) for g, size in zip(gather, buffer.shape)):
+                out_data = buffer
+            else:
+                out_data = buffer[np.ix_(*gather)]
         # Apply transform chain to output data, if any
         return reduce(lambda data, transform: transform(data, original_keep), self.transforms, out_data)
 
@@ -389,9 +621,11 @@ class DaskLazyIndexer(object):
     The internals are computed only on first use, so there is minimal
     cost in constructing an instance and immediately throwing it away again.
 
-    Fancy indexing is supported but much slower. However, a boolean array
-    for which a contiguous interval of values is selected is treated as a
-    special case and becomes a slice.
+    Fancy indexing is supported on any number of axes, applied independently
+    per axis (outer indexing), and integer indices may be unsorted or
+    repeated. It is slower than slicing, though. A boolean array for which a
+    contiguous interval of values is selected is treated as a special case
+    and becomes a slice.
 
     Parameters
     ----------
@@ -431,13 +665,7 @@ class DaskLazyIndexer(object):
     def dataset(self):
         with self._lock:
             if self._dataset is None:
-                try:
-                    dataset = self._orig_dataset[self.keep]
-                except NotImplementedError:
-                    # Dask does not like multiple boolean indices: go one dim at a time
-                    dataset = self._orig_dataset
-                    for dim, keep_per_dim in enumerate(self.keep):
-                        dataset = da.take(dataset, keep_per_dim, axis=dim)
+                dataset = _dask_oindex(self._orig_dataset, self.keep)
                 for transform in self.transforms:
                     dataset = transform(dataset)
                 self._dataset = dataset
@@ -447,7 +675,8 @@ class DaskLazyIndexer(object):
     def dask_getitem(self, keep):
         """Index the array and return a dask array.
 
-        This is functionally equivalent to ``self.dataset[keep]``, but it culls
+        This is functionally equivalent to ``self.dataset[keep]``, except that
+        fancy indices are applied independently per axis, and it culls
         unnecessary nodes from the graph, which makes it cheaper to compute if
         only a small piece of the graph is needed.
         """
@@ -455,7 +684,7 @@ class DaskLazyIndexer(object):
         # ensure_dict, which copies all the keys, presumably to speed up the
         # case where most keys are retained. A lazy indexer is normally used to
         # fetch a small part of the data.
-        kept = self.dataset[keep]
+        kept = _dask_oindex(self.dataset, keep)
         kept.dask = dask.optimization.cull(kept.dask, kept.__dask_keys__())[0]
         return kept
 
@@ -484,3 +713,37 @@ class DaskLazyIndexer(object):
     @property
     def dtype(self):
         return self.dataset.dtype
+
+
+def dask_array_from_hdf5(dataset, chunk_bytes=16 * 1024 ** 2):
+    """Turn HDF5 dataset (or equivalent) into dask array aligned with its chunks.
+
+    Each dask chunk consists of a whole number of HDF5 chunks, so that every
+    HDF5 chunk is read (and decompressed) by a single task. The HDF5 chunks
+    are grouped along the first dimension until the dask chunk reaches about
+    `chunk_bytes` bytes. If the dataset is not chunked, it is split along the
+    first dimension only, which keeps each read contiguous on disk.
+
+    Parameters
+    ----------
+    dataset : :class:`h5py.Dataset` object or equivalent
+        Underlying dataset, with `shape`, `dtype` and `__getitem__` members
+        (and optionally `chunks`, `name` and `file`)
+    chunk_bytes : int, optional
+        Approximate number of bytes per dask chunk
+
+    Returns
+    -------
+    array : :class:`dask.array.Array` object
+        Dask array that reads from `dataset` upon computation
+    """
+    shape = dataset.shape
+    base = _hdf5_chunk_shape(dataset) or (1,) + tuple(shape[1:])
+    base_bytes = max(int(np.prod(base)) * dataset.dtype.itemsize, 1)
+    # Keep the dask chunk at least one HDF5 chunk along the first dimension
+    multiple = max(chunk_bytes // base_bytes, 1)
+    chunks = (min(base[0] * multiple, max(shape[0], 1)),) + tuple(base[1:])
+    filename = getattr(getattr(dataset, 'file', None), 'filename', '')
+    name = 'hdf5-' + tokenize(filename, getattr(dataset, 'name', ''), shape, chunks)
+    # h5py serialises access to the HDF5 library internally, so no extra lock
+    return da.from_array(dataset, chunks, name=name, lock=False)
@@ -31,9 +31,112 @@ import multiprocessing
 import multiprocessing.sharedctypes
 
 import numpy as np
+import numba
 import katpoint
 
 from . import ms_extra
+from .dataset import utc_to_mjd
+
+
+# Output tile size in baselines and channels: the input rows of a channel
+# tile and the output of a baseline tile should stay in cache
+PERMUTE_BL_STEP = 16
+PERMUTE_CHAN_STEP = 128
+
+
+@numba.jit(nopython=True)
+def _permute_baseline_tile(in_vis, in_weights, in_flags_u8, cp_index, out_vis, out_weights, out_flags_u8,
+                           t, b, cstart, cstop):
+    """Copy a tile of channels for a single output baseline and time."""
+    n_pols = out_vis.shape[3]
+    if n_pols == 4 and cp_index[b, 0] >= 0 and cp_index[b, 1] >= 0 \
+            and cp_index[b, 2] >= 0 and cp_index[b, 3] >= 0:
+        # Common case of full polarisation with all products present, unrolled
+        i0 = cp_index[b, 0]
+        i1 = cp_index[b, 1]
+        i2 = cp_index[b, 2]
+        i3 = cp_index[b, 3]
+        for c in range(cstart, cstop):
+            out_vis[t, b, c, 0] = in_vis[t, c, i0]
+            out_vis[t, b, c, 1] = in_vis[t, c, i1]
+            out_vis[t, b, c, 2] = in_vis[t, c, i2]
+            out_vis[t, b, c, 3] = in_vis[t, c, i3]
+            out_weights[t, b, c, 0] = in_weights[t, c, i0]
+            out_weights[t, b, c, 1] = in_weights[t, c, i1]
+            out_weights[t, b, c, 2] = in_weights[t, c, i2]
+            out_weights[t, b, c, 3] = in_weights[t, c, i3]
+            out_flags_u8[t, b, c, 0] = in_flags_u8[t, c, i0]
+            out_flags_u8[t, b, c, 1] = in_flags_u8[t, c, i1]
+            out_flags_u8[t, b, c, 2] = in_flags_u8[t, c, i2]
+            out_flags_u8[t, b, c, 3] = in_flags_u8[t, c, i3]
+    else:
+        for c in range(cstart, cstop):
+            for p in range(n_pols):
+                idx = cp_index[b, p]
+                if idx >= 0:
+                    out_vis[t, b, c, p] = in_vis[t, c, idx]
+                    out_weights[t, b, c, p] = in_weights[t, c, idx]
+                    out_flags_u8[t, b, c, p] = in_flags_u8[t, c, idx]
+                else:
+                    out_vis[t, b, c, p] = 0
+                    out_weights[t, b, c, p] = 0
+                    out_flags_u8[t, b, c, p] = 1
+
+
+@numba.jit(nopython=True, parallel=True)
+def permute_baselines(in_vis, in_weights, in_flags, cp_index, out_vis, out_weights, out_flags):
+    """Reorganise baselines and axis order.
+
+    The inputs have dimensions (time, channel, pol-baseline), and the output has shape
+    (time, baseline, channel, pol). cp_index is a 2D array which is indexed by baseline and
+    pol to get the input pol-baseline.
+
+    cp_index may contain negative indices if the data is not present, in which
+    case it is filled with 0s and flagged.
+
+    The output is processed in tiles of baselines and channels, with the
+    tiles of all dumps spread over the threads (so that a single dump still
+    runs in parallel). The loop over polarisations is unrolled for the
+    common case of four polarisation products that are all present.
+    """
+    # Workaround for https://github.com/numba/numba/issues/2921
+    in_flags_u8 = in_flags.view(np.uint8)
+    out_flags_u8 = out_flags.view(np.uint8)
+    n_time, n_bls, n_chans, n_pols = out_vis.shape
+    if n_bls <= PERMUTE_BL_STEP:
+        # A single baseline tile gains nothing from tiling channels, so copy
+        # whole input rows in channel order instead, spreading channel blocks
+        # over the threads.
+        cblocks = (n_chans + PERMUTE_CHAN_STEP - 1) // PERMUTE_CHAN_STEP
+        for i in numba.prange(n_time * cblocks):
+            t, cblock = divmod(np.int64(i), cblocks)
+            cstart = cblock * PERMUTE_CHAN_STEP
+            cstop = min(n_chans, cstart + PERMUTE_CHAN_STEP)
+            for c in range(cstart, cstop):
+                for b in range(n_bls):
+                    for p in range(n_pols):
+                        idx = cp_index[b, p]
+                        if idx >= 0:
+                            out_vis[t, b, c, p] = in_vis[t, c, idx]
+                            out_weights[t, b, c, p] = in_weights[t, c, idx]
+                            out_flags_u8[t, b, c, p] = in_flags_u8[t, c, idx]
+                        else:
+                            out_vis[t, b, c, p] = 0
+                            out_weights[t, b, c, p] = 0
+                            out_flags_u8[t, b, c, p] = 1
+        return out_vis, out_weights, out_flags
+    bblocks = (n_bls + PERMUTE_BL_STEP - 1) // PERMUTE_BL_STEP
+    for i in numba.prange(n_time * bblocks):
+        # The prange index is unsigned, which turns mixed integer division into float
+        t, bblock = divmod(np.int64(i), bblocks)
+        bstart = bblock * PERMUTE_BL_STEP
+        bstop = min(n_bls, bstart + PERMUTE_BL_STEP)
+        for cstart in range(0, n_chans, PERMUTE_CHAN_STEP):
+            cstop = min(n_chans, cstart + PERMUTE_CHAN_STEP)
+            for b in range(bstart, bstop):
+                _permute_baseline_tile(in_vis, in_weights, in_flags_u8, cp_index,
+                                       out_vis, out_weights, out_flags_u8, t, b, cstart, cstop)
+    return out_vis, out_weights, out_flags
 
 
 class RawArray(object):
@@ -147,8 +250,7 @@ def ms_writer_process(
 
                     # Convert averaged UTC timestamps to MJD seconds.
                     # Blow time up to (ntime*nbl,)
-                    out_mjd = np.asarray([katpoint.Timestamp(t).to_mjd() * 24 * 60 * 60
-                                          for t in item.time_utc])
+                    out_mjd = utc_to_mjd(item.time_utc) * 24 * 60 * 60
 
                     out_mjd = np.broadcast_to(out_mjd[:, np.newaxis], (tdiff, nbl)).ravel()
 
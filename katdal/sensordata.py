@@ -19,6 +19,7 @@
 import logging
 import re
 import cPickle as pickle
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
 import katpoint
@@ -50,6 +51,9 @@ try:
 except ImportError:
     PiecewisePolynomial1DFit = None
 
+# Default maximum number of threads loading raw sensor data in SensorCache.get_many
+SENSOR_LOAD_THREADS = 8
+
 # -------------------------------------------------------------------------------------------------
 # -- CLASS :  SensorData
 # -------------------------------------------------------------------------------------------------
@@ -278,6 +282,9 @@ class TelstateSensorData(SensorData):
     replaced by either a CategoricalData object or a NumPy array as part of
     sensor extraction, right after the caching occurs.
 
+    The data is cached as a pair of read-only NumPy arrays (timestamps and
+    values) that are returned as is on every item access.
+
     """
 
     def __init__(self, telstate, name):
@@ -300,22 +307,29 @@ class TelstateSensorData(SensorData):
     __nonzero__ = __bool__
 
     def _cache_data(self):
-        if not self._times:
+        if self._times is None:
             value_times = self._telstate.get_range(self.name, st=0)
-            self._values = [v for v, t in value_times]
-            self.dtype = infer_dtype(self._values)
+            values = [v for v, t in value_times]
+            self.dtype = infer_dtype(values)
             if self.dtype == np.object:
-                self._values = [ComparableArrayWrapper(v) for v in self._values]
-            self._times = [t for v, t in value_times]
+                wrapped = np.empty(len(values), dtype=object)
+                for n, v in enumerate(values):
+                    wrapped[n] = ComparableArrayWrapper(v)
+                values = wrapped
+            else:
+                values = np.array(values)
+            times = np.fromiter((t for v, t in value_times), dtype=np.float64, count=len(value_times))
+            values.flags.writeable = times.flags.writeable = False
+            self._values, self._times = values, times
 
     def __getitem__(self, key):
         """Extract timestamp and value of each sensor data point."""
         if key == 'timestamp':
             self._cache_data()
-            return np.array(self._times)
+            return self._times
         elif key == 'value':
             self._cache_data()
-            return np.array(self._values)
+            return self._values
         else:
             raise ValueError("Sensor %r data has no key '%s'" % (self.name, key))
 
@@ -342,14 +356,15 @@ def _safe_linear_interp(xi, yi, x):
     xi : array, shape (N,)
         Array of fixed x-coordinates, sorted in ascending order and with no
         duplicate values
-    yi : array, shape (N,)
-        Corresponding array of fixed y-coordinates
+    yi : array, shape (N,) or (N, K)
+        Corresponding array of fixed y-coordinates (or K columns of them,
+        which are interpolated together if `x` is 1-D)
     x : float or array, shape (M,)
         Array of x-coordinates at which to do interpolation of y-values
 
     Returns
     -------
-    y : float or array, shape (M,)
+    y : float or array, shape (M,) or (M, K)
         Array of interpolated y-values
 
     Notes
@@ -361,7 +376,7 @@ def _safe_linear_interp(xi, yi, x):
     # Do zeroth-order interpolation for a single fixed (x, y) coordinate
     if len(xi) == 1:
         # The simplest way to handle x of e.g. 3, np.array(3) and [1, 2, 3]
-        return yi[0] * np.ones_like(x)
+        return np.multiply.outer(np.ones_like(x), yi[0])
     # Find lowest xi value >= x (end of segment containing x)
     end = np.atleast_1d(xi.searchsorted(x))
     # Associate any x found outside xi range with closest segment (first or last one)
@@ -375,6 +390,8 @@ def _safe_linear_interp(xi, yi, x):
     end_weight = (x - xi[start]) / (xi[end] - xi[start])
     # Do zeroth-order interpolation beyond the range of xi
     end_weight = np.clip(end_weight, 0.0, 1.0)
+    # Apply the same weights to all columns of yi
+    end_weight = np.reshape(end_weight, np.shape(end_weight) + (1,) * (np.ndim(yi) - 1))
     return (1.0 - end_weight) * yi[start] + end_weight * yi[end]
 
 
@@ -462,32 +479,38 @@ def remove_duplicates_and_invalid_values(sensor):
     except ValueError:
         z = None
     # Sort x via mergesort, as it is usually already sorted and stability is important
-    sort_ind = np.argsort(x, kind='mergesort')
-    x, y = x[sort_ind], y[sort_ind]
+    if not np.all(x[1:] >= x[:-1]):
+        sort_ind = np.argsort(x, kind='mergesort')
+        x, y = x[sort_ind], y[sort_ind]
+        z = z[sort_ind] if z is not None else None
     # Array contains True where an x value is unique or the last of a run of identical x values
-    last_of_run = np.asarray(list(np.diff(x) != 0) + [True])
+    last_of_run = np.r_[x[1:] != x[:-1], True]
     # Discard the False values, as they represent duplicates - simultaneously keep last of each run of duplicates
     unique_ind = last_of_run.nonzero()[0]
-    # Determine the index of the x value chosen to represent each original x value (used to pick y values too)
-    replacement = unique_ind[len(unique_ind) - np.cumsum(last_of_run[::-1])[::-1]]
     # All duplicates should have the same y and z values - complain otherwise, but continue
-    y_differs = [n for (r, n) in zip(replacement, range(len(y))) if y[r] != y[n]]
-    if y_differs:
-        logger.debug("Sensor %r has duplicate timestamps with different values",
-                     sensor.name)
-        for ind in y_differs:
-            logger.debug("At %s, sensor %r has values of %s and %s - "
-                         "keeping last one", katpoint.Timestamp(x[ind]).local(),
-                         sensor.name, y[ind], y[replacement[ind]])
-    if z is not None:
-        z_differs = [n for (r, n) in zip(replacement, range(len(z))) if z[r] != z[n]]
-        if z_differs:
-            logger.debug("Sensor %r has duplicate timestamps with different statuses",
+    duplicate_ind = (~last_of_run).nonzero()[0]
+    if len(duplicate_ind):
+        # Determine the index of the x value chosen to represent each duplicate x value (used to pick y values too)
+        replacement = unique_ind[np.searchsorted(unique_ind, duplicate_ind)]
+        # Only describe each duplicate if anyone is listening, as this is slow for high-rate sensors
+        verbose = logger.isEnabledFor(logging.DEBUG)
+        y_mask = y[replacement] != y[duplicate_ind]
+        if verbose and y_mask.any():
+            logger.debug("Sensor %r has duplicate timestamps with different values",
                          sensor.name)
-            for ind in z_differs:
-                logger.debug("At %s, sensor %r has statuses of %r and %r - "
+            for ind, rep in zip(duplicate_ind[y_mask], replacement[y_mask]):
+                logger.debug("At %s, sensor %r has values of %s and %s - "
                              "keeping last one", katpoint.Timestamp(x[ind]).local(),
-                             sensor.name, z[ind], z[replacement[ind]])
+                             sensor.name, y[ind], y[rep])
+        if z is not None:
+            z_mask = z[replacement] != z[duplicate_ind]
+            if verbose and z_mask.any():
+                logger.debug("Sensor %r has duplicate timestamps with different statuses",
+                             sensor.name)
+                for ind, rep in zip(duplicate_ind[z_mask], replacement[z_mask]):
+                    logger.debug("At %s, sensor %r has statuses of %r and %r - "
+                                 "keeping last one", katpoint.Timestamp(x[ind]).local(),
+                                 sensor.name, z[ind], z[rep])
     # Remove entries where 'status' implies invalid values, if 'status' is present
     if z is not None:
         # Explicitly cast status to string type, as k7_augment produced sensors with integer statuses
@@ -495,10 +518,84 @@ def remove_duplicates_and_invalid_values(sensor):
         unique_ind = unique_ind[(status == 'nominal') | (status == 'warn') |
                                 (status == 'error')]
     # Strip 'status' / z field from final output as its job is done
-    data = np.array(zip(x[unique_ind], y[unique_ind]),
-                    dtype=[('timestamp', x.dtype), ('value', y.dtype)])
+    data = np.empty(len(unique_ind), dtype=[('timestamp', x.dtype), ('value', y.dtype)])
+    data['timestamp'] = x[unique_ind]
+    data['value'] = y[unique_ind]
     return RecordSensorData(data, sensor.name)
 
+# -------------------------------------------------------------------------------------------------
+# -- CLASS :  VirtualSensorTable
+# -------------------------------------------------------------------------------------------------
+
+
+class VirtualSensorTable(object):
+    """Dispatch table that matches sensor names to virtual sensor templates.
+
+    Each template is a regular expression in which variable names enclosed in
+    braces match a single sensor name component (e.g. 'Antennas/{ant}/az').
+    The templates are converted and compiled once, and combined into as few
+    alternations as the regular expression engine allows, so that a sensor
+    name is matched against all templates in a single pass. As with separate
+    :func:`re.match` calls, the first template (in order) to match a prefix
+    of the sensor name wins.
+
+    Parameters
+    ----------
+    templates : sequence of string
+        Virtual sensor templates, in order of precedence
+
+    """
+
+    # Python's regular expression engine supports at most 100 groups
+    MAX_GROUPS = 100
+
+    def __init__(self, templates):
+        self.templates = list(templates)
+        self._regexes = []
+        alternatives, lookup, groups = [], {}, 0
+        for n, template in enumerate(self.templates):
+            variables = {}
+
+            def variable_group(match):
+                group = '_%d_%s' % (n, match.group(1))
+                variables[group] = match.group(1)
+                return '(?P<%s>[^//]+)' % (group,)
+            regex = re.sub(r'{([a-zA-Z_]\w*)}', variable_group, template)
+            # Each template gets its own group to identify it (and its variables)
+            template_groups = re.compile(regex).groups + 1
+            if alternatives and groups + template_groups > self.MAX_GROUPS:
+                self._regexes.append((re.compile('|'.join(alternatives)), lookup))
+                alternatives, lookup, groups = [], {}, 0
+            alternatives.append('(?P<_%d>%s)' % (n, regex))
+            lookup['_%d' % (n,)] = (template, variables)
+            groups += template_groups
+        if alternatives:
+            self._regexes.append((re.compile('|'.join(alternatives)), lookup))
+
+    def match(self, name):
+        """Find the virtual sensor template matching the given sensor name.
+
+        Parameters
+        ----------
+        name : string
+            Sensor name
+
+        Returns
+        -------
+        template : string or None
+            First template that matches sensor name, or None if none match
+        variables : dict mapping string to string
+            Values of template variables extracted from the sensor name
+
+        """
+        for regex, lookup in self._regexes:
+            match = regex.match(name)
+            if match:
+                # The template group encloses all others, so it is closed last
+                template, variables = lookup[match.lastgroup]
+                return template, dict((var, match.group(group)) for group, var in variables.iteritems())
+        return None, {}
+
 # -------------------------------------------------------------------------------------------------
 # -- CLASS :  SensorCache
 # -------------------------------------------------------------------------------------------------
@@ -558,7 +655,10 @@ class SensorCache(dict):
     virtual : dict mapping string to function, optional
         Virtual sensors, specified as a pattern matching the virtual sensor name
         and a corresponding function that will create the sensor (together with
-        any associated virtual sensors)
+        any associated virtual sensors). The function may have a `dependencies`
+        attribute, which is a function that is called with the sensor name and
+        template variables and returns the names of sensors that it reads
+        (this allows :meth:`get_many` to load them together).
     aliases : dict mapping string to string, optional
         Alternate names for sensors, as a dictionary mapping each alias to the
         original sensor name suffix. This will create additional sensors with
@@ -575,6 +675,7 @@ class SensorCache(dict):
         self.props = props if props is not None else {}
         # Add virtual sensor templates
         self.virtual = virtual
+        self._virtual_table = VirtualSensorTable(virtual)
         # Add sensor aliases
         for alias, original in aliases.iteritems():
             self.add_aliases(alias, original)
@@ -625,6 +726,121 @@ class SensorCache(dict):
         """
         return self.get(name, select=True)
 
+    # Lookup structures built from virtual templates and props (class defaults
+    # so that subclasses that don't call the constructor can also use them)
+    _virtual_table = None
+    _wildcard_index = {}
+    _indexed_keys = None
+
+    def _match_virtual(self, name):
+        """Find virtual sensor template and variables matching sensor name."""
+        # The virtual sensor templates may be modified after construction
+        if self._virtual_table is None or self._virtual_table.templates != list(self.virtual):
+            self._virtual_table = VirtualSensorTable(self.virtual)
+        return self._virtual_table.match(name)
+
+    def _wildcard_props(self, name):
+        """Properties of all wildcard (*suffix) sensor classes matching name.
+
+        These are looked up via an index on suffix instead of scanning all
+        properties, which grow with the number of sensors accessed. The
+        properties are returned in order of increasing suffix length, so that
+        the most specific class is applied last.
+        """
+        # Reindex if the properties were replaced or modified elsewhere
+        if self._indexed_keys is None or self.props.viewkeys() != self._indexed_keys:
+            self._wildcard_index = dict((key[1:], key) for key in self.props if key.startswith('*'))
+            self._indexed_keys = set(self.props)
+        keys = [self._wildcard_index.get(name[start:]) for start in range(len(name), -1, -1)]
+        return [self.props[key] for key in keys if key is not None]
+
+    def _dependencies(self, names):
+        """Uncached virtual sensors in `names` and the sensors they depend on."""
+        dependencies, pending = [], list(names)
+        while pending:
+            name = pending.pop()
+            if name in self:
+                continue
+            template, variables = self._match_virtual(name)
+            func_deps = getattr(self.virtual[template], 'dependencies', None) if template else None
+            for dep in func_deps(name, **variables) if func_deps else []:
+                if dep not in dependencies and dep not in names:
+                    dependencies.append(dep)
+                    pending.append(dep)
+        return dependencies
+
+    def _sensor_props(self, name, kwargs):
+        """Look up (and store) the properties of sensor about to be extracted."""
+        # Look up properties associated with this class of sensor
+        class_props = self._wildcard_props(name)
+        # Look up properties associated with this specific sensor
+        self.props[name] = props = self.props.get(name, {})
+        # Adding specific properties does not invalidate the wildcard index
+        self._indexed_keys.add(name)
+        for val in class_props:
+            props.update(val)
+        # Any properties passed directly to the get method takes precedence
+        props.update(kwargs)
+        return props
+
+    @staticmethod
+    def _clean(name, sensor_data, props):
+        """Load raw sensor data and clean it up, replacing unusable data by dummy data."""
+        # Clean up sensor data if non-empty
+        if sensor_data:
+            # Sort sensor events in chronological order and discard duplicates and unreadable sensor values
+            sensor_data = remove_duplicates_and_invalid_values(sensor_data)
+        if not sensor_data:
+            sensor_data = dummy_sensor_data(name, value=props.get('initial_value'), dtype=sensor_data.dtype)
+            logger.warning("No usable data found for sensor '%s' - replaced with dummy data (%r)" %
+                           (name, sensor_data['value'][0]))
+        return sensor_data
+
+    def _interpolation_method(self, sensor_data, props):
+        """Determine how to interpolate clean sensor data (and record it in props).
+
+        Returns None for categorical data, otherwise the polynomial degree.
+        """
+        # If this is the first time any sensor is accessed, obtain all data timestamps via indexer
+        self.timestamps = self.timestamps[:] if not isinstance(self.timestamps, np.ndarray) else self.timestamps
+        # Determine if sensor produces categorical or numerical data (by default, float data are non-categorical)
+        categ = props.get('categorical', not np.issubdtype(sensor_data.dtype, np.floating))
+        props['categorical'] = categ
+        if categ:
+            return None
+        props['interp_degree'] = interp_degree = props.get('interp_degree', 1)
+        return interp_degree
+
+    def _check_extrapolation(self, name, sensor_timestamps, interp_degree):
+        """Warn if sensor data will be extrapolated to start or end of data set with potentially bogus results."""
+        if interp_degree > 0 and len(sensor_timestamps) > 1:
+            if sensor_timestamps[0] > self.timestamps[0]:
+                logger.warning(("First data point for sensor '%s' only arrives %g seconds into data set" %
+                               (name, sensor_timestamps[0] - self.timestamps[0])) +
+                               " - extrapolation may lead to ridiculous values")
+            if sensor_timestamps[-1] < self.timestamps[-1]:
+                logger.warning(("Last data point for sensor '%s' arrives %g seconds before end of data set" %
+                               (name, self.timestamps[-1] - sensor_timestamps[-1])) +
+                               " - extrapolation may lead to ridiculous values")
+
+    def _interpolate(self, name, sensor_data, props):
+        """Interpolate clean sensor data onto data timestamps."""
+        interp_degree = self._interpolation_method(sensor_data, props)
+        if interp_degree is None:
+            return sensor_to_categorical(sensor_data['timestamp'], sensor_data['value'],
+                                         self.timestamps, self.dump_period, **props)
+        # Interpolate numerical data onto data timestamps (fallback option is linear interpolation)
+        sensor_timestamps = sensor_data['timestamp']
+        self._check_extrapolation(name, sensor_timestamps, interp_degree)
+        if PiecewisePolynomial1DFit is not None:
+            interp = PiecewisePolynomial1DFit(max_degree=interp_degree)
+            interp.fit(sensor_timestamps, sensor_data['value'])
+            return interp(self.timestamps)
+        if interp_degree != 1:
+            logger.warning('Requested sensor interpolation with polynomial degree ' + str(interp_degree) +
+                           ' but scikits.fitting not installed - falling back to linear interpolation')
+        return _safe_linear_interp(sensor_timestamps, sensor_data['value'], self.timestamps)
+
     def _set_keep(self, keep=None):
         """Set time selection for sensor values."""
         if keep is not None:
@@ -706,68 +922,91 @@ class SensorCache(dict):
             # First try to load the actual sensor data from cache (remember to call base class here!)
             sensor_data = super(SensorCache, self).__getitem__(name)
         except KeyError:
-            # Otherwise, iterate through virtual sensor templates and look for a match
-            for pattern, create_sensor in self.virtual.iteritems():
-                # Expand variable names enclosed in braces to the relevant regular expression
-                pattern = re.sub('({[a-zA-Z_]\w*})', lambda m: '(?P<' + m.group(0)[1:-1] + '>[^//]+)', pattern)
-                match = re.match(pattern, name)
-                if match:
-                    # Call sensor creation function with extracted variables from sensor name
-                    sensor_data = create_sensor(self, name, **match.groupdict())
-                    break
-            else:
+            # Otherwise, look for a matching virtual sensor template
+            template, variables = self._match_virtual(name)
+            if template is None:
                 raise KeyError("Unknown sensor '%s' (does not match actual name or virtual template)" % (name,))
+            # Call sensor creation function with extracted variables from sensor name
+            sensor_data = self.virtual[template](self, name, **variables)
         # If this is the first time this sensor is accessed, extract its data and store it in cache, if enabled
         if isinstance(sensor_data, SensorData) and extract:
-            # Look up properties associated with this specific sensor
-            self.props[name] = props = self.props.get(name, {})
-            # Look up properties associated with this class of sensor
-            for key, val in self.props.iteritems():
-                if key[0] == '*' and name.endswith(key[1:]):
-                    props.update(val)
-            # Any properties passed directly to this method takes precedence
-            props.update(kwargs)
-            # Clean up sensor data if non-empty
-            if sensor_data:
-                # Sort sensor events in chronological order and discard duplicates and unreadable sensor values
-                sensor_data = remove_duplicates_and_invalid_values(sensor_data)
-            if not sensor_data:
-                sensor_data = dummy_sensor_data(name, value=props.get('initial_value'), dtype=sensor_data.dtype)
-                logger.warning("No usable data found for sensor '%s' - replaced with dummy data (%r)" %
-                               (name, sensor_data['value'][0]))
-            # If this is the first time any sensor is accessed, obtain all data timestamps via indexer
-            self.timestamps = self.timestamps[:] if not isinstance(self.timestamps, np.ndarray) else self.timestamps
-            # Determine if sensor produces categorical or numerical data (by default, float data are non-categorical)
-            categ = props.get('categorical', not np.issubdtype(sensor_data.dtype, np.floating))
-            props['categorical'] = categ
-            if categ:
-                sensor_data = sensor_to_categorical(sensor_data['timestamp'], sensor_data['value'],
-                                                    self.timestamps, self.dump_period, **props)
+            props = self._sensor_props(name, kwargs)
+            sensor_data = self._clean(name, sensor_data, props)
+            self[name] = sensor_data = self._interpolate(name, sensor_data, props)
+        return sensor_data[self.keep] if select else sensor_data
+
+    def get_many(self, names, select=False, extract=True, max_threads=SENSOR_LOAD_THREADS, **kwargs):
+        """Values of several sensors interpolated to correlator data timestamps.
+
+        This gives the same result as calling :meth:`get` on each sensor name
+        in turn, but first extracts all actual sensors among them in one go.
+        Their raw data are loaded and cleaned up concurrently by a pool of
+        threads, as this typically waits on I/O (HDF5 files or telstate), and
+        numerical sensors that share the same sensor timestamps are then
+        interpolated together. Virtual sensors are calculated afterwards. The
+        actual sensors they depend on are included in the batch if the virtual
+        sensor functions declare them (see the `virtual` parameter of
+        :class:`SensorCache`).
+
+        Parameters
+        ----------
+        names : sequence of string
+            Sensor names
+        select, extract, kwargs : optional
+            See :meth:`get`, applied to all sensors
+        max_threads : int, optional
+            Maximum number of threads that load sensor data (1 disables threads)
+
+        Returns
+        -------
+        data : list of array or :class:`CategoricalData` or :class:`SensorData` object
+            Sensor data, one per sensor name (see :meth:`get`)
+
+        Raises
+        ------
+        ValueError
+            If select=True and extract=False, as select requires interpolation
+        KeyError
+            If any sensor name was not found in cache and did not match virtual template
+
+        """
+        if select and not extract:
+            raise ValueError('Cannot apply selection on raw sensor data')
+        if extract:
+            raw, seen = [], set()
+            # Dependencies of virtual sensors are extracted with default properties
+            requested = [(name, kwargs) for name in names]
+            for name, name_kwargs in requested + [(dep, {}) for dep in self._dependencies(names)]:
+                sensor_data = super(SensorCache, self).get(name)
+                if isinstance(sensor_data, SensorData) and name not in seen:
+                    raw.append((name, sensor_data, self._sensor_props(name, name_kwargs)))
+                    seen.add(name)
+            if max_threads > 1 and len(raw) > 1:
+                pool = ThreadPool(min(max_threads, len(raw)))
+                try:
+                    clean = pool.map(lambda args: self._clean(*args), raw)
+                finally:
+                    pool.close()
+                    pool.join()
             else:
-                # Interpolate numerical data onto data timestamps (fallback option is linear interpolation)
-                props['interp_degree'] = interp_degree = props.get('interp_degree', 1)
-                sensor_timestamps = sensor_data['timestamp']
-                # Warn if sensor data will be extrapolated to start or end of data set with potentially bogus results
-                if interp_degree > 0 and len(sensor_timestamps) > 1:
-                    if sensor_timestamps[0] > self.timestamps[0]:
-                        logger.warning(("First data point for sensor '%s' only arrives %g seconds into data set" %
-                                       (name, sensor_timestamps[0] - self.timestamps[0])) +
-                                       " - extrapolation may lead to ridiculous values")
-                    if sensor_timestamps[-1] < self.timestamps[-1]:
-                        logger.warning(("Last data point for sensor '%s' arrives %g seconds before end of data set" %
-                                       (name, self.timestamps[-1] - sensor_timestamps[-1])) +
-                                       " - extrapolation may lead to ridiculous values")
-                if PiecewisePolynomial1DFit is not None:
-                    interp = PiecewisePolynomial1DFit(max_degree=interp_degree)
-                    interp.fit(sensor_timestamps, sensor_data['value'])
-                    sensor_data = interp(self.timestamps)
+                clean = [self._clean(*args) for args in raw]
+            # Group linearly interpolated numerical sensors by sensor timestamps
+            linear = {}
+            for (name, _, props), sensor_data in zip(raw, clean):
+                if PiecewisePolynomial1DFit is None and self._interpolation_method(sensor_data, props) == 1 \
+                        and sensor_data['value'].ndim == 1:
+                    sensor_timestamps = sensor_data['timestamp']
+                    group = linear.setdefault(sensor_timestamps.tobytes(), (sensor_timestamps, [], []))
+                    group[1].append(name)
+                    group[2].append(sensor_data['value'])
                 else:
-                    if interp_degree != 1:
-                        logger.warning('Requested sensor interpolation with polynomial degree ' + str(interp_degree) +
-                                       ' but scikits.fitting not installed - falling back to linear interpolation')
-                    sensor_data = _safe_linear_interp(sensor_timestamps, sensor_data['value'], self.timestamps)
-            self[name] = sensor_data
-        return sensor_data[self.keep] if select else sensor_data
+                    self[name] = self._interpolate(name, sensor_data, props)
+            for sensor_timestamps, group_names, values in linear.itervalues():
+                interp_values = _safe_linear_interp(sensor_timestamps, np.column_stack(values), self.timestamps)
+                for n, name in enumerate(group_names):
+                    self._check_extrapolation(name, sensor_timestamps, 1)
+                    self[name] = interp_values[:, n]
+        return [self.get(name, select, extract, **kwargs) for name in names]
 
     def get_with_fallback(self, sensor_type, names):
         """Sensor values interpolated to correlator data timestamps.
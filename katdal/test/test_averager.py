@@ -0,0 +1,239 @@
+################################################################################
+# Copyright (c) 2018, National Research Foundation (Square Kilometre Array)
+#
+# Licensed under the BSD 3-Clause License (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+################################################################################
+
+"""Tests for :py:mod:`katdal.averager`."""
+
+import numpy as np
+from numpy.testing import assert_array_equal, assert_allclose
+from nose.tools import assert_equal, assert_is_none, assert_raises
+
+from katdal.averager import (average_visibilities, _average_visibilities, _parallel_axis, StreamingAverager,
+                             baseline_averaging_factors, average_visibilities_per_baseline, average_and_permute)
+
+
+def random_visibilities(shape, seed=1):
+    """Random vis, weights and flags of given shape, with some fully flagged bins."""
+    rs = np.random.RandomState(seed)
+    vis = (rs.standard_normal(shape) + 1j * rs.standard_normal(shape)).astype(np.complex64)
+    weight = rs.random_sample(shape).astype(np.float32)
+    flag = rs.random_sample(shape) < 0.3
+    flag[:2, :4, :3] = True
+    return vis, weight, flag
+
+
+def reference_average(vis, weight, flag, timeav, chanav, flagav):
+    """Straightforward numpy version of :func:`_average_visibilities`."""
+    n_time, n_chans, n_bl = vis.shape
+    shape = (n_time // timeav, timeav, n_chans // chanav, chanav, n_bl)
+    vis = vis.reshape(shape).astype(np.complex128)
+    weight = np.where(flag, 0., weight).reshape(shape)
+    flag = flag.reshape(shape)
+    weight_sum = weight.sum(axis=(1, 3))
+    unweighted = vis.mean(axis=(1, 3))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weighted = (weight * vis).sum(axis=(1, 3)) / weight_sum
+    av_vis = np.where(weight_sum > 0, weighted, unweighted)
+    av_flag = flag.any(axis=(1, 3)) if flagav else flag.all(axis=(1, 3))
+    return av_vis, weight_sum, av_flag
+
+
+class TestAverageVisibilities(object):
+    """Test the numba averager against a numpy reference."""
+    def setup(self):
+        self.vis, self.weight, self.flag = random_visibilities((6, 16, 300))
+
+    def test_parallel_axes(self):
+        for timeav, chanav in [(2, 4), (3, 16), (1, 1)]:
+            for flagav in [False, True]:
+                expected = reference_average(self.vis, self.weight, self.flag, timeav, chanav, flagav)
+                for axis in range(3):
+                    actual = _average_visibilities(self.vis, self.weight, self.flag,
+                                                   timeav, chanav, flagav, axis)
+                    assert_allclose(actual[0], expected[0], rtol=1e-5, atol=1e-6)
+                    assert_allclose(actual[1], expected[1], rtol=1e-5)
+                    assert_array_equal(actual[2], expected[2])
+
+    def test_average_visibilities(self):
+        timestamps = 1234567890. + np.arange(6)
+        freqs = 1e9 + 1e6 * np.arange(16)
+        av_vis, av_weight, av_flag, av_timestamps, av_freqs = average_visibilities(
+            self.vis, self.weight, self.flag, timestamps, freqs, timeav=4, chanav=5)
+        expected = reference_average(self.vis[:4, :15], self.weight[:4, :15], self.flag[:4, :15], 4, 5, False)
+        assert_allclose(av_vis, expected[0], rtol=1e-5, atol=1e-6)
+        assert_array_equal(av_flag, expected[2])
+        assert_array_equal(av_timestamps, [1234567891.5])
+        assert_array_equal(av_freqs, 1e9 + 1e6 * np.array([2., 7., 12.]))
+
+    def test_parallel_axis_choice(self):
+        # Plenty of averaged channels -> channels
+        assert_equal(_parallel_axis(1, 1024, 2016, n_threads=32), 1)
+        # Heavy channel averaging and many dumps -> time
+        assert_equal(_parallel_axis(200, 16, 2016, n_threads=32), 0)
+        # Heavy averaging in both -> baseline blocks (MeerKAT 64-antenna has 8256 products)
+        assert_equal(_parallel_axis(2, 16, 8256, n_threads=32), 2)
+        # Nothing is big enough -> the largest axis
+        assert_equal(_parallel_axis(1, 4, 2016, n_threads=32), 2)
+        assert_equal(_parallel_axis(1, 1, 1, n_threads=32), 1)
+
+
+class TestStreamingAverager(object):
+    """Test averaging a stream of irregular time blocks."""
+    def setup(self):
+        self.vis, self.weight, self.flag = random_visibilities((23, 16, 40), seed=2)
+        self.timestamps = 1234567890. + np.arange(23)
+        self.freqs = 1e9 + 1e6 * np.arange(16)
+
+    def _stream(self, averager, block_sizes):
+        outputs = []
+        start = 0
+        for size in block_sizes:
+            index = np.s_[start:start + size]
+            outputs.append(averager.add(self.vis[index], self.weight[index],
+                                        self.flag[index], self.timestamps[index]))
+            start += size
+        final = averager.flush()
+        if final is not None:
+            outputs.append(final)
+        return [np.concatenate(arrays) for arrays in zip(*outputs)]
+
+    def test_blocks_match_batch_average(self):
+        for block_sizes in [[23], [5, 5, 5, 8], [1] * 23, [2, 0, 9, 12]]:
+            averager = StreamingAverager(self.freqs, timeav=4, chanav=5)
+            av_vis, av_weight, av_flag, av_timestamps = self._stream(averager, block_sizes)
+            assert_equal(av_vis.shape, (6, 3, 40))
+            expected = average_visibilities(self.vis, self.weight, self.flag, self.timestamps,
+                                            self.freqs, timeav=4, chanav=5)
+            assert_allclose(av_vis[:5], expected[0], rtol=1e-5, atol=1e-6)
+            assert_allclose(av_weight[:5], expected[1], rtol=1e-5)
+            assert_array_equal(av_flag[:5], expected[2])
+            assert_array_equal(av_timestamps[:5], expected[3])
+            assert_array_equal(averager.channel_freqs, expected[4])
+            # The final 3 dumps form a partial bin
+            partial = reference_average(self.vis[20:, :15], self.weight[20:, :15], self.flag[20:, :15], 3, 5, False)
+            assert_allclose(av_vis[5:], partial[0], rtol=1e-5, atol=1e-6)
+            assert_array_equal(av_flag[5:], partial[2])
+            assert_array_equal(av_timestamps[5:], [1234567911.])
+
+    def test_partial_chans(self):
+        averager = StreamingAverager(self.freqs, timeav=23, chanav=5, flagav=True, partial_chans=True)
+        av_vis, av_weight, av_flag, av_timestamps = self._stream(averager, [10, 13])
+        assert_equal(av_vis.shape, (1, 4, 40))
+        assert_array_equal(averager.channel_freqs, 1e9 + 1e6 * np.array([2., 7., 12., 15.]))
+        expected = reference_average(self.vis[:, 15:], self.weight[:, 15:], self.flag[:, 15:], 23, 1, True)
+        assert_allclose(av_vis[:, 3:], expected[0], rtol=1e-5, atol=1e-6)
+        assert_array_equal(av_flag[:, 3:], expected[2])
+
+    def test_flush_and_errors(self):
+        averager = StreamingAverager(self.freqs, timeav=4, chanav=4)
+        assert_is_none(averager.flush())
+        averager.add(self.vis[:2], self.weight[:2], self.flag[:2], self.timestamps[:2])
+        assert_raises(ValueError, averager.add, self.vis[:2, :, :20], self.weight[:2, :, :20],
+                      self.flag[:2, :, :20], self.timestamps[:2])
+        assert_raises(ValueError, averager.add, self.vis[:2, :8], self.weight[:2, :8],
+                      self.flag[:2, :8], self.timestamps[:2])
+        assert_equal(averager.flush()[0].shape, (1, 4, 40))
+        assert_is_none(averager.flush())
+        assert_raises(ValueError, StreamingAverager, self.freqs, timeav=0)
+
+
+class TestBaselineDependentAveraging(object):
+    """Test averaging with different factors per baseline."""
+    def setup(self):
+        self.vis, self.weight, self.flag = random_visibilities((7, 16, 6), seed=3)
+        self.timestamps = 1234567890. + 2. * np.arange(7)
+        self.freqs = 1e9 + 1e6 * np.arange(16)
+
+    def test_factors(self):
+        lengths = [0., 10., 100., 1000., 8000.]
+        # 1% loss at 1 degree from the phase centre at 1.7 GHz allows about
+        # 10.8 seconds and 1.34 MHz on a 1 km baseline
+        timeav, chanav = baseline_averaging_factors(lengths, 2., 208984., 1.7e9, np.radians(1.),
+                                                    max_timeav=64, max_chanav=64)
+        assert_array_equal(timeav, [64, 64, 32, 4, 1])
+        assert_array_equal(chanav, [64, 64, 64, 4, 1])
+        # Smaller tolerance -> less averaging
+        timeav, chanav = baseline_averaging_factors(lengths, 8., 208984., 1.7e9, np.radians(1.),
+                                                    tolerance=1e-4, max_timeav=8, max_chanav=64)
+        assert_array_equal(timeav, [8, 8, 1, 1, 1])
+        assert_array_equal(chanav, [64, 64, 4, 1, 1])
+
+    def test_rows(self):
+        timeav = np.array([1, 2, 4, 4, 8, 2])
+        chanav = np.array([1, 2, 4, 16, 1, 2])
+        out = average_visibilities_per_baseline(self.vis, self.weight, self.flag, self.timestamps,
+                                                self.freqs, 2., timeav, chanav)
+        assert_equal(sorted(out.channel_freqs), [1, 2, 4, 16])
+        assert_array_equal(out.channel_freqs[4], 1e9 + 1e6 * np.array([1.5, 5.5, 9.5, 13.5]))
+        assert_equal(len(out.offsets), len(out.baseline) + 1)
+        # Rows are sorted by time and then baseline
+        assert_array_equal(np.lexsort((out.baseline, out.time)), np.arange(len(out.time)))
+        for bl in range(6):
+            rows = np.flatnonzero(out.baseline == bl)
+            av_n_time = -(-7 // timeav[bl])
+            assert_equal(len(rows), av_n_time)
+            assert_array_equal(out.chanav[rows], chanav[bl])
+            for n, row in enumerate(rows):
+                start = n * timeav[bl]
+                stop = min(start + timeav[bl], 7)
+                assert_equal(out.interval[row], 2. * (stop - start))
+                assert_equal(out.time[row], self.timestamps[start:stop].mean())
+                expected = reference_average(self.vis[start:stop, :, bl:bl + 1], self.weight[start:stop, :, bl:bl + 1],
+                                             self.flag[start:stop, :, bl:bl + 1], stop - start, chanav[bl], False)
+                index = slice(out.offsets[row], out.offsets[row + 1])
+                assert_allclose(out.vis[index], expected[0].ravel(), rtol=1e-5, atol=1e-6)
+                assert_allclose(out.weight[index], expected[1].ravel(), rtol=1e-5)
+                assert_array_equal(out.flag[index], expected[2].ravel())
+
+    def test_uniform_factors(self):
+        out = average_visibilities_per_baseline(self.vis[:6], self.weight[:6], self.flag[:6], self.timestamps[:6],
+                                                self.freqs, 2., 3, 4, flagav=True)
+        expected = average_visibilities(self.vis[:6], self.weight[:6], self.flag[:6], self.timestamps[:6],
+                                        self.freqs, timeav=3, chanav=4, flagav=True)
+        assert_allclose(out.vis.reshape(2, 6, 4), expected[0].transpose(0, 2, 1), rtol=1e-6)
+        assert_array_equal(out.flag.reshape(2, 6, 4), expected[2].transpose(0, 2, 1))
+        assert_array_equal(out.time, np.repeat(expected[3], 6))
+
+
+class TestAverageAndPermute(object):
+    """Test fused averaging and baseline permutation."""
+    def setup(self):
+        self.vis, self.weight, self.flag = random_visibilities((6, 12, 40), seed=4)
+        # 10 baselines x 4 pols, in reverse order with one missing product
+        self.cp_index = np.arange(40)[::-1].reshape(10, 4)
+        self.cp_index[3, 2] = -1
+
+    def test_matches_average_then_permute(self):
+        for timeav, chanav, flagav in [(3, 4, False), (2, 5, True), (1, 1, False)]:
+            shape = (6 // timeav, 10, 12 // chanav, 4)
+            out = [np.empty(shape, x.dtype) for x in (self.vis, self.weight, self.flag)]
+            out_vis, out_weight, out_flag = average_and_permute(self.vis, self.weight, self.flag, self.cp_index,
+                                                                out[0], out[1], out[2], timeav, chanav, flagav)
+            assert out_vis is out[0]
+            av = average_visibilities(self.vis, self.weight, self.flag, np.arange(6.), np.arange(12.),
+                                      timeav, chanav, flagav)
+            for actual, expected in zip(out, av[:3]):
+                expected = expected[:, :, self.cp_index].transpose(0, 2, 1, 3)
+                valid = (self.cp_index >= 0)[np.newaxis, :, np.newaxis, :].repeat(shape[2], axis=2)
+                valid = valid.repeat(shape[0], axis=0)
+                assert_allclose(actual[valid], expected[valid], rtol=1e-6)
+            assert_array_equal(out_vis[:, 3, :, 2], 0)
+            assert_array_equal(out_weight[:, 3, :, 2], 0)
+            assert_array_equal(out_flag[:, 3, :, 2], True)
+
+    def test_bad_output_shape(self):
+        out = [np.empty((2, 10, 4, 4), x.dtype) for x in (self.vis, self.weight, self.flag)]
+        assert_raises(ValueError, average_and_permute, self.vis, self.weight, self.flag, self.cp_index,
+                      out[0], out[1], out[2], 2, 3)
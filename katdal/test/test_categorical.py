@@ -18,8 +18,44 @@
 
 import numpy as np
 from numpy.testing import assert_array_equal
+from nose.tools import assert_equal, assert_raises
 
-from katdal.categorical import _single_event_per_dump, sensor_to_categorical
+from katdal.categorical import _single_event_per_dump, _intern, sensor_to_categorical, CategoricalData
+
+
+def reference_single_event_per_dump(events, greedy):
+    """Original generator version of :func:`_single_event_per_dump`, for reference."""
+    # The previous winning event is the dominant event in the previous dump
+    previous_winning_event = 0
+    previous_dump = 0
+    # This generates consecutive event indices with associated dump indices
+    for current_event, current_dump in enumerate(events):
+        # At the start of a new dump, process the events of the previous dump
+        if current_dump > previous_dump:
+            # This previous event segment is assumed to straddle dump boundary
+            assert current_event >= 1, "First sensor event not at dump 0"
+            event_at_dump_start = current_event - 1
+            # The normal victory condition is to be the final event in the dump
+            if not greedy[previous_winning_event]:
+                previous_winning_event = event_at_dump_start
+            winning_dump = events[previous_winning_event]
+            # Only yield winning event in immediate past to avoid duplicates
+            if previous_dump <= winning_dump < current_dump:
+                yield previous_winning_event
+            # If winning event was greedy and final event was non-greedy,
+            # push final event to the start of next dump and yield if it is
+            # the only event in that dump (otherwise it has to fight it out...)
+            if event_at_dump_start != previous_winning_event:
+                # NB: This modifies `events`! It simplifies bookkeeping.
+                events[event_at_dump_start] += 1
+                if current_dump > events[event_at_dump_start]:
+                    yield event_at_dump_start
+                previous_winning_event = event_at_dump_start
+            previous_dump = current_dump
+        # While within the same dump, pick the latest greedy event as winner
+        # Also, avoid indexing greedy with final one-past-last event
+        if (current_event < len(greedy)) and greedy[current_event]:
+            previous_winning_event = current_event
 
 
 def test_dump_to_event_parsing():
@@ -34,6 +70,30 @@ def test_dump_to_event_parsing():
     assert_array_equal(new_events, [0, 1, 3, 5, 6], 'Dump->event parser failed')
 
 
+def test_dump_to_event_parsing_matches_reference():
+    rs = np.random.RandomState(8)
+    for n in range(2000):
+        num_events = rs.randint(1, 30)
+        num_dumps = rs.randint(1, 40)
+        events = np.r_[0, np.sort(rs.randint(0, num_dumps, num_events - 1)), num_dumps]
+        greedy = rs.random_sample(num_events) < rs.random_sample()
+        expected_events = events.copy()
+        expected = list(reference_single_event_per_dump(expected_events, greedy))
+        cleaned = _single_event_per_dump(events, greedy)
+        assert_array_equal(cleaned, expected, 'Dump->event parser differs from reference')
+        assert_array_equal(events, expected_events, 'Dump->event parser differs from reference')
+
+
+def test_intern():
+    for values in (np.array(list('cabcca')), np.array(['c', 1, 'b', 'c', 1], dtype=object),
+                   np.array([None, [1], [0], [1], [1]], dtype=object)[1:]):
+        unique_values, codes = _intern(values)
+        assert_equal(unique_values.dtype, values.dtype)
+        assert_equal(list(unique_values[codes]), list(values))
+        assert_equal(list(unique_values), [v for n, v in enumerate(values) if v not in list(values[:n])])
+        assert_array_equal(codes[:2], [0, 1])
+
+
 def test_categorical_sensor_creation():
     timestamps = [-363.784, 2.467, 8.839, 8.867, 15.924, 48.925, 54.897, 88.982]
     values = ['stop', 'slew', 'track', 'slew', 'track', 'slew', 'track', 'slew']
@@ -48,3 +108,51 @@ def test_categorical_sensor_creation():
                        'Sensor->categorical failed')
     assert_array_equal(categ.indices, [0, 1, 0, 1, 0],
                        'Sensor->categorical failed')
+
+
+def test_categorical_sensor_transform():
+    timestamps = [2.0, 5.0, 12.0, 21.0, 26.0, 35.0]
+    values = ['0', 'False', 'True', '1', '0', '0']
+    dump_period = 4.
+    dump_times = np.arange(2., 40., dump_period)
+    # The transform maps several sensor values to the same boolean,
+    # and the greedy value grabs dump 6 as it is active at its start
+    categ = sensor_to_categorical(timestamps, values, dump_times, dump_period,
+                                  transform=lambda x: x not in ('0', 'False'),
+                                  greedy_values=(True,))
+    assert_array_equal(categ.unique_values, [False, True])
+    assert_array_equal(categ.events, [0, 2, 7, 10])
+    assert_array_equal(categ.indices, [0, 1, 0])
+    # The initial value repeats the first proper value
+    categ = sensor_to_categorical(timestamps[2:], values[2:], dump_times, dump_period,
+                                  transform=lambda x: x not in ('0', 'False'),
+                                  initial_value=True)
+    assert_array_equal(categ.unique_values, [True, False])
+    assert_array_equal(categ.events, [0, 6, 10])
+    assert_array_equal(categ.indices, [0, 1])
+
+
+def test_categorical_getitem():
+    categ = CategoricalData(['a', 'bb', 'a', 'c'], [0, 2, 5, 6, 10])
+    assert_equal(categ[3], 'bb')
+    assert_array_equal(categ[:], ['a', 'a', 'bb', 'bb', 'bb', 'a', 'c', 'c', 'c', 'c'])
+    assert_array_equal(categ[1:9:3], ['a', 'bb', 'c'])
+    assert_array_equal(categ[::-4], ['c', 'a', 'a'])
+    assert_array_equal(categ[[9, 0, 4]], ['c', 'a', 'bb'])
+    assert_array_equal(categ[np.arange(10) >= 7], ['c', 'c', 'c'])
+    assert_equal(categ[5:5].shape, (0,))
+    # Changes to the unique values are picked up by subsequent lookups
+    categ.add(8, 'd')
+    assert_array_equal(categ[7:], ['c', 'd', 'd'])
+    categ.remove('a')
+    assert_array_equal(categ[2:5], ['bb', 'bb', 'bb'])
+    categ.unique_values = [value.upper() for value in categ.unique_values]
+    assert_array_equal(categ[2:5], ['BB', 'BB', 'BB'])
+    # Sequences as sensor values turn into extra dimensions
+    categ = CategoricalData([(1, 2), (3, 4)], [0, 2, 3])
+    assert_array_equal(categ[1:], [[1, 2], [3, 4]])
+    assert_equal(categ[2:2].shape, (0, 2))
+    # Values of incompatible shapes are returned one by one
+    categ = CategoricalData([np.zeros((2, 3)), np.ones((2, 4))], [0, 1, 2])
+    assert_array_equal(categ[:1], np.zeros((1, 2, 3)))
+    assert_raises(IndexError, categ.__getitem__, 2)
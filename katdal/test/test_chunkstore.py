@@ -221,6 +221,19 @@ class ChunkStoreTestBase(object):
         self.get_dask_array('big_y', np.s_[0:3, 0:30, 0:2])
         self.has_array('big_y', np.s_[0:3, 0:30, 0:2])
 
+    def test_dask_array_chunk_index(self):
+        self.put_dask_array('big_y')
+        array_name, dask_array, offset = self.make_dask_array('big_y')
+        index = ([5, 2, 0], [1])
+        pull = self.store.get_dask_array(array_name, dask_array.chunks,
+                                         dask_array.dtype, index=index)
+        # Only the selected chunks are in the graph, in the requested order
+        n_chunks = len(index[0]) * len(index[1]) * len(dask_array.chunks[2])
+        assert_equal(len(pull.dask), n_chunks)
+        blocks = [[dask_array.blocks[i, j] for j in index[1]] for i in index[0]]
+        expected = da.concatenate([da.concatenate(row, axis=1) for row in blocks])
+        assert_array_equal(pull.compute(), expected.compute())
+
     def test_dask_array_put_parts_get_whole(self):
         # Split big array into quarters along existing chunks and reassemble
         self.put_dask_array('big_y2', np.s_[0:3,  0:30, 0:2])
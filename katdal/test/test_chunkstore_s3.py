@@ -26,7 +26,7 @@ import os
 import time
 
 from nose import SkipTest
-from nose.tools import assert_raises, timed
+from nose.tools import assert_raises, assert_equal, assert_true, timed
 import mock
 
 from katdal.chunkstore_s3 import S3ChunkStore
@@ -157,3 +157,34 @@ class TestS3ChunkStoreAuth(TestS3ChunkStore):
     def from_url(cls, url):
         """Create the chunk store"""
         return S3ChunkStore.from_url(url, timeout=1, token='mysecret')
+
+
+class TestS3ChunkStoreRegistry(object):
+    """Test the sharing of S3 chunk stores via :meth:`S3ChunkStore.shared_from_url`."""
+
+    def teardown(self):
+        S3ChunkStore.clear_registry()
+
+    @mock.patch.object(S3ChunkStore, 'from_url', side_effect=lambda *args: object())
+    def test_reuse(self, mock_from_url):
+        url = 'http://apparently.invalid/'
+        store1 = S3ChunkStore.shared_from_url(url, timeout=1)
+        store2 = S3ChunkStore.shared_from_url(url, timeout=1)
+        assert_equal(mock_from_url.call_count, 1)
+        assert_true(store1 is store2)
+        # Different credentials or timeouts result in a new store
+        store3 = S3ChunkStore.shared_from_url(url, timeout=1, token='mysecret')
+        store4 = S3ChunkStore.shared_from_url(url, timeout=2)
+        assert_equal(mock_from_url.call_count, 3)
+        assert_true(store3 is not store1 and store4 is not store1)
+        S3ChunkStore.clear_registry()
+        store5 = S3ChunkStore.shared_from_url(url, timeout=1)
+        assert_true(store5 is not store1)
+
+    def test_store_unavailable_not_shared(self):
+        # Failed stores are not registered, so later attempts try again
+        for attempt in range(2):
+            assert_raises(StoreUnavailable, S3ChunkStore.shared_from_url,
+                          'http://apparently.invalid/',
+                          timeout=0.1, extra_timeout=0)
+        assert_equal(S3ChunkStore._registry, {})
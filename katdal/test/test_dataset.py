@@ -0,0 +1,222 @@
+################################################################################
+# Copyright (c) 2018, National Research Foundation (Square Kilometre Array)
+#
+# Licensed under the BSD 3-Clause License (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+################################################################################
+
+"""Tests for :py:mod:`katdal.dataset`."""
+
+import numpy as np
+from numpy.testing import assert_array_equal, assert_allclose
+from nose.tools import assert_equal, assert_raises
+import dask.array as da
+import katpoint
+
+from katdal.dataset import DataSet, DEFAULT_VIRTUAL_SENSORS, utc_to_mjd
+from katdal.lazy_indexer import DaskLazyIndexer
+from katdal.sensordata import SensorCache
+from katdal.categorical import CategoricalData
+
+
+class MinimalDataSet(DataSet):
+    """Data set with only timestamps and correlator data, for block tests."""
+    def __init__(self, vis, weights, flags):
+        DataSet.__init__(self, 'minimal')
+        self.shape = vis.shape
+        self._timestamps = 1234567890. + np.arange(vis.shape[0])
+        self._vis = vis
+        self._weights = weights
+        self._flags = flags
+
+    @property
+    def timestamps(self):
+        return self._timestamps
+
+    @property
+    def vis(self):
+        return self._vis
+
+    @property
+    def weights(self):
+        return self._weights
+
+    @property
+    def flags(self):
+        return self._flags
+
+
+class TestBlocks(object):
+    """Test the :meth:`DataSet.blocks` generator."""
+    def setup(self):
+        shape = (10, 12, 3)
+        rs = np.random.RandomState(5)
+        self.vis = (rs.standard_normal(shape) + 1j * rs.standard_normal(shape)).astype(np.complex64)
+        self.weights = rs.random_sample(shape).astype(np.float32)
+        self.flags = rs.random_sample(shape) < 0.2
+
+    def _test_blocks(self, dataset, dumps_per_block, channels_per_block=None, prefetch=True):
+        blocks = dataset.blocks(dumps_per_block, channels_per_block, prefetch)
+        vis = np.zeros_like(self.vis)
+        weights = np.zeros_like(self.weights)
+        flags = np.zeros_like(self.flags)
+        chans = self.vis.shape[1] if channels_per_block is None else channels_per_block
+        n_blocks = 0
+        for n, (timestamps, block_vis, block_weights, block_flags) in enumerate(blocks):
+            n_time, n_freq = divmod(n, -(-self.vis.shape[1] // chans))
+            index = np.s_[n_time * dumps_per_block:(n_time + 1) * dumps_per_block,
+                          n_freq * chans:(n_freq + 1) * chans]
+            assert_array_equal(timestamps, dataset.timestamps[index[0]])
+            vis[index] = block_vis
+            weights[index] = block_weights
+            flags[index] = block_flags
+            n_blocks += 1
+        assert_array_equal(vis, self.vis)
+        assert_array_equal(weights, self.weights)
+        assert_array_equal(flags, self.flags)
+        return n_blocks
+
+    def test_dask_blocks(self):
+        arrays = [DaskLazyIndexer(da.from_array(x, chunks=(2, 4, 3)))
+                  for x in (self.vis, self.weights, self.flags)]
+        dataset = MinimalDataSet(*arrays)
+        assert_equal(self._test_blocks(dataset, 3), 4)
+        assert_equal(self._test_blocks(dataset, 4, 5), 9)
+        assert_equal(self._test_blocks(dataset, 100, prefetch=False), 1)
+
+    def test_ndarray_blocks(self):
+        dataset = MinimalDataSet(self.vis, self.weights, self.flags)
+        assert_equal(self._test_blocks(dataset, 4, 6), 6)
+
+    def test_errors_are_raised(self):
+        broken = DaskLazyIndexer(da.from_array(self.weights, chunks=(2, 4, 3)),
+                                 transforms=[lambda x: x.map_blocks(_fail)])
+        dataset = MinimalDataSet(self.vis, broken, self.flags)
+        assert_raises(ValueError, list, dataset.blocks(3))
+
+
+ANTENNAS = [
+    'm000, -30:42:39.8, 21:26:38.0, 1035.0, 13.5, -8.258 -207.289 1.2075 5874.184 5875.444, ,1.22',
+    'm001, -30:42:39.8, 21:26:38.0, 1035.0, 13.5, 1.126 -171.761 1.0605 5868.979 5869.998, ,1.22',
+    'm063, -30:42:39.8, 21:26:38.0, 1035.0, 13.5, -3419.585 -1840.48 16.3855, ,1.22',
+]
+
+
+class UVWDataSet(DataSet):
+    """Data set with antennas and targets, for (u,v,w) tests."""
+    def __init__(self, antennas, targets, n_dumps):
+        DataSet.__init__(self, 'uvw')
+        self.dump_period = 8.0
+        self._timestamps = 1234567890. + self.dump_period * np.arange(n_dumps)
+        self.ants = antennas
+        self.corr_products = np.array([(a.name + 'h', b.name + 'v')
+                                       for n, a in enumerate(antennas) for b in antennas[n:]])
+        self.shape = (n_dumps, 1, len(self.corr_products))
+        cache = {'Antennas/%s/antenna' % (ant.name,): CategoricalData([ant], [0, n_dumps]) for ant in antennas}
+        cache['Observation/target'] = CategoricalData(targets, [0, n_dumps // 2, n_dumps])
+        self.sensor = SensorCache(cache, self._timestamps, self.dump_period, virtual=DEFAULT_VIRTUAL_SENSORS)
+
+    @property
+    def timestamps(self):
+        return self._timestamps
+
+
+class TestUVW(object):
+    """Test bulk (u,v,w) calculation against per-baseline calculation."""
+    def setup(self):
+        self.ants = [katpoint.Antenna(ant) for ant in ANTENNAS]
+        targets = [katpoint.Target('J1939-6342, radec, 19:39:25.03, -63:42:45.6'),
+                   katpoint.Target('PKS 0408-65, radec, 4:08:20.38, -65:45:09.1')]
+        self.dataset = UVWDataSet(self.ants, targets, 10)
+        self.targets = targets
+
+    def _expected(self, antA, antB):
+        timestamps = self.dataset.timestamps
+        return np.hstack([target.uvw(antA, timestamps[segm], antB)
+                          for target, segm in zip(self.targets, [np.s_[:5], np.s_[5:]])])
+
+    def test_baseline_sensor(self):
+        u = self.dataset.sensor['Antennas/m063/u_m000']
+        v = self.dataset.sensor['Antennas/m063/v_m000']
+        w = self.dataset.sensor['Antennas/m063/w_m000']
+        # Agree to within the precision of ephem (a few cm on a 3.9 km baseline)
+        assert_allclose(np.array([u, v, w]), self._expected(self.ants[2], self.ants[0]), atol=5e-2)
+        # All antennas are done in one go
+        assert 'Antennas/m001/array_u' in self.dataset.sensor.keys()
+
+    def test_dataset_uvw(self):
+        uvw = [self.dataset.u, self.dataset.v, self.dataset.w]
+        assert_equal(uvw[0].shape, (10, 6))
+        for n, (inpA, inpB) in enumerate(self.dataset.corr_products):
+            antA, antB = [self.ants[[a.name for a in self.ants].index(inp[:-1])] for inp in (inpA, inpB)]
+            expected = self._expected(antA, antB)
+            assert_allclose(np.array([coord[:, n] for coord in uvw]), expected, atol=5e-2)
+
+
+class TestUVWMixedReferences(TestUVW):
+    """Test (u,v,w) calculation for antennas with different reference positions."""
+    def setup(self):
+        TestUVW.setup(self)
+        # Same physical location as m063, but relative to another reference position
+        ant = katpoint.Antenna(ANTENNAS[2])
+        other_ref = katpoint.Antenna('', -30.72 * np.pi / 180, 21.45 * np.pi / 180, 1050.0)
+        enu = other_ref.baseline_toward(ant)
+        moved = katpoint.Antenna('m063', *(other_ref.ref_position_wgs84 + (13.5, enu)))
+        self.ants[2] = moved
+        self.dataset = UVWDataSet(self.ants, self.targets, 10)
+
+    def test_mixed_references(self):
+        assert self.ants[2].ref_position_wgs84 != self.ants[0].ref_position_wgs84
+        u = self.dataset.sensor['Antennas/m063/u_m001']
+        v = self.dataset.sensor['Antennas/m063/v_m001']
+        w = self.dataset.sensor['Antennas/m063/w_m001']
+        assert_allclose(np.array([u, v, w]), self._expected(self.ants[2], self.ants[1]), atol=5e-2)
+
+
+class TestPointingSensors(object):
+    """Test array-based (ra, dec) and parallactic angle against katpoint."""
+    def setup(self):
+        self.ants = [katpoint.Antenna(ant) for ant in ANTENNAS]
+        target = katpoint.Target('J1939-6342, radec, 19:39:25.03, -63:42:45.6')
+        self.dataset = UVWDataSet(self.ants, [target, target], 20)
+        rs = np.random.RandomState(6)
+        for ant in self.ants:
+            self.dataset.sensor['Antennas/%s/az' % (ant.name,)] = rs.uniform(0, 2 * np.pi, 20)
+            self.dataset.sensor['Antennas/%s/el' % (ant.name,)] = rs.uniform(0.2, 1.5, 20)
+
+    def test_identical_to_katpoint(self):
+        ra, dec, parangle = self.dataset.ra, self.dataset.dec, self.dataset.parangle
+        for n, ant in enumerate(self.ants):
+            azel = [katpoint.construct_azel_target(az, el) for az, el in
+                    zip(self.dataset.sensor['Antennas/%s/az' % (ant.name,)],
+                        self.dataset.sensor['Antennas/%s/el' % (ant.name,)])]
+            timestamps = self.dataset.timestamps
+            radec = np.array([target.radec(t, ant) for target, t in zip(azel, timestamps)])
+            assert_array_equal(ra[:, n], katpoint.rad2deg(radec[:, 0]))
+            assert_array_equal(dec[:, n], katpoint.rad2deg(radec[:, 1]))
+            expected = [target.parallactic_angle(t, ant) for target, t in zip(azel, timestamps)]
+            assert_array_equal(parangle[:, n], katpoint.rad2deg(np.array(expected)))
+
+
+def test_utc_to_mjd():
+    """Test that array-based MJD conversion agrees bit for bit with katpoint."""
+    rs = np.random.RandomState(7)
+    timestamps = np.r_[rs.uniform(0, 2e9, 5000), 1234567890. + 0.125 * np.arange(2000), 0., 86400.]
+    expected = np.array([katpoint.Timestamp(t).to_mjd() for t in timestamps])
+    assert_array_equal(utc_to_mjd(timestamps), expected)
+    assert_equal(utc_to_mjd(timestamps[1].item()), expected[1])
+    dataset = UVWDataSet([katpoint.Antenna(ANTENNAS[0])], [katpoint.Target('Sun, special')] * 2, 10)
+    assert_array_equal(dataset.mjd, [katpoint.Timestamp(t).to_mjd() for t in dataset.timestamps])
+
+
+def _fail(x):
+    raise ValueError('Broken block')
@@ -29,7 +29,8 @@ import dask.array as da
 
 from katdal.chunkstore import generate_chunks
 from katdal.chunkstore_npy import NpyFileChunkStore
-from katdal.datasources import ChunkStoreVisFlagsWeights
+from katdal.datasources import (VisFlagsWeights, ChunkStoreVisFlagsWeights,
+                                _data_lost_map)
 
 
 def ramp(shape, offset=1.0, slope=1.0, dtype=np.float_):
@@ -69,6 +70,39 @@ def put_fake_dataset(store, prefix, shape, chunk_overrides=None):
     return data, chunk_info
 
 
+def test_data_lost_map():
+    flags_chunks = ((2, 2, 2), (3, 3), (4,))
+    # Missing chunk straddles the first two flags chunks along first axis
+    has_vis = np.ones((2, 2, 1), dtype=np.bool_)
+    has_vis[0, 1, 0] = False
+    # Missing chunk of 2-D array affects all flags chunks along last axis
+    has_weights_channel = np.ones((6, 1), dtype=np.bool_)
+    has_weights_channel[5, 0] = False
+    has_arrays = [(has_vis, ((3, 3), (3, 3), (4,))),
+                  (has_weights_channel, ((1,) * 6, (6,))),
+                  (np.ones((1, 1, 1), dtype=np.bool_), ((6,), (6,), (4,)))]
+    touched, offsets, missing = _data_lost_map(has_arrays, flags_chunks)
+    expected = np.zeros((3, 2, 1), dtype=np.bool_)
+    expected[0:2, 1, 0] = True
+    expected[2, :, 0] = True
+    assert_array_equal(touched, expected)
+    # Complete arrays are not needed to mark lost data
+    assert_equal(len(missing), 2)
+
+
+def test_select_flags():
+    shape = (4, 6, 3)
+    vis = da.zeros(shape, dtype=np.complex64, chunks=(2, 3, 3))
+    weights = da.ones(shape, dtype=np.float32, chunks=(2, 3, 3))
+    flags = ramp(shape, dtype=np.uint8)
+    vfw = VisFlagsWeights(vis, to_dask_array(flags, (2, 3, 3)), weights)
+    for flags_select in (255, 10, 0):
+        bool_flags, keep = vfw.select_flags(flags_select)
+        bool_flags = bool_flags.compute()
+        assert_equal(bool_flags.dtype, np.bool_)
+        assert_array_equal(bool_flags, (flags & flags_select) != 0)
+
+
 class TestChunkStoreVisFlagsWeights(object):
     """Test the :class:`ChunkStoreVisFlagsWeights` dataset store."""
 
@@ -93,6 +127,10 @@ class TestChunkStoreVisFlagsWeights(object):
         assert_array_equal(vfw.vis.compute(), data['correlator_data'])
         assert_array_equal(vfw.flags.compute(), data['flags'])
         assert_array_equal(vfw.weights.compute(), weights)
+        # Check that the weight components combine to the full weights
+        assert_array_equal(vfw.unscaled_weights.compute(), data['weights'])
+        assert_array_equal(vfw.weights_channel.compute(), data['weights_channel'])
+        assert_equal(VisFlagsWeights(vfw.vis, vfw.flags, vfw.weights).weights_channel, None)
 
     def _test_missing_chunks(self, shape, chunk_overrides=None):
         # Put fake dataset into chunk store
@@ -127,6 +165,47 @@ class TestChunkStoreVisFlagsWeights(object):
         for culled_slice in itertools.chain(*missing_chunks.values()):
             flags[culled_slice] |= 8
         assert_array_equal(vfw.flags, flags)
+        # Check that flag selection and bool conversion agree with raw flags
+        for flags_select in (255, 8, 1, 0):
+            assert_array_equal(vfw.select_flags(flags_select)[0],
+                               (flags & flags_select) != 0)
+        # Check that restricting arrays to the selected chunks gives same data
+        rs = np.random.RandomState(2)
+        keep = tuple(rs.random_sample(n) < 0.05 for n in vis.shape)
+        select = np.ix_(*keep)
+        subset_flags, subset_keep = vfw.select_flags(255, keep)
+        assert_array_equal(subset_flags.compute()[np.ix_(*subset_keep)], flags[select] != 0)
+        subset_vis, subset_keep = vfw.subset('vis', keep)
+        assert_array_equal(subset_vis.compute()[np.ix_(*subset_keep)], vis[select])
+        subset_weights, subset_keep = vfw.subset('weights', keep)
+        assert_array_equal(subset_weights.compute()[np.ix_(*subset_keep)], weights[select])
+
+    def test_subset(self):
+        store = NpyFileChunkStore(self.tempdir)
+        prefix = 'cb3'
+        shape = (10, 64, 30)
+        data, chunk_info = put_fake_dataset(store, prefix, shape)
+        vfw = ChunkStoreVisFlagsWeights(store, chunk_info)
+        time_keep = np.zeros(shape[0], dtype=np.bool_)
+        time_keep[[2, 3, 7]] = True
+        freq_keep = np.zeros(shape[1], dtype=np.bool_)
+        freq_keep[10:14] = True
+        keep = (time_keep, freq_keep, np.ones(shape[2], dtype=np.bool_))
+        vis, vis_keep = vfw.subset('vis', keep)
+        # Only the chunks of the selected dumps and channels are in the graph
+        assert_equal(vis.shape, (3, 8, 30))
+        assert_equal(len(vis.dask), 6)
+        assert_array_equal(vis.compute()[np.ix_(*vis_keep)],
+                           data['correlator_data'][np.ix_(*keep)])
+        # The subset is reused while the selection touches the same chunks
+        freq_keep[[10, 13]] = False
+        vis2, vis_keep2 = vfw.subset('vis', keep)
+        assert_equal(vis2.name, vis.name)
+        assert_array_equal(vis2.compute()[np.ix_(*vis_keep2)],
+                           data['correlator_data'][np.ix_(*keep)])
+        channel, channel_keep = vfw.subset('weights_channel', keep[:2])
+        assert_array_equal(channel.compute()[np.ix_(*channel_keep)],
+                           data['weights_channel'][np.ix_(*keep[:2])])
 
     def test_missing_chunks(self):
         self._test_missing_chunks((100, 256, 30))
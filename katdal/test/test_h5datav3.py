@@ -0,0 +1,70 @@
+################################################################################
+# Copyright (c) 2018, National Research Foundation (Square Kilometre Array)
+#
+# Licensed under the BSD 3-Clause License (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+################################################################################
+
+"""Tests for :py:mod:`katdal.h5datav3`."""
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from numpy.testing import assert_array_equal
+from nose.tools import assert_equal, assert_raises
+import h5py
+
+from katdal.h5datav3 import DirectDataset
+from katdal.lazy_indexer import LazyIndexer, dask_array_from_hdf5
+
+
+class TestDirectDataset(object):
+    """Test reading HDF5 datasets directly from their storage."""
+    def setup(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.file = h5py.File(os.path.join(self.tempdir, 'test.h5'), 'w')
+        self.data = np.arange(7 * 10 * 6 * 2, dtype=np.float32).reshape(7, 10, 6, 2)
+
+    def teardown(self):
+        self.file.close()
+        shutil.rmtree(self.tempdir)
+
+    def _test_indexing(self, dataset):
+        direct = DirectDataset(dataset)
+        assert_equal(direct.shape, self.data.shape)
+        assert_equal(len(direct), len(self.data))
+        indices = [np.s_[:], np.s_[2:5], np.s_[3, 1:9, 5], np.s_[-1, :, 2:3, 0],
+                   np.s_[1:6, 4:4], np.s_[::2, [0, 3]], np.s_[..., 1]]
+        for index in indices:
+            assert_array_equal(direct[index], self.data[index])
+            # Selections are proper arrays that have been read from disk
+            assert direct[index].flags.writeable
+        assert_raises(IndexError, direct.__getitem__, (7, 0))
+        stage1 = (np.s_[1:6], [0, 2, 3, 7], slice(None))
+        indexer = LazyIndexer(direct, stage1)
+        assert_array_equal(indexer[1:3], self.data[1:6][:, [0, 2, 3, 7]][1:3])
+        assert_array_equal(dask_array_from_hdf5(direct).compute(), self.data)
+
+    def test_contiguous(self):
+        dataset = self.file.create_dataset('contiguous', data=self.data)
+        self.file.flush()
+        self._test_indexing(dataset)
+
+    def test_unsupported(self):
+        chunked = self.file.create_dataset('chunked', data=self.data, chunks=(2, 4, 6, 1))
+        assert_raises(ValueError, DirectDataset, chunked)
+        compressed = self.file.create_dataset('compressed', data=self.data, compression='gzip')
+        assert_raises(ValueError, DirectDataset, compressed)
+        empty = self.file.create_dataset('empty', self.data.shape, self.data.dtype)
+        assert_raises(ValueError, DirectDataset, empty)
@@ -18,10 +18,12 @@
 
 import numpy as np
 import dask.array as da
+import h5py
 
-from nose.tools import assert_raises
+from nose.tools import assert_raises, assert_equal
 
-from katdal.lazy_indexer import _simplify_index, DaskLazyIndexer
+from katdal.lazy_indexer import (_simplify_index, LazyIndexer, DaskLazyIndexer,
+                                 dask_array_from_hdf5)
 
 
 class TestSimplifyIndices(object):
@@ -71,6 +73,78 @@ class TestSimplifyIndices(object):
         self._test_index_error(np.s_[0, 0, 0, 0])
 
 
+def _outer_index(data, index):
+    """Apply index to numpy array independently per axis."""
+    axis = 0
+    for dim_index in index:
+        data = data[(slice(None),) * axis + (dim_index,)]
+        if not np.isscalar(dim_index):
+            axis += 1
+    return data
+
+
+class CountingDataset(object):
+    """Array wrapper that only supports basic indexing and counts reads."""
+    def __init__(self, data, chunks=None):
+        self.data = data
+        self.shape = data.shape
+        self.dtype = data.dtype
+        self.chunks = chunks
+        self.reads = 0
+
+    def __getitem__(self, index):
+        assert all(np.isscalar(k) or isinstance(k, slice) for k in index)
+        self.reads += 1
+        return self.data[index]
+
+
+class TestLazyIndexer(object):
+    """Test the :class:`~katdal.lazy_indexer.LazyIndexer` class."""
+    def setup(self):
+        shape = (20, 64, 30)
+        self.data = np.arange(np.product(shape)).reshape(shape)
+
+    def _test_with(self, stage1, stage2=(), read_overhead=None):
+        dataset = CountingDataset(self.data)
+        indexer = LazyIndexer(dataset, stage1)
+        if read_overhead is not None:
+            indexer.read_overhead = read_overhead
+        expected = _outer_index(_outer_index(self.data, stage1), stage2)
+        np.testing.assert_array_equal(indexer[stage2], expected)
+        return dataset.reads
+
+    def test_stage1_and_stage2(self):
+        self._test_with((np.s_[2:], [1, 5, 6, 7, 40], np.arange(30) % 3 == 0))
+        self._test_with((np.s_[3:4], np.s_[::2], [0, 29]), (np.s_[:], np.s_[1:], [1]))
+        self._test_with((np.arange(20) < 10, np.s_[4:5], np.s_[:]), ([9, 0], 0))
+        self._test_with((np.s_[:], [], np.s_[:]))
+
+    def test_unsorted_and_duplicate_indices(self):
+        self._test_with(([7, 2, 2, 19], np.s_[3:17], [29, 0, 5, 5, 12]))
+        self._test_with(([-1, 3], [60, 2, 60]), ([1, 1, 0], np.s_[::-1]))
+
+    def test_merge_segments(self):
+        stage1 = (np.s_[:], np.arange(0, 64, 2), np.arange(0, 30, 3))
+        # Without read overhead each contiguous piece is read separately
+        assert_equal(self._test_with(stage1, read_overhead=0), 32 * 10)
+        # With the default overhead the small gaps are read too
+        assert_equal(self._test_with(stage1), 1)
+
+    def test_hdf5_chunks(self):
+        h5file = h5py.File('lazy_indexer_test.h5', 'w', driver='core', backing_store=False)
+        dataset = h5file.create_dataset('data', data=self.data, chunks=(1, 16, 30))
+        stage1 = (np.s_[:], [0, 2, 4, 20, 30, 50], np.s_[:])
+        indexer = LazyIndexer(dataset, stage1)
+        np.testing.assert_array_equal(indexer[[3, 1, 4]], self.data[[3, 1, 4]][:, stage1[1]])
+        # Segments sharing a chunk are read together, even without read overhead
+        counter = CountingDataset(self.data, dataset.chunks)
+        indexer = LazyIndexer(counter, (np.s_[0:1], [0, 2, 4, 20, 63], np.s_[0:1]))
+        indexer.read_overhead = 0
+        np.testing.assert_array_equal(indexer[:], self.data[0:1, [0, 2, 4, 20, 63], 0:1])
+        assert_equal(counter.reads, 2)
+        h5file.close()
+
+
 class TestDaskLazyIndexer(object):
     """Test the :func:`~katdal.lazy_indexer.DaskLazyIndexer class."""
     def setup(self):
@@ -87,3 +161,49 @@ class TestDaskLazyIndexer(object):
         stage1 = tuple([True] * d for d in self.data.shape)
         indexer = DaskLazyIndexer(self.data_dask, stage1)
         np.testing.assert_array_equal(indexer[:], self.data)
+
+    def test_stage1_unsorted_and_duplicate_indices(self):
+        stage1 = ([7, 2, 2, 9], np.s_[3:17], [29, 0, 5, 5, 12])
+        indexer = DaskLazyIndexer(self.data_dask, stage1)
+        expected = self.data[np.ix_([7, 2, 2, 9], range(3, 17), [29, 0, 5, 5, 12])]
+        np.testing.assert_array_equal(indexer[:], expected)
+        # Output blocks follow runs of indices served by the same input chunk
+        assert_equal(indexer.dataset.chunks, ((1, 2, 1), (1, 4, 4, 4, 1), (5,)))
+
+    def test_stage2_multiple_fancy_indices(self):
+        stage1 = np.s_[2:, :, ::-1]
+        indexer = DaskLazyIndexer(self.data_dask, stage1)
+        stage2 = (np.array([True, False] * 4), -1, [25, 3, -4, 3])
+        expected = self.data[stage1][np.ix_(np.flatnonzero(stage2[0]), [19], [25, 3, 26, 3])][:, 0]
+        np.testing.assert_array_equal(indexer[stage2], expected)
+        stage2 = (np.array([True, False] * 4), 3, [30])
+        with assert_raises(IndexError):
+            indexer[stage2]
+
+    def test_zero_and_multi_dimensional_index_arrays(self):
+        indexer = DaskLazyIndexer(self.data_dask)
+        # A 0-d integer array drops its axis, like an integer
+        np.testing.assert_array_equal(indexer[np.array(3), [4, 1]], self.data[3][[4, 1]])
+        np.testing.assert_array_equal(indexer[[5, 2], :, np.array(-2)], self.data[[5, 2]][:, :, -2])
+        # Index arrays with more than one dimension have no outer indexing interpretation
+        with assert_raises(ValueError):
+            indexer[np.array([[0, 1], [1, 2]]), [3, 1]]
+        with assert_raises(ValueError):
+            DaskLazyIndexer(self.data_dask, (np.array([[0, 1], [1, 2]]), [3, 1])).dataset
+
+
+def test_dask_array_from_hdf5():
+    data = np.arange(20 * 64 * 30 * 2, dtype=np.float32).reshape(20, 64, 30, 2)
+    h5file = h5py.File('dask_array_test.h5', 'w', driver='core', backing_store=False)
+    chunked = h5file.create_dataset('chunked', data=data, chunks=(2, 16, 30, 2))
+    contiguous = h5file.create_dataset('contiguous', data=data)
+    chunk_bytes = 4 * 2 * 16 * 30 * 2 * 4
+    darray = dask_array_from_hdf5(chunked, chunk_bytes)
+    # Dask chunks are made up of whole HDF5 chunks, combined along time
+    assert_equal(darray.chunks, ((8, 8, 4), (16,) * 4, (30,), (2,)))
+    np.testing.assert_array_equal(darray.compute(), data)
+    darray = dask_array_from_hdf5(contiguous, chunk_bytes)
+    assert_equal(darray.chunks[1:], ((64,), (30,), (2,)))
+    indexer = DaskLazyIndexer(darray, (np.s_[3:], [5, 1, 9]))
+    np.testing.assert_array_equal(indexer[::2, :, 4], data[3::2][:, [5, 1, 9]][:, :, 4])
+    h5file.close()
@@ -0,0 +1,70 @@
+################################################################################
+# Copyright (c) 2018, National Research Foundation (Square Kilometre Array)
+#
+# Licensed under the BSD 3-Clause License (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+################################################################################
+
+"""Tests for :py:mod:`katdal.ms_async`."""
+
+import numpy as np
+from numpy.testing import assert_array_equal
+
+from katdal.ms_async import permute_baselines
+
+
+def random_products(shape, seed=1):
+    """Random vis, weights and flags with dimensions (time, channel, pol-baseline)."""
+    rs = np.random.RandomState(seed)
+    vis = (rs.standard_normal(shape) + 1j * rs.standard_normal(shape)).astype(np.complex64)
+    weights = rs.random_sample(shape).astype(np.float32)
+    flags = rs.random_sample(shape) < 0.3
+    return vis, weights, flags
+
+
+class TestPermuteBaselines(object):
+    """Test reordering of baselines into MS layout."""
+    def _test_permute(self, n_time, n_chans, cp_index):
+        n_bls, n_pols = cp_index.shape
+        inputs = random_products((n_time, n_chans, cp_index.max() + 1))
+        outputs = [np.empty((n_time, n_bls, n_chans, n_pols), x.dtype) for x in inputs]
+        permute_baselines(*(inputs + (cp_index,) + tuple(outputs)))
+        present = cp_index >= 0
+        # Compare with baseline and pol as the last two axes
+        outputs = [out.transpose(0, 2, 1, 3) for out in outputs]
+        for x, out in zip(inputs, outputs):
+            expected = x[:, :, np.where(present, cp_index, 0)]
+            assert_array_equal(out[:, :, present], expected[:, :, present])
+        assert_array_equal(outputs[0][:, :, ~present], 0)
+        assert_array_equal(outputs[1][:, :, ~present], 0)
+        assert_array_equal(outputs[2][:, :, ~present], True)
+
+    def test_full_pol(self):
+        # Shuffled products spanning several baseline and channel tiles
+        cp_index = np.random.RandomState(2).permutation(37 * 4).reshape(37, 4)
+        self._test_permute(3, 150, cp_index)
+
+    def test_missing_products(self):
+        cp_index = np.arange(20 * 4).reshape(20, 4)[::-1].copy()
+        cp_index[[1, 7], [0, 3]] = -1
+        self._test_permute(2, 70, cp_index)
+
+    def test_few_baselines(self):
+        # A single baseline tile is copied in channel order instead
+        cp_index = np.random.RandomState(3).permutation(10 * 4).reshape(10, 4)
+        cp_index[6, 2] = -1
+        self._test_permute(2, 300, cp_index)
+
+    def test_dual_pol(self):
+        cp_index = np.arange(2 * 19).reshape(19, 2)
+        cp_index[4, 1] = -1
+        self._test_permute(1, 5, cp_index)
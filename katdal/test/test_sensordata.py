@@ -0,0 +1,240 @@
+################################################################################
+# Copyright (c) 2018, National Research Foundation (Square Kilometre Array)
+#
+# Licensed under the BSD 3-Clause License (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+################################################################################
+
+"""Tests for :py:mod:`katdal.sensordata`."""
+
+from collections import OrderedDict
+
+import numpy as np
+from numpy.testing import assert_array_equal
+from nose.tools import assert_equal, assert_raises
+import katsdptelstate
+
+from katdal.h5datav3 import VIRTUAL_SENSORS as H5DATAV3_VIRTUAL_SENSORS
+from katdal.sensordata import (SensorCache, VirtualSensorTable, RecordSensorData, TelstateSensorData, dummy_sensor_data,
+                               remove_duplicates_and_invalid_values, _safe_linear_interp)
+
+
+def _calc_template(template):
+    """Virtual sensor function that records its template and arguments."""
+    def calc(cache, name, **kwargs):
+        cache[name] = result = (template, kwargs)
+        return result
+    return calc
+
+
+class TestVirtualSensorTable(object):
+    """Test matching of sensor names against virtual sensor templates."""
+    def setup(self):
+        self.templates = ['Antennas/{ant}/az', 'Antennas/{antA}/[uvw]_{antB}', 'Antennas/{ant}/[uvw]',
+                          'Antennas/{ant}/array_[uvw]', 'Timestamps/mjd', 'Antennas/{ant}/{coord}']
+
+    def test_first_match_wins(self):
+        table = VirtualSensorTable(self.templates)
+        assert_equal(table.match('Antennas/m000/az'), ('Antennas/{ant}/az', {'ant': 'm000'}))
+        assert_equal(table.match('Antennas/m000/u_m001'),
+                     ('Antennas/{antA}/[uvw]_{antB}', {'antA': 'm000', 'antB': 'm001'}))
+        # Templates match a prefix of the name, like re.match
+        assert_equal(table.match('Antennas/m000/ux'), ('Antennas/{ant}/[uvw]', {'ant': 'm000'}))
+        assert_equal(table.match('Antennas/m000/array_v'), ('Antennas/{ant}/array_[uvw]', {'ant': 'm000'}))
+        assert_equal(table.match('Timestamps/mjd'), ('Timestamps/mjd', {}))
+        assert_equal(table.match('Antennas/m000/ra'), ('Antennas/{ant}/{coord}', {'ant': 'm000', 'coord': 'ra'}))
+        assert_equal(table.match('Observation/target'), (None, {}))
+
+    def test_many_templates(self):
+        # More groups than a single regular expression can hold
+        templates = ['Sensor{}/{{a}}/{{b}}'.format(n) for n in range(100)]
+        table = VirtualSensorTable(templates)
+        assert len(table._regexes) > 1
+        for n in (0, 33, 99):
+            assert_equal(table.match('Sensor{}/x/y'.format(n)), (templates[n], {'a': 'x', 'b': 'y'}))
+
+
+class TestSensorCache(object):
+    """Test virtual sensor dispatch and property lookup in sensor cache."""
+    def setup(self):
+        self.timestamps = np.arange(10.)
+        virtual = OrderedDict((template, _calc_template(template))
+                              for template in ['Antennas/{ant}/az', 'Antennas/{ant}/{coord}'])
+        props = {'*nd_coupler': {'categorical': True, 'initial_value': '0'},
+                 '*coupler': {'initial_value': '1', 'greedy_values': ('1',)},
+                 'Antennas/m000/rsc_nd_coupler': {'transform': int}}
+        cache = {'Antennas/m000/rsc_nd_coupler': dummy_sensor_data('Antennas/m000/rsc_nd_coupler', '1', '|S1'),
+                 'Antennas/m000/temperature': dummy_sensor_data('Antennas/m000/temperature', 20.0)}
+        self.cache = SensorCache(cache, self.timestamps, 1.0, props=props, virtual=virtual)
+
+    def test_virtual(self):
+        assert_equal(self.cache.get('Antennas/m000/az'), ('Antennas/{ant}/az', {'ant': 'm000'}))
+        assert_equal(self.cache.get('Antennas/m001/el'), ('Antennas/{ant}/{coord}', {'ant': 'm001', 'coord': 'el'}))
+        assert_raises(KeyError, self.cache.get, 'Observation/target')
+        # Templates may be added after construction
+        self.cache.virtual = dict(self.cache.virtual)
+        self.cache.virtual['Observation/{sensor}'] = _calc_template('Observation/{sensor}')
+        assert_equal(self.cache.get('Observation/target'), ('Observation/{sensor}', {'sensor': 'target'}))
+
+    def test_props(self):
+        assert_array_equal(self.cache['Antennas/m000/temperature'], np.full(10, 20.0))
+        self.cache.get('Antennas/m000/rsc_nd_coupler')
+        # The most specific wildcard properties are applied last
+        assert_equal(self.cache.props['Antennas/m000/rsc_nd_coupler'],
+                     {'categorical': True, 'initial_value': '0', 'greedy_values': ('1',), 'transform': int})
+        # Wildcard properties may be added after construction
+        self.cache.props['*temperature'] = {'interp_degree': 0}
+        self.cache.get('Antennas/m000/temperature', interp_degree=1)
+        del self.cache['Antennas/m000/temperature']
+        self.cache['Antennas/m001/temperature'] = dummy_sensor_data('Antennas/m001/temperature', 20.0)
+        self.cache.get('Antennas/m001/temperature')
+        assert_equal(self.cache.props['Antennas/m001/temperature'], {'interp_degree': 0, 'categorical': False})
+        # Replacing one wildcard class by another keeps the number of properties the same
+        del self.cache.props['*temperature']
+        self.cache.props['*pressure'] = {'interp_degree': 0}
+        self.cache['Antennas/m002/temperature'] = dummy_sensor_data('Antennas/m002/temperature', 20.0)
+        self.cache['Antennas/m002/pressure'] = dummy_sensor_data('Antennas/m002/pressure', 1000.0)
+        self.cache.get('Antennas/m002/temperature')
+        self.cache.get('Antennas/m002/pressure')
+        assert_equal(self.cache.props['Antennas/m002/temperature'], {'interp_degree': 1, 'categorical': False})
+        assert_equal(self.cache.props['Antennas/m002/pressure'], {'interp_degree': 0, 'categorical': False})
+
+
+def _sensor_data(name, timestamps, values):
+    data = np.array(zip(timestamps, values), dtype=[('timestamp', np.float64), ('value', np.asarray(values).dtype)])
+    return RecordSensorData(data, name)
+
+
+class TestTelstateSensorData(object):
+    """Test sensor data read from telstate."""
+    def setup(self):
+        self.telstate = katsdptelstate.TelescopeState()
+        for n, (azim, activity, gains) in enumerate([(10.5, 'slew', [1, 2]), (11.0, 'track', [3, 4]),
+                                                     (11.5, 'track', [5, 6])]):
+            self.telstate.add('m000_pos_actual_scan_azim', azim, ts=100. + n)
+            self.telstate.add('m000_activity', activity, ts=100. + n)
+            self.telstate.add('cal_product_G', np.array(gains), ts=100. + n)
+        self.telstate.add('sub_band', 'l', immutable=True)
+
+    def test_columns(self):
+        azim = TelstateSensorData(self.telstate, 'm000_pos_actual_scan_azim')
+        assert_equal(azim.dtype, None)
+        assert_array_equal(azim['timestamp'], [100., 101., 102.])
+        assert_array_equal(azim['value'], [10.5, 11.0, 11.5])
+        assert_equal(azim.dtype, np.float64)
+        # Repeated access returns the same (read-only) arrays
+        assert azim['value'] is azim['value']
+        assert azim['timestamp'] is azim['timestamp']
+        assert_raises(ValueError, azim['value'].__setitem__, 0, 1.0)
+        activity = TelstateSensorData(self.telstate, 'm000_activity')
+        assert_array_equal(activity['value'], ['slew', 'track', 'track'])
+        assert_equal(activity.dtype.kind, 'S')
+        gains = TelstateSensorData(self.telstate, 'cal_product_G')
+        assert_equal(gains['value'].shape, (3,))
+        assert_equal(gains.dtype, np.object)
+        assert_equal(gains['value'][1], np.array([3, 4]))
+        assert_raises(ValueError, gains.__getitem__, 'status')
+
+    def test_missing(self):
+        assert_raises(KeyError, TelstateSensorData, self.telstate, 'm000_pos_actual_scan_elev')
+        assert_raises(KeyError, TelstateSensorData, self.telstate, 'sub_band')
+
+
+def test_safe_linear_interp_columns():
+    xi = np.array([1., 2.5, 4., 8.])
+    yi = np.random.RandomState(3).standard_normal((4, 3))
+    x = np.arange(0., 10., 0.7)
+    interp = _safe_linear_interp(xi, yi, x)
+    assert_equal(interp.shape, (len(x), 3))
+    for n in range(3):
+        assert_array_equal(interp[:, n], _safe_linear_interp(xi, yi[:, n], x))
+    assert_array_equal(_safe_linear_interp(xi[:1], yi[:1], x), np.tile(yi[0], (len(x), 1)))
+
+
+def test_remove_duplicates_and_invalid_values():
+    timestamps = [3., 1., 2., 2., 5., 4., 1., 5.]
+    values = [30., 10., 20., 21., 50., 40., 10., 51.]
+    status = ['unknown', 'warn', 'failure', 'nominal', 'error', 'nominal', 'nominal', 'nominal']
+    data = np.array(zip(timestamps, values, status),
+                    dtype=[('timestamp', np.float64), ('value', np.float64), ('status', '|S7')])
+    clean = remove_duplicates_and_invalid_values(RecordSensorData(data, 'sensor'))
+    # The last of each set of duplicates is kept, and statuses follow their values when sorting
+    assert_raises(ValueError, clean.__getitem__, 'status')
+    assert_array_equal(clean['timestamp'], [1., 2., 4., 5.])
+    assert_array_equal(clean['value'], [10., 21., 40., 51.])
+    clean = remove_duplicates_and_invalid_values(RecordSensorData(data[['timestamp', 'value']], 'sensor'))
+    assert_array_equal(clean['timestamp'], [1., 2., 3., 4., 5.])
+    assert_array_equal(clean['value'], [10., 21., 30., 40., 51.])
+
+
+class TestGetMany(object):
+    """Test extraction of several sensors at once."""
+    def setup(self):
+        rs = np.random.RandomState(4)
+        shared = np.sort(rs.uniform(0, 20, 15))
+        self.raw = {'Antennas/m000/azim': _sensor_data('azim', shared, rs.standard_normal(15)),
+                    'Antennas/m000/elev': _sensor_data('elev', shared, rs.standard_normal(15)),
+                    'Antennas/m001/azim': _sensor_data('azim', np.r_[shared[::-1], 3.0], rs.standard_normal(16)),
+                    'Antennas/m001/elev': _sensor_data('elev', [], np.array([], dtype=np.float64)),
+                    'Antennas/m000/mode': _sensor_data('mode', shared[::5], ['STOP', 'POINT', 'STOP'])}
+        virtual = {'Antennas/{ant}/az': lambda cache, name, ant: cache.get('Antennas/%s/azim' % (ant,)) * 2}
+        self.names = ['Antennas/m000/azim', 'Antennas/m001/elev', 'Antennas/m000/az',
+                      'Antennas/m000/mode', 'Antennas/m001/azim', 'Antennas/m000/elev', 'Antennas/m000/azim']
+        self.caches = [SensorCache(dict(self.raw), np.arange(2., 22.), 1.0, keep=slice(3, 12), virtual=virtual)
+                       for n in range(3)]
+
+    def test_same_as_get(self):
+        expected = [self.caches[0].get(name, select=True) for name in self.names]
+        for cache, max_threads in zip(self.caches[1:], [1, 4]):
+            actual = cache.get_many(self.names, select=True, max_threads=max_threads)
+            assert_equal(len(actual), len(expected))
+            for a, e in zip(actual, expected):
+                assert_array_equal(a, e)
+            assert_equal(cache.props, self.caches[0].props)
+
+    def test_virtual_dependencies(self):
+        log = []
+
+        class LoggingSensorCache(SensorCache):
+            @staticmethod
+            def _clean(name, sensor_data, props):
+                log.append(name)
+                return SensorCache._clean(name, sensor_data, props)
+
+        def calc_azel(cache, name, ant):
+            log.append(name)
+            return H5DATAV3_VIRTUAL_SENSORS['Antennas/{ant}/az'](cache, name, ant)
+        calc_azel.dependencies = H5DATAV3_VIRTUAL_SENSORS['Antennas/{ant}/az'].dependencies
+
+        rs = np.random.RandomState(5)
+        timestamps = np.sort(rs.uniform(0, 20, 15))
+        raw = {}
+        for ant in ('m000', 'm001', 'm002'):
+            for coord in ('azim', 'elev'):
+                name = 'Antennas/%s/pos_actual_scan_%s' % (ant, coord)
+                raw[name] = _sensor_data(name, timestamps, rs.uniform(0, 90, 15))
+        virtual = {'Antennas/{ant}/az': calc_azel, 'Antennas/{ant}/el': calc_azel}
+        cache = LoggingSensorCache(raw, np.arange(2., 22.), 1.0, virtual=virtual)
+        names = ['Antennas/%s/%s' % (ant, coord) for ant in ('m000', 'm001', 'm002') for coord in ('az', 'el')]
+        values = cache.get_many(names)
+        # The actual pointing sensors are all extracted in the batch before any (az, el) is calculated
+        assert_equal(sorted(log[:6]), sorted(raw))
+        assert_equal(log[6:], names)
+        expected = SensorCache(dict(raw), np.arange(2., 22.), 1.0, virtual=H5DATAV3_VIRTUAL_SENSORS)
+        for name, value in zip(names, values):
+            assert_array_equal(value, expected.get(name))
+
+    def test_errors(self):
+        assert_raises(ValueError, self.caches[1].get_many, self.names, select=True, extract=False)
+        assert_raises(KeyError, self.caches[1].get_many, ['Antennas/m000/azim', 'Observation/target'])
+        raw = self.caches[2].get_many(self.names[:2], extract=False)
+        assert_equal(raw, [self.raw[name] for name in self.names[:2]])
@@ -20,7 +20,6 @@ import logging
 
 import numpy as np
 import katpoint
-import dask.array as da
 
 from .dataset import (DataSet, BrokenFile, Subarray, SpectralWindow,
                       DEFAULT_SENSOR_PROPS, DEFAULT_VIRTUAL_SENSORS,
@@ -54,14 +53,20 @@ SENSOR_ALIASES = {
 }
 
 
+def _azel_sensors(name, ant):
+    """Actual sensor behind virtual (az, el) sensor (as a dependency list)."""
+    return ['%s_pos_actual_scan_%s' % (ant, 'azim' if name.endswith('az') else 'elev')]
+
+
 def _calc_azel(cache, name, ant):
     """Calculate virtual (az, el) sensors from actual ones in sensor cache."""
-    real_sensor = '%s_pos_actual_scan_%s' % \
-                  (ant, 'azim' if name.endswith('az') else 'elev')
-    cache[name] = sensor_data = katpoint.deg2rad(cache.get(real_sensor))
+    cache[name] = sensor_data = katpoint.deg2rad(cache.get(_azel_sensors(name, ant)[0]))
     return sensor_data
 
 
+_calc_azel.dependencies = _azel_sensors
+
+
 VIRTUAL_SENSORS = dict(DEFAULT_VIRTUAL_SENSORS)
 VIRTUAL_SENSORS.update({'Antennas/{ant}/az': _calc_azel,
                         'Antennas/{ant}/el': _calc_azel})
@@ -350,22 +355,35 @@ class VisibilityDataV4(DataSet):
         update_flags = update_all or flags_keep is not None
         if not self.source.data:
             self._vis = self._weights = self._flags = None
+            self._unscaled_weights = self._weights_channel = None
         elif update_flags:
             # Create first-stage index from dataset selectors. Note: use
             # the member variables, not the parameters, because the parameters
             # can be None to indicate no change
             stage1 = (self._time_keep, self._freq_keep, self._corrprod_keep)
             if update_all:
-                # Cache dask graphs for the data fields
-                self._vis = DaskLazyIndexer(self.source.data.vis, stage1)
-                self._weights = DaskLazyIndexer(self.source.data.weights, stage1)
-            flag_transforms = []
-            if ~self._flags_select != 0:
-                # Copy so that the lambda isn't affected by future changes
-                select = self._flags_select.copy()
-                flag_transforms.append(lambda flags: da.bitwise_and(select, flags))
-            flag_transforms.append(lambda flags: flags.view(np.bool_))
-            self._flags = DaskLazyIndexer(self.source.data.flags, stage1, flag_transforms)
+                # Cache dask graphs for the data fields, only including the
+                # chunks touched by the selection where the source allows it
+                data = self.source.data
+                vis, vis_keep = data.subset('vis', stage1)
+                self._vis = DaskLazyIndexer(vis, vis_keep)
+                channel, channel_keep = data.subset('weights_channel', stage1[:2])
+                if channel is None:
+                    weights, weights_keep = data.subset('weights', stage1)
+                    self._weights = DaskLazyIndexer(weights, weights_keep)
+                    self._unscaled_weights = self._weights_channel = None
+                else:
+                    # Scale the weights per channel only after selection, to
+                    # avoid forming the full product for a subset of the data
+                    weights_channel = DaskLazyIndexer(channel, channel_keep)
+                    weights, weights_keep = data.subset('unscaled_weights', stage1)
+                    scale = lambda weights: weights * weights_channel.dataset[..., np.newaxis]  # noqa: E731
+                    self._weights = DaskLazyIndexer(weights, weights_keep, [scale])
+                    self._unscaled_weights = DaskLazyIndexer(weights, weights_keep)
+                    self._weights_channel = weights_channel
+            # Mark lost data, apply flag mask and turn into bools in one go
+            flags, flags_keep = self.source.data.select_flags(self._flags_select[0], stage1)
+            self._flags = DaskLazyIndexer(flags, flags_keep)
 
     @property
     def timestamps(self):
@@ -422,6 +440,38 @@ class VisibilityDataV4(DataSet):
                              'was opened with metadata only')
         return self._weights
 
+    @property
+    def unscaled_weights(self):
+        """Low-resolution visibility weights before per-channel scaling.
+
+        The weights are returned as an array indexer of uint8, shape
+        (*T*, *F*, *B*), with the same selection as :meth:`weights`. Multiply
+        them by :meth:`weights_channel` (broadcast along the last dimension)
+        to obtain the actual weights. This is useful for bandwidth-bound code
+        that prefers to apply the scale factors itself.
+
+        """
+        if self._unscaled_weights is None:
+            raise ValueError('Unscaled weights are not available since dataset '
+                             'was opened with metadata only or does not '
+                             'store weights as separate components')
+        return self._unscaled_weights
+
+    @property
+    def weights_channel(self):
+        """Per-channel scale factors of visibility weights.
+
+        The factors are returned as an array indexer of float32, shape
+        (*T*, *F*), with the same time and frequency selection as
+        :meth:`weights`. See :meth:`unscaled_weights` for more details.
+
+        """
+        if self._weights_channel is None:
+            raise ValueError('Per-channel weights are not available since dataset '
+                             'was opened with metadata only or does not '
+                             'store weights as separate components')
+        return self._weights_channel
+
     @property
     def flags(self):
         """Flags as a function of time, frequency and baseline.
@@ -34,7 +34,6 @@ import Queue
 import numpy as np
 import dask
 import dask.array as da
-import numba
 
 import katpoint
 import katdal
@@ -75,48 +74,6 @@ def load(dataset, indices, vis, weights, flags):
         flags[:] = dataset.flags[indices]
 
 
-@numba.jit(nopython=True, parallel=True)
-def permute_baselines(in_vis, in_weights, in_flags, cp_index, out_vis, out_weights, out_flags):
-    """Reorganise baselines and axis order.
-
-    The inputs have dimensions (time, channel, pol-baseline), and the output has shape
-    (time, baseline, channel, pol). cp_index is a 2D array which is indexed by baseline and
-    pol to get the input pol-baseline.
-
-    cp_index may contain negative indices if the data is not present, in which
-    case it is filled with 0s and flagged.
-
-    This could probably be optimised further: the current implementation isn't
-    particularly cache-friendly, and it could benefit from unrolling the loop
-    over polarisations in some way
-    """
-    # Workaround for https://github.com/numba/numba/issues/2921
-    in_flags_u8 = in_flags.view(np.uint8)
-    n_time, n_bls, n_chans, n_pols = out_vis.shape
-    bstep = 128
-    bblocks = (n_bls + bstep - 1) // bstep
-    for t in range(n_time):
-        for bblock in numba.prange(bblocks):
-            bstart = bblock * bstep
-            bstop = min(n_bls, bstart + bstep)
-            for c in range(n_chans):
-                for b in range(bstart, bstop):
-                    for p in range(out_vis.shape[3]):
-                        idx = cp_index[b, p]
-                        if idx >= 0:
-                            vis = in_vis[t, c, idx]
-                            weight = in_weights[t, c, idx]
-                            flag = in_flags_u8[t, c, idx] != 0
-                        else:
-                            vis = np.complex64(0 + 0j)
-                            weight = np.float32(0)
-                            flag = np.bool_(True)
-                        out_vis[t, b, c, p] = vis
-                        out_weights[t, b, c, p] = weight
-                        out_flags[t, b, c, p] = flag
-    return out_vis, out_weights, out_flags
-
-
 def main():
     tag_to_intent = {'gaincal': 'CALIBRATE_PHASE,CALIBRATE_AMPLI',
                      'bpcal': 'CALIBRATE_BANDPASS,CALIBRATE_FLUX',
@@ -218,7 +175,7 @@ def main():
         # Generate baseline antenna pairs
         ant1_index, ant2_index = antenna_indices(len(dataset.ants), options.no_auto)
         # Order as similarly to the input as possible, which gives better performance
-        # in permute_baselines.
+        # in ms_async.permute_baselines.
         bl_indices = zip(ant1_index, ant2_index)
         bl_indices.sort(key=lambda (a1, a2): _cp_index(dataset.ants[a1],
                                                        dataset.ants[a2],
@@ -543,22 +500,24 @@ def main():
 
                     out_utc = utc_seconds[ltime:utime]
 
-                    # Overwrite the input visibilities with averaged visibilities,
-                    # flags, weights, timestamps, channel freqs
+                    # Select correlator products and permute axes
+                    cp_index = cp_info.cp_index.reshape((nbl, npol))
                     if average_data:
-                        vis_data, weight_data, flag_data, out_utc, out_freqs = \
-                            averager.average_visibilities(vis_data, weight_data, flag_data,
-                                                          out_utc, out_freqs, timeav=dump_av,
-                                                          chanav=chan_av, flagav=options.flagav)
+                        # Average visibilities, flags and weights straight into the
+                        # output slot, and average the timestamps and channel freqs
+                        vis_data, weight_data, flag_data = averager.average_and_permute(
+                            vis_data, weight_data, flag_data, cp_index,
+                            ms_vis_data[slot], ms_weight_data[slot], ms_flag_data[slot],
+                            timeav=dump_av, chanav=chan_av, flagav=options.flagav)
+                        out_utc = np.mean(out_utc.reshape(-1, dump_av), axis=-1)
+                        out_freqs = np.mean(out_freqs[:nchan * chan_av].reshape(-1, chan_av), axis=-1)
 
                         # Infer new time dimension from averaged data
                         tdiff = vis_data.shape[0]
-
-                    # Select correlator products and permute axes
-                    cp_index = cp_info.cp_index.reshape((nbl, npol))
-                    vis_data, weight_data, flag_data = permute_baselines(
-                        vis_data, weight_data, flag_data, cp_index,
-                        ms_vis_data[slot], ms_weight_data[slot], ms_flag_data[slot])
+                    else:
+                        vis_data, weight_data, flag_data = ms_async.permute_baselines(
+                            vis_data, weight_data, flag_data, cp_index,
+                            ms_vis_data[slot], ms_weight_data[slot], ms_flag_data[slot])
 
                     # Increment the number of averaged dumps
                     ntime_av += tdiff